@@ -0,0 +1,267 @@
+"""Client side scheduling of MediaWiki API requests.
+
+A `ScheduledSession` asks a shared `RequestScheduler` for permission before
+every request. The scheduler keeps to an average request rate, limits the
+number of requests in flight to each host and, when the server asks
+clients to back off, holds every request until the wait is over.
+"""
+
+import contextlib
+import email.utils
+import logging
+import threading
+import time
+
+from typing import Any
+from typing import Dict
+from typing import Iterator
+from typing import Mapping
+from typing import Optional
+from urllib.parse import urlsplit
+
+import requests
+
+from run_metrics import METRICS
+
+
+# Methods that are safe to repeat after a 429 or 503 response.
+IDEMPOTENT_METHODS = frozenset(["HEAD", "GET", "OPTIONS"])
+
+# Statuses that ask clients to slow down, usually with a Retry-After header.
+BACK_OFF_STATUSES = frozenset([429, 503])
+
+# How long to wait when the server asks us to back off without saying for
+# how long. MediaWiki suggests 5 seconds for maxlag errors.
+DEFAULT_RETRY_AFTER = 5.0
+
+MAX_RETRY_AFTER = 120.0
+
+
+class TokenBucket:
+    """Allow _rate_ calls to `acquire` per second on average, in bursts of up
+    to _burst_, across all threads."""
+
+    def __init__(self, rate: float, burst: int = 1) -> None:
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+
+    def reserve(self) -> float:
+        """Take a token without waiting for it, and return the number of
+        seconds to wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            # Tokens can go negative, which reserves a place in the queue.
+            self._tokens -= 1
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+
+class RequestScheduler:
+    """Decide when requests can be sent, shared by every thread and session
+    talking to the same wiki.
+
+    At most _rate_ requests per second are sent on average, in bursts of up
+    to _burst_, and at most _concurrency_ requests are in flight to any one
+    host. Either limit can be None for no limit. After `back_off` is
+    called, no requests are sent until the wait is over.
+
+    _maxlag_ is added to every request made through a ScheduledSession, so
+    that MediaWiki refuses requests while its database replicas are lagging
+    by more than that many seconds.
+    """
+
+    def __init__(
+        self,
+        *,
+        rate: Optional[float] = None,
+        burst: int = 1,
+        concurrency: Optional[int] = None,
+        maxlag: Optional[int] = None,
+    ) -> None:
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.concurrency = concurrency
+        self.maxlag = maxlag
+        self._hosts: Dict[str, threading.BoundedSemaphore] = {}
+        self._resume = 0.0
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def slot(self, url: str) -> Iterator[None]:
+        """Wait until a request to _url_ can be sent, then hold a place for it
+        until the context manager exits."""
+        semaphore = self._semaphore(urlsplit(url).netloc)
+        if semaphore:
+            semaphore.acquire()
+        try:
+            self._wait_for_resume()
+            if self.bucket:
+                self.bucket.acquire()
+            yield
+        finally:
+            if semaphore:
+                semaphore.release()
+
+    def back_off(self, seconds: float) -> None:
+        """Hold all requests for _seconds_."""
+        with self._lock:
+            resume = time.monotonic() + seconds
+            if resume > self._resume:
+                logging.warning("backing off for %.1f seconds", seconds)
+                self._resume = resume
+
+    def resume_delay(self) -> float:
+        """Return the number of seconds until requests can be sent again
+        after a `back_off`, or 0."""
+        with self._lock:
+            return max(0.0, self._resume - time.monotonic())
+
+    def _wait_for_resume(self) -> None:
+        while True:
+            delay = self.resume_delay()
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+    def _semaphore(self, host: str) -> Optional[threading.BoundedSemaphore]:
+        if not self.concurrency:
+            return None
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = threading.BoundedSemaphore(self.concurrency)
+            return self._hosts[host]
+
+
+class ScheduledSession(requests.Session):
+    """A requests.Session that sends every request through a shared
+    RequestScheduler.
+
+    Requests refused because of maxlag, and idempotent requests answered
+    with a 429 or 503 status, are retried up to _retries_ times. Other
+    requests from any thread sharing the scheduler wait for as long as the
+    Retry-After header asks.
+
+    Every response, and every retry, is recorded in `run_metrics.METRICS`.
+    """
+
+    def __init__(
+        self,
+        scheduler: Optional[RequestScheduler] = None,
+        *,
+        retries: int = 5,
+    ) -> None:
+        super().__init__()
+        self.scheduler = scheduler or RequestScheduler()
+        self.retries = retries
+
+    def request(  # type: ignore[override]
+        self,
+        method: str,
+        url: str,
+        *args: Any,
+        **kwargs: Any,
+    ) -> requests.Response:
+        if self.scheduler.maxlag is not None:
+            key = "data" if method.upper() == "POST" else "params"
+            kwargs[key] = {**(kwargs.get(key) or {}), "maxlag": self.scheduler.maxlag}
+
+        retries = 0
+        while True:
+            with self.scheduler.slot(url):
+                response = super().request(method, url, *args, **kwargs)
+            record_response(response, method, streamed=bool(kwargs.get("stream")))
+
+            delay = retry_delay(response.status_code, response.headers, method)
+            if delay is None or retries >= self.retries:
+                return response
+
+            retries += 1
+            reason = response.headers.get("MediaWiki-API-Error") or response.status_code
+            METRICS.inc("api_retries_total", reason=reason)
+            logging.debug("retry %d of %s after %s", retries, url, reason)
+            response.close()
+            self.scheduler.back_off(delay)
+
+
+def record_response(
+    response: requests.Response,
+    method: str,
+    *,
+    streamed: bool = False,
+) -> None:
+    """Record _response_ in METRICS, along with any retries urllib3 made
+    before getting it. The size of a _streamed_ response isn't known yet, so
+    whoever reads it must record `received_bytes` once it has."""
+    METRICS.response(
+        method,
+        response.status_code,
+        response.elapsed.total_seconds(),
+        None if streamed else received_bytes(response),
+    )
+
+    retries = getattr(response.raw, "retries", None)
+    for attempt in getattr(retries, "history", ()):
+        if attempt.redirect_location:
+            continue
+        reason = attempt.status or type(attempt.error).__name__
+        METRICS.inc("api_retries_total", reason=reason)
+
+
+def received_bytes(response: requests.Response) -> int:
+    """Return the number of bytes of _response_ read so far, as sent over the
+    network, before any content encoding is decoded."""
+    try:
+        return int(response.raw.tell())
+    except AttributeError:
+        return len(response.content)
+
+
+def retry_delay(
+    status: int,
+    headers: Mapping[str, str],
+    method: str,
+) -> Optional[float]:
+    """Return the number of seconds to wait before retrying a _method_ request
+    that got a response with _status_ and _headers_, or None if it shouldn't
+    be retried."""
+    if headers.get("MediaWiki-API-Error") == "maxlag":
+        # Nothing was done, so even an edit can be repeated.
+        pass
+    elif status in BACK_OFF_STATUSES and method.upper() in IDEMPOTENT_METHODS:
+        pass
+    else:
+        return None
+
+    delay = retry_after(headers)
+    if delay is None:
+        delay = DEFAULT_RETRY_AFTER
+    return min(MAX_RETRY_AFTER, delay)
+
+
+def retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """Return the number of seconds given by a Retry-After header, or None if
+    there isn't one."""
+    value = headers.get("Retry-After")
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
@@ -0,0 +1,213 @@
+"""Incremental decoding of MediaWiki API query responses.
+
+A `QueryStream` reads a response body a piece at a time and yields each
+entry of `query.pages` as soon as it has been decoded. Neither the whole
+body nor every page in it is held in memory at once. Everything else in
+the response, like `continue`, `warnings` and `errors`, is collected into
+`QueryStream.data` as usual.
+"""
+
+import codecs
+import json
+import re
+
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import Optional
+
+
+# Bytes to read from the response at a time.
+STREAM_CHUNK_SIZE = 64 * 1024
+
+RE_WHITESPACE = re.compile(r"[ \t\n\r]*")
+RE_STRUCTURE = re.compile(r'["{}\[\]]')
+# Characters up to the closing quote of a string, or the end of the buffer.
+RE_STRING_BODY = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*', re.DOTALL)
+RE_SCALAR_END = re.compile(r"[,:}\]\s]")
+
+
+class QueryStream:
+    """Decode a JSON API response from an iterable of byte _chunks_, such as
+    `requests.Response.iter_content()`.
+
+    Call `pages` to decode the response. Once it is exhausted, `data` holds
+    the rest of the response, without `query.pages`.
+    """
+
+    def __init__(self, chunks: Iterable[bytes]) -> None:
+        self.data: Dict[str, Any] = {}
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+
+    def pages(self) -> Iterator[Dict[str, Any]]:
+        """Generate pages from `query.pages`, which can be a list of pages
+        (formatversion=2) or an object keyed by page id."""
+        self._expect("{")
+        for key in self._members():
+            if key == "query":
+                query: Dict[str, Any] = {}
+                self._expect("{")
+                for query_key in self._members():
+                    if query_key == "pages":
+                        yield from self._pages()
+                    else:
+                        query[query_key] = self._value()
+                self.data["query"] = query
+            else:
+                self.data[key] = self._value()
+
+        if self._peek(required=False) is not None:
+            raise ValueError("extra data after JSON response")
+
+    def _pages(self) -> Iterator[Dict[str, Any]]:
+        if self._peek() == "[":
+            self._pos += 1
+            if self._peek() == "]":
+                self._pos += 1
+                return
+            while True:
+                yield self._value()
+                if self._separator("]"):
+                    return
+        else:
+            self._expect("{")
+            for _ in self._members():
+                yield self._value()
+
+    def _members(self) -> Iterator[str]:
+        """Generate the keys of an object whose opening brace has been
+        consumed. The caller must consume each member's value."""
+        if self._peek() == "}":
+            self._pos += 1
+            return
+        while True:
+            key = self._value()
+            if not isinstance(key, str):
+                raise ValueError(f"expected an object key, found {key!r}")
+            self._expect(":")
+            yield key
+            if self._separator("}"):
+                return
+
+    def _separator(self, close: str) -> bool:
+        """Consume a comma or _close_. Return True if it was _close_."""
+        char = self._peek()
+        self._pos += 1
+        if char == close:
+            return True
+        if char != ",":
+            raise ValueError(f"expected ',' or {close!r}, found {char!r}")
+        return False
+
+    def _expect(self, char: str) -> None:
+        found = self._peek()
+        if found != char:
+            raise ValueError(f"expected {char!r}, found {found!r}")
+        self._pos += 1
+
+    def _peek(self, required: bool = True) -> Optional[str]:
+        """Skip whitespace and return the next character without consuming
+        it."""
+        while True:
+            match = RE_WHITESPACE.match(self._buf, self._pos)
+            assert match
+            self._pos = match.end()
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                if required:
+                    raise ValueError("unexpected end of JSON response")
+                return None
+
+    def _value(self) -> Any:
+        """Decode the next complete JSON value."""
+        char = self._peek()
+
+        if char == '"':
+            end = self._string_end(1)
+        elif char is not None and char in "{[":
+            end = self._container_end()
+        else:
+            end = self._scalar_end()
+
+        text = self._buf[self._pos : self._pos + end]
+        self._pos += end
+        return json.loads(text)
+
+    def _string_end(self, offset: int) -> int:
+        """Return the offset, from the current position, just past the string
+        whose opening quote is before _offset_."""
+        while True:
+            match = RE_STRING_BODY.match(self._buf, self._pos + offset)
+            assert match
+            end = match.end()
+            if end < len(self._buf) and self._buf[end] == '"':
+                return end + 1 - self._pos
+
+            # The end of the buffer, maybe after an unfinished escape.
+            offset = end - self._pos
+            if not self._fill():
+                raise ValueError("unterminated string in JSON response")
+
+    def _container_end(self) -> int:
+        depth = 0
+        offset = 0
+        while True:
+            match = RE_STRUCTURE.search(self._buf, self._pos + offset)
+            if match is None:
+                offset = len(self._buf) - self._pos
+                if not self._fill():
+                    raise ValueError("unexpected end of JSON response")
+                continue
+
+            offset = match.end() - self._pos
+            char = match.group()
+            if char == '"':
+                offset = self._string_end(offset)
+            elif char is not None and char in "{[":
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return offset
+
+    def _scalar_end(self) -> int:
+        while True:
+            match = RE_SCALAR_END.search(self._buf, self._pos)
+            if match is not None:
+                return match.start() - self._pos
+            if not self._fill():
+                return len(self._buf) - self._pos
+
+    def _fill(self) -> bool:
+        """Read more of the response, dropping text before the current
+        position. Return False if there is nothing more to read.
+
+        At least as much text as is already buffered is read, so a value
+        spanning many chunks is copied a bounded number of times.
+        """
+        kept = self._buf[self._pos :]
+        parts = [kept]
+        size = 0
+
+        while not self._eof and (not size or size < len(kept)):
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self._eof = True
+                text = self._decoder.decode(b"", final=True)
+            else:
+                text = self._decoder.decode(chunk)
+            parts.append(text)
+            size += len(text)
+
+        if not size:
+            return False
+
+        self._buf = "".join(parts)
+        self._pos = 0
+        return True
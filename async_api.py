@@ -0,0 +1,623 @@
+"""An asyncio alternative to the requests based MediaWiki API layer.
+
+`AsyncSession` wraps an `aiohttp.ClientSession` with the same scheduling
+and retry behaviour as `find_bad_lang_tags.get_session`, and can share its
+`api_scheduler.RequestScheduler`. The query generators here are
+async iterator equivalents of those in `find_bad_lang_tags`, and share one
+pool of connections, so several continuation streams or reads can be in
+flight at once. Use `iterate` to consume any of them from synchronous code.
+
+Query logic, like following continuations and completing truncated
+responses, lives in the request generators of `find_bad_lang_tags`. This
+module only makes their requests.
+
+Needs aiohttp, which is an optional dependency.
+"""
+
+import asyncio
+import contextlib
+import json
+import logging
+import tempfile
+import threading
+import time
+
+from collections import deque
+from typing import Any
+from typing import AsyncGenerator
+from typing import AsyncIterator
+from typing import Awaitable
+from typing import Callable
+from typing import Coroutine
+from typing import Deque
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import TextIO
+from typing import Tuple
+from typing import TypeVar
+from urllib.parse import urlsplit
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover
+    aiohttp = None  # type: ignore
+
+from api_scheduler import RequestScheduler
+from api_scheduler import retry_delay
+from find_bad_lang_tags import MAX_IDS_PER_REQUEST
+from find_bad_lang_tags import PAGEIDS_QUERY
+from find_bad_lang_tags import REVIDS_QUERY
+from find_bad_lang_tags import AdaptiveChunkSize
+from find_bad_lang_tags import BatchContinuation
+from find_bad_lang_tags import RequestGenerator
+from find_bad_lang_tags import ap_params
+from find_bad_lang_tags import chunked
+from find_bad_lang_tags import cm_params
+from find_bad_lang_tags import page_requests
+from find_bad_lang_tags import prefetch
+from find_bad_lang_tags import title_shard_requests
+from run_metrics import METRICS
+
+T = TypeVar("T")
+
+# The same as the Retry strategy used by get_session. 429 and 503 responses,
+# and maxlag errors, are retried as ScheduledSession does.
+RETRY_TOTAL = 5
+RETRY_STATUSES = frozenset([500, 502, 504])
+RETRY_METHODS = frozenset(["HEAD", "GET", "OPTIONS"])
+BACKOFF_MAX = 120.0
+
+
+class AsyncSession:
+    """An aiohttp session that schedules and retries requests like the
+    `ScheduledSession` returned by `get_session` does.
+
+    Every request waits for the shared _scheduler_, keeping to its rate and
+    per host concurrency limits and to any back off, and has the
+    scheduler's maxlag added to it. Requests refused because of maxlag, and
+    GET, HEAD and OPTIONS requests answered with a 429 or 503 status, are
+    retried up to _total_ times after making every request sharing the
+    scheduler wait for as long as the Retry-After header asks.
+
+    GET, HEAD and OPTIONS requests are also retried up to _total_ times
+    after connection errors or a 500, 502 or 504 response, backing off
+    exponentially by _backoff_factor_. Like urllib3's default, a
+    _backoff_factor_ of 0 retries immediately.
+
+    Responses and retries are recorded in `run_metrics.METRICS`, with the
+    size of each response body after decompression.
+
+    Must be created and used inside a running event loop.
+    """
+
+    def __init__(
+        self,
+        scheduler: Optional[RequestScheduler] = None,
+        *,
+        pool_size: int = 10,
+        total: int = RETRY_TOTAL,
+        backoff_factor: float = 0.0,
+    ) -> None:
+        if aiohttp is None:
+            raise ImportError(
+                "the aiohttp backend needs aiohttp, install it with "
+                "'python -m pip install -r requirements-optional.txt'"
+            )
+
+        self.scheduler = scheduler or RequestScheduler()
+        self.total = total
+        self.backoff_factor = backoff_factor
+        self._hosts: Dict[str, asyncio.Semaphore] = {}
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=pool_size),
+            headers={"User-Agent": "Find bad lang tags bot"},
+        )
+
+    async def get_json(self, url: str, params: Dict[str, Any]) -> Any:
+        return await self.request_json("GET", url, params=params)
+
+    async def request_json(
+        self,
+        method: str,
+        url: str,
+        *,
+        params: Optional[Dict[str, Any]] = None,
+        data: Optional[Dict[str, Any]] = None,
+    ) -> Any:
+        """Make a request and return its decoded JSON body, raising
+        `aiohttp.ClientResponseError` for error responses."""
+        if self.scheduler.maxlag is not None:
+            if method.upper() == "POST":
+                data = {**(data or {}), "maxlag": self.scheduler.maxlag}
+            else:
+                params = {**(params or {}), "maxlag": self.scheduler.maxlag}
+
+        retries = 0
+        while True:
+            try:
+                async with self._slot(url):
+                    started = time.monotonic()
+                    async with self._session.request(
+                        method,
+                        url,
+                        params=_query_string(params),
+                        data=_query_string(data),
+                    ) as response:
+                        seconds = time.monotonic() - started
+                        body = await response.read()
+                        METRICS.response(method, response.status, seconds, len(body))
+                        delay = retry_delay(response.status, response.headers, method)
+                        if retries >= self.total or (
+                            delay is None
+                            and not (
+                                response.status in RETRY_STATUSES
+                                and method in RETRY_METHODS
+                            )
+                        ):
+                            response.raise_for_status()
+                            return json.loads(body)
+
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as err:
+                if method not in RETRY_METHODS or retries >= self.total:
+                    raise
+                METRICS.inc("api_retries_total", reason=type(err).__name__)
+                retries += 1
+                logging.debug("retry %d of %s after %s", retries, url, err)
+                await asyncio.sleep(self._backoff(retries))
+                continue
+
+            retries += 1
+            reason = response.headers.get("MediaWiki-API-Error") or response.status
+            METRICS.inc("api_retries_total", reason=reason)
+            logging.debug("retry %d of %s after %s", retries, url, reason)
+            if delay is None:
+                await asyncio.sleep(self._backoff(retries))
+            else:
+                self.scheduler.back_off(delay)
+
+    @contextlib.asynccontextmanager
+    async def _slot(self, url: str) -> AsyncIterator[None]:
+        """The asyncio equivalent of `RequestScheduler.slot`."""
+        semaphore = self._semaphore(urlsplit(url).netloc)
+        if semaphore:
+            await semaphore.acquire()
+        try:
+            while True:
+                delay = self.scheduler.resume_delay()
+                if delay <= 0:
+                    break
+                await asyncio.sleep(delay)
+            if self.scheduler.bucket:
+                delay = self.scheduler.bucket.reserve()
+                if delay:
+                    await asyncio.sleep(delay)
+            yield
+        finally:
+            if semaphore:
+                semaphore.release()
+
+    def _semaphore(self, host: str) -> Optional[asyncio.Semaphore]:
+        # Requests from threads sharing the scheduler aren't counted, the
+        # limit only applies to requests made on this session's event loop.
+        if not self.scheduler.concurrency:
+            return None
+        if host not in self._hosts:
+            self._hosts[host] = asyncio.Semaphore(self.scheduler.concurrency)
+        return self._hosts[host]
+
+    def _backoff(self, retries: int) -> float:
+        # urllib3 doesn't wait before the first retry.
+        if retries <= 1:
+            return 0.0
+        return min(BACKOFF_MAX, self.backoff_factor * (2 ** (retries - 1)))
+
+    async def close(self) -> None:
+        await self._session.close()
+
+    async def __aenter__(self) -> "AsyncSession":
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        await self.close()
+
+
+def _query_string(params: Optional[Dict[str, Any]]) -> Optional[Dict[str, str]]:
+    # requests drops parameters that are None, aiohttp rejects them.
+    if params is None:
+        return None
+    return {key: str(value) for key, value in params.items() if value is not None}
+
+
+async def run_requests(
+    session: AsyncSession,
+    generator: RequestGenerator[T],
+    *,
+    url: str,
+) -> T:
+    """Async equivalent of `find_bad_lang_tags.run_requests`."""
+    try:
+        params = next(generator)
+        while True:
+            params = generator.send(await session.get_json(url, params))
+    except StopIteration as done:
+        return done.value  # type: ignore[no-any-return]
+
+
+async def query_pages(
+    session: AsyncSession,
+    params: Dict[str, Any],
+    *,
+    url: str,
+    chunk_size: Optional[AdaptiveChunkSize] = None,
+) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """Make the requests for `find_bad_lang_tags.page_requests` with
+    _session_."""
+    return await run_requests(session, page_requests(params, chunk_size), url=url)
+
+
+async def query_batches(
+    session: AsyncSession,
+    params: Dict[str, Any],
+    *,
+    url: str,
+    continue_key: str,
+    limit: int,
+    limit_key: Optional[str] = None,
+    max_chunk_size: int = 500,
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """Async equivalent of `find_bad_lang_tags.query_batches`, without
+    checkpoints or streaming."""
+    batches = BatchContinuation(
+        params,
+        continue_key=continue_key,
+        limit=limit,
+        limit_key=limit_key,
+        max_chunk_size=max_chunk_size,
+    )
+
+    while not batches.done:
+        pages, _continue = await query_pages(
+            session,
+            batches.request(),
+            url=url,
+            chunk_size=batches.chunk_size,
+        )
+        batches.received(_continue, pages, len(pages))
+        yield pages
+
+
+async def cm_query(
+    session: AsyncSession,
+    category: str,
+    *,
+    url: str,
+    chunk_size: int = 20,
+    max_chunk_size: int = 500,
+    limit: int = 50,
+) -> AsyncIterator[Dict[str, Any]]:
+    async for batch in query_batches(
+        session,
+        cm_params(category, chunk_size),
+        url=url,
+        continue_key="gcmcontinue",
+        limit=limit,
+        limit_key="gcmlimit",
+        max_chunk_size=max_chunk_size,
+    ):
+        for page in batch:
+            yield page
+
+
+async def ap_query(
+    session: AsyncSession,
+    *,
+    url: str,
+    prefix: str = "",
+    namespace: int = 0,
+    chunk_size: int = 25,
+    max_chunk_size: int = 500,
+    limit: int = 200,
+    start: str = "",
+    end: str = "",
+) -> AsyncIterator[Dict[str, Any]]:
+    params = ap_params(
+        prefix=prefix,
+        namespace=namespace,
+        chunk_size=chunk_size,
+        start=start,
+        end=end,
+    )
+
+    async for batch in query_batches(
+        session,
+        params,
+        url=url,
+        continue_key="gapcontinue",
+        limit=limit,
+        limit_key="gaplimit",
+        max_chunk_size=max_chunk_size,
+    ):
+        for page in batch:
+            yield page
+
+
+async def sharded_ap_query(
+    session: AsyncSession,
+    *,
+    url: str,
+    prefix: str = "",
+    namespace: int = 0,
+    chunk_size: int = 25,
+    max_chunk_size: int = 500,
+    limit: int = 200,
+    shards: int = 4,
+) -> AsyncIterator[Dict[str, Any]]:
+    """Async equivalent of `find_bad_lang_tags.sharded_ap_query`.
+
+    Each shard's continuation loop runs as a task on the same event loop
+    and connection pool, spooling pages to a temporary file. Pages are
+    yielded shard by shard, in title order.
+    """
+    ranges = await run_requests(
+        session,
+        title_shard_requests(
+            prefix=prefix, namespace=namespace, shards=shards, limit=limit
+        ),
+        url=url,
+    )
+
+    if not ranges:
+        return
+
+    shard_limit = -(-limit // len(ranges))
+
+    async def _fetch(start: str, end: str) -> TextIO:
+        spool = tempfile.TemporaryFile("w+", encoding="utf-8")
+        try:
+            async for page in ap_query(
+                session,
+                url=url,
+                prefix=prefix,
+                namespace=namespace,
+                chunk_size=chunk_size,
+                max_chunk_size=max_chunk_size,
+                limit=shard_limit,
+                start=start,
+                end=end,
+            ):
+                spool.write(json.dumps(page))
+                spool.write("\n")
+        except BaseException:
+            spool.close()
+            raise
+        spool.seek(0)
+        logging.debug("shard %s..%s complete", start, end)
+        return spool
+
+    tasks = [asyncio.ensure_future(_fetch(start, end)) for start, end in ranges]
+    try:
+        for task in tasks:
+            with await task as spool:
+                for line in spool:
+                    yield json.loads(line)
+    finally:
+        # If the consumer stops early, cancel the shards that are still
+        # running and remove the spools of those that have finished.
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            if task.done() and not task.cancelled() and task.exception() is None:
+                task.result().close()
+
+
+async def _in_flight(
+    requests: Iterator[Awaitable[T]],
+    concurrency: int,
+) -> AsyncIterator[T]:
+    """Await coroutines from _requests_, keeping up to _concurrency_ of them
+    running at once, and yield their results in order."""
+    pending: Deque["asyncio.Future[T]"] = deque()
+    try:
+        for request in requests:
+            pending.append(asyncio.ensure_future(request))
+            if len(pending) >= concurrency:
+                yield await pending.popleft()
+        while pending:
+            yield await pending.popleft()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+async def ids_query(
+    session: AsyncSession,
+    params: Dict[str, Any],
+    ids: List[int],
+    *,
+    url: str,
+    ids_key: str,
+    chunk_size: int = 20,
+    concurrency: int = 4,
+) -> AsyncIterator[Dict[str, Any]]:
+    """Async equivalent of `find_bad_lang_tags.ids_query`, with up to
+    _concurrency_ requests in flight.
+
+    Chunks are planned up front, so their size doesn't adapt, but truncated
+    responses are still completed by following their continuation.
+    """
+    requests = (
+        query_pages(
+            session,
+            {**params, ids_key: "|".join(str(_id) for _id in chunk)},
+            url=url,
+        )
+        for chunk in chunked(ids, min(chunk_size, MAX_IDS_PER_REQUEST))
+    )
+
+    async for pages, _ in _in_flight(requests, concurrency):
+        for page in pages:
+            yield page
+
+
+async def revids_query(
+    session: AsyncSession,
+    revids: List[int],
+    *,
+    url: str,
+    chunk_size: int = 50,
+    concurrency: int = 4,
+) -> AsyncIterator[Dict[str, Any]]:
+    """Async equivalent of `find_bad_lang_tags.revids_query`, with up to
+    _concurrency_ requests in flight."""
+    async for page in ids_query(
+        session,
+        REVIDS_QUERY,
+        revids,
+        url=url,
+        ids_key="revids",
+        chunk_size=chunk_size,
+        concurrency=concurrency,
+    ):
+        yield page
+
+
+async def pageids_query(
+    session: AsyncSession,
+    pageids: List[int],
+    *,
+    url: str,
+    chunk_size: int = 20,
+    category: Optional[str] = None,
+    concurrency: int = 4,
+) -> AsyncIterator[Dict[str, Any]]:
+    """Async equivalent of `find_bad_lang_tags.pageids_query`, without a
+    cache, with up to _concurrency_ requests in flight."""
+    params: Dict[str, Any] = {**PAGEIDS_QUERY}
+    if category:
+        params["prop"] = "revisions|categories"
+        params["clcategories"] = category
+
+    async for page in ids_query(
+        session,
+        params,
+        pageids,
+        url=url,
+        ids_key="pageids",
+        chunk_size=chunk_size,
+        concurrency=concurrency,
+    ):
+        if page.get("missing") or page.get("invalid"):
+            continue
+        if category and not page.get("categories"):
+            continue
+        yield page
+
+
+class BackgroundSession:
+    """An AsyncSession running on an event loop in a background thread, so
+    that synchronous code on any number of threads can share its connection
+    pool, with requests from different threads in flight at once.
+
+    Call `close` when done, or use it as a context manager.
+    """
+
+    def __init__(
+        self,
+        scheduler: Optional[RequestScheduler] = None,
+        *,
+        pool_size: int = 10,
+    ) -> None:
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        self.session = self.run(_open_session(scheduler, pool_size))
+
+    def run(self, coroutine: Coroutine[Any, Any, T]) -> T:
+        """Run _coroutine_ on the event loop and wait for its result."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def pageids_query(
+        self,
+        pageids: List[int],
+        *,
+        url: str,
+        **kwargs: Any,
+    ) -> List[Dict[str, Any]]:
+        """Return the pages from `pageids_query`."""
+
+        async def _pages() -> List[Dict[str, Any]]:
+            return [
+                page
+                async for page in pageids_query(
+                    self.session, pageids, url=url, **kwargs
+                )
+            ]
+
+        return self.run(_pages())
+
+    def close(self) -> None:
+        self.run(self.session.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def __enter__(self) -> "BackgroundSession":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+
+async def _open_session(
+    scheduler: Optional[RequestScheduler],
+    pool_size: int,
+) -> AsyncSession:
+    # aiohttp sessions must be created on the loop they are used on.
+    return AsyncSession(scheduler, pool_size=pool_size)
+
+
+def iterate(
+    factory: Callable[[AsyncSession], AsyncIterator[T]],
+    *,
+    prefetch_depth: int = 2,
+    scheduler: Optional[RequestScheduler] = None,
+    pool_size: int = 10,
+) -> Iterator[T]:
+    """Yield items from the async iterator returned by _factory_, which is
+    given a new AsyncSession using _scheduler_.
+
+    The event loop runs on a background thread, keeping up to
+    _prefetch_depth_ items ready, so that requests keep going while the
+    caller processes items.
+    """
+
+    async def _items() -> AsyncGenerator[T, None]:
+        async with AsyncSession(scheduler, pool_size=pool_size) as session:
+            items = factory(session)
+            try:
+                async for item in items:
+                    yield item
+            finally:
+                # Let async generators clean up if the caller stops early.
+                aclose = getattr(items, "aclose", None)
+                if aclose is not None:
+                    await aclose()
+
+    def _run() -> Iterator[T]:
+        loop = asyncio.new_event_loop()
+        items = _items()
+        try:
+            while True:
+                try:
+                    yield loop.run_until_complete(items.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            loop.run_until_complete(items.aclose())
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.close()
+
+    return prefetch(_run(), max(prefetch_depth, 1))
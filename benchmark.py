@@ -0,0 +1,456 @@
+"""Benchmark find_bad_lang_tags and to_csv on synthetic and recorded wikitext.
+
+Scanning and CSV writing are timed separately. Results can be saved as a
+baseline and later runs compared against it, exiting with a non-zero status
+if any benchmark has slowed down by more than the given tolerance.
+
+With --check-engines, every corpus is also scanned with each of the scanner's
+matching engines, exiting with a non-zero status if their output differs.
+
+With --memory, the memory needed to hold every tag found in each corpus is
+reported for each result representation instead.
+"""
+
+import io
+import json
+import random
+import sys
+import time
+import tracemalloc
+
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from find_bad_lang_tags import ENGINES
+from find_bad_lang_tags import BadLangTag
+from find_bad_lang_tags import TagBatch
+from find_bad_lang_tags import find_bad_lang_tags
+from find_bad_lang_tags import to_csv
+
+from mediawiki_dump import dump_query
+
+LANGS = ["python", "c", "haskell", "perl", "j", "rexx", "bogus", "Python", "C++"]
+
+
+def small_pages(rng: random.Random, count: int = 2000) -> List[str]:
+    """Short pages with a handful of tags, like most talk and user pages."""
+    pages = []
+    for _ in range(count):
+        parts = ["Some discussion about the task.\n\n"]
+        for _ in range(rng.randint(0, 4)):
+            lang = rng.choice(LANGS)
+            parts.append(
+                rng.choice(["<lang %s>", '<syntaxhighlight lang="%s">']) % lang
+            )
+            parts.append("\nprint('hello')\n")
+            parts.append(rng.choice(["</lang>", "</syntaxhighlight>"]))
+            parts.append("\n\n--~~~~\n")
+        pages.append("".join(parts))
+    return pages
+
+
+def huge_pages(rng: random.Random, count: int = 4, blocks: int = 1500) -> List[str]:
+    """Big task pages with one solution block per language."""
+    pages = []
+    for _ in range(count):
+        parts = ["{{task}}\nDo the thing.\n\n"]
+        for i in range(blocks):
+            lang = rng.choice(LANGS)
+            parts.append(f"=={{{{header|Lang{i}}}}}==\n")
+            if rng.random() < 0.5:
+                parts.append(f"<lang {lang}>\n")
+                parts.append("x = a < b > c\n" * rng.randint(1, 20))
+                parts.append("</lang>\n")
+            else:
+                parts.append(f'<syntaxhighlight lang="{lang}">\n')
+                parts.append("x = a < b > c\n" * rng.randint(1, 20))
+                parts.append("</syntaxhighlight>\n")
+            parts.append("{{out}}\n<pre>\nok\n</pre>\n\n")
+        pages.append("".join(parts))
+    return pages
+
+
+def unterminated_pages(rng: random.Random, count: int = 4, tags: int = 50) -> List[str]:
+    """Pages full of start tags without matching end tags, which make lazy
+    patterns scan to the end of the page from every start tag."""
+    pages = []
+    for _ in range(count):
+        parts = []
+        for _ in range(tags):
+            lang = rng.choice(LANGS)
+            parts.append(
+                rng.choice(
+                    [
+                        f'<syntaxhighlight lang="{lang}">\n',
+                        f"<syntaxhighlight lang={lang}>\n",
+                        "<syntaxhighlight line>\n",
+                        f"<lang {lang}>\n",
+                    ]
+                )
+            )
+            parts.append("int main() { return a < b; }\n" * rng.randint(1, 10))
+        pages.append("".join(parts))
+    return pages
+
+
+def skip_region_pages(rng: random.Random, count: int = 200) -> List[str]:
+    """Pages with many nowiki, comment, pre and code regions."""
+    pages = []
+    for _ in range(count):
+        parts = []
+        for _ in range(rng.randint(50, 150)):
+            lang = rng.choice(LANGS)
+            parts.append(
+                rng.choice(
+                    [
+                        f"<nowiki><lang {lang}></nowiki> text\n",
+                        f"<!-- <syntaxhighlight lang={lang}> -->\n",
+                        "<pre>\nsome output\n</pre>\n",
+                        f"Use <code><lang {lang}></code> here.\n",
+                        f"<lang {lang}>x</lang>\n",
+                    ]
+                )
+            )
+        pages.append("".join(parts))
+    return pages
+
+
+SYNTHETIC: Dict[str, Callable[[random.Random], List[str]]] = {
+    "small": small_pages,
+    "huge": huge_pages,
+    "unterminated": unterminated_pages,
+    "skip_regions": skip_region_pages,
+}
+
+
+def recorded_pages(path: str, limit: Optional[int] = None) -> List[str]:
+    """Page content from a MediaWiki XML dump."""
+    return [
+        page["revisions"][0]["slots"]["main"]["content"]
+        for page in dump_query(path, limit=limit)
+    ]
+
+
+def _best(func: Callable[[], Any], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench(
+    texts: List[str],
+    *,
+    repeat: int = 3,
+    skip_unsupported_langs: bool = False,
+    engine: str = "tokens",
+) -> Dict[str, float]:
+    """Time scanning and CSV writing of _texts_, returning throughput figures
+    for each."""
+    scanned: List[List[BadLangTag]] = []
+
+    def _scan() -> None:
+        scanned.clear()
+        for text in texts:
+            scanned.append(
+                list(find_bad_lang_tags(text, skip_unsupported_langs, engine))
+            )
+
+    def _write() -> None:
+        to_csv(zip(pages, scanned), out_file=io.StringIO())
+
+    pages = [
+        {
+            "pageid": i,
+            "title": f"Page {i}",
+            "revisions": [{"revid": i, "timestamp": "2000-01-01T00:00:00Z"}],
+        }
+        for i in range(len(texts))
+    ]
+
+    megabytes = sum(len(text.encode("utf-8")) for text in texts) / (1024 * 1024)
+    scan_seconds = _best(_scan, repeat)
+    csv_seconds = _best(_write, repeat)
+
+    return {
+        "pages": len(texts),
+        "megabytes": round(megabytes, 3),
+        "tags": sum(len(tags) for tags in scanned),
+        "scan_seconds": scan_seconds,
+        "scan_pages_per_second": len(texts) / scan_seconds,
+        "scan_mb_per_second": megabytes / scan_seconds,
+        "csv_seconds": csv_seconds,
+        "csv_pages_per_second": len(texts) / csv_seconds,
+        "csv_mb_per_second": megabytes / csv_seconds,
+    }
+
+
+def check_engines(texts: List[str]) -> List[int]:
+    """Return the indexes of _texts_ for which any two engines find different
+    tags."""
+    mismatches = []
+    for i, text in enumerate(texts):
+        outputs = [
+            [tag.as_tuple() for tag in find_bad_lang_tags(text, engine=engine)]
+            for engine in ENGINES
+        ]
+        if any(output != outputs[0] for output in outputs[1:]):
+            mismatches.append(i)
+    return mismatches
+
+
+class DictLangTagMatch:
+    """LangTagMatch as it was before it had slots, for comparison."""
+
+    def __init__(self, text: str, start: int, end: int, lineno: int) -> None:
+        self.text = text
+        self.start = start
+        self.end = end
+        self.lineno = lineno
+
+
+class DictBadLangTag:
+    """BadLangTag as it was before it had slots, for comparison."""
+
+    def __init__(
+        self,
+        lang: Optional[str],
+        tag: str,
+        start: DictLangTagMatch,
+        end: Optional[DictLangTagMatch],
+        kind: str,
+    ):
+        self.lang = lang
+        self.tag = tag
+        self.start = start
+        self.end = end
+        self.kind = kind
+
+
+def _dict_tags(text: str) -> List[DictBadLangTag]:
+    return [
+        DictBadLangTag(
+            lang=tag.lang,
+            tag=tag.tag,
+            start=DictLangTagMatch(
+                tag.start.text, tag.start.start, tag.start.end, tag.start.lineno
+            ),
+            end=(
+                None
+                if tag.end is None
+                else DictLangTagMatch(
+                    tag.end.text, tag.end.start, tag.end.end, tag.end.lineno
+                )
+            ),
+            kind=tag.kind,
+        )
+        for tag in find_bad_lang_tags(text)
+    ]
+
+
+def _batch(texts: List[str]) -> TagBatch:
+    batch = TagBatch()
+    for i, text in enumerate(texts):
+        batch.extend(i, find_bad_lang_tags(text))
+    return batch
+
+
+REPRESENTATIONS: Dict[str, Callable[[List[str]], Any]] = {
+    "dict": lambda texts: [_dict_tags(text) for text in texts],
+    "slots": lambda texts: [list(find_bad_lang_tags(text)) for text in texts],
+    "slots_lazy": lambda texts: [
+        list(find_bad_lang_tags(text, lazy_text=True)) for text in texts
+    ],
+    "batch": _batch,
+}
+
+
+def _retained(func: Callable[[], Any]) -> int:
+    """Return the number of bytes allocated by _func_ that are still in use
+    while its return value is alive."""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = func()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del result
+    return after - before
+
+
+def memory(texts: List[str]) -> Dict[str, float]:
+    """Return bytes per tag needed to hold every tag found in _texts_, for
+    each result representation. Page text is not counted."""
+    tag_count = sum(1 for text in texts for _ in find_bad_lang_tags(text))
+    return {
+        name: _retained(lambda: build(texts)) / max(tag_count, 1)
+        for name, build in REPRESENTATIONS.items()
+    }
+
+
+def report_memory(results: Dict[str, Dict[str, float]]) -> None:
+    print(f"{'bytes/tag':<14}" + "".join(f"{name:>12}" for name in REPRESENTATIONS))
+    for name, r in results.items():
+        print(f"{name:<14}" + "".join(f"{r[key]:>12.1f}" for key in REPRESENTATIONS))
+
+
+def compare(
+    results: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]],
+    tolerance: float,
+) -> List[str]:
+    """Return a description of each benchmark that is slower than _baseline_
+    by more than _tolerance_, a fraction."""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for key in ("scan_seconds", "csv_seconds"):
+            limit = baseline[name][key] * (1 + tolerance)
+            if result[key] > limit:
+                regressions.append(
+                    f"{name} {key}: {result[key]:.4f}s, "
+                    f"baseline {baseline[name][key]:.4f}s"
+                )
+    return regressions
+
+
+def report(results: Dict[str, Dict[str, float]]) -> None:
+    print(
+        f"{'corpus':<14}{'pages':>7}{'MB':>9}{'tags':>8}"
+        f"{'scan p/s':>12}{'scan MB/s':>11}{'csv p/s':>12}{'csv MB/s':>10}"
+    )
+    for name, r in results.items():
+        print(
+            f"{name:<14}{r['pages']:>7}{r['megabytes']:>9.2f}{r['tags']:>8}"
+            f"{r['scan_pages_per_second']:>12.1f}{r['scan_mb_per_second']:>11.2f}"
+            f"{r['csv_pages_per_second']:>12.1f}{r['csv_mb_per_second']:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+
+    parser.add_argument(
+        "--corpus",
+        action="append",
+        choices=sorted(SYNTHETIC),
+        help="synthetic corpus to benchmark, may be repeated (default: all)",
+    )
+
+    parser.add_argument(
+        "--dump",
+        help="also benchmark pages recorded in a MediaWiki XML dump",
+    )
+
+    parser.add_argument(
+        "--dump-limit",
+        type=int,
+        default=None,
+        dest="dump_limit",
+        help="maximum number of pages to read from --dump (default: all)",
+    )
+
+    parser.add_argument(
+        "--engine",
+        choices=sorted(ENGINES),
+        default="tokens",
+        help="tag matching engine to benchmark (default: tokens)",
+    )
+
+    parser.add_argument(
+        "--check-engines",
+        action="store_true",
+        dest="check_engines",
+        help="check that all engines find the same tags in every corpus",
+    )
+
+    parser.add_argument(
+        "--memory",
+        action="store_true",
+        help="report memory used by each result representation and exit",
+    )
+
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="time each benchmark this many times and keep the best (default: 3)",
+    )
+
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=42,
+        help="random seed for synthetic corpora (default: 42)",
+    )
+
+    parser.add_argument(
+        "--save-baseline",
+        dest="save_baseline",
+        help="write results to this JSON file",
+    )
+
+    parser.add_argument(
+        "--baseline",
+        help="compare results with a JSON file written by --save-baseline",
+    )
+
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="allowed slowdown compared to --baseline, as a fraction (default: 0.2)",
+    )
+
+    args = parser.parse_args()
+
+    corpora: Dict[str, List[str]] = {
+        name: SYNTHETIC[name](random.Random(args.seed))
+        for name in args.corpus or SYNTHETIC
+    }
+
+    if args.dump:
+        corpora["recorded"] = recorded_pages(args.dump, args.dump_limit)
+
+    if args.check_engines:
+        failed = False
+        for name, texts in corpora.items():
+            for i in check_engines(texts):
+                print(f"MISMATCH {name} page {i}", file=sys.stderr)
+                failed = True
+        if failed:
+            sys.exit(1)
+
+    if args.memory:
+        report_memory({name: memory(texts) for name, texts in corpora.items()})
+        sys.exit()
+
+    results = {
+        name: bench(texts, repeat=args.repeat, engine=args.engine)
+        for name, texts in corpora.items()
+    }
+
+    report(results)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as fd:
+            json.dump(results, fd, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as fd:
+            regressions = compare(results, json.load(fd), args.tolerance)
+
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,151 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from collections import deque
+from typing import Any
+from typing import Deque
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import TextIO
+from typing import Tuple
+
+
+class CheckpointMismatchError(Exception):
+    """Exception raised when resuming from a checkpoint saved by a different
+    scan."""
+
+
+class Checkpoint:
+    """Progress through a long API query, saved to a JSON file at _path_ so an
+    interrupted scan can carry on where it left off.
+
+    The query calls `batch` with the continuation parameters that follow
+    each batch of pages, possibly on another thread. The output side calls
+    `written` for every page it writes. Once the last page of a batch has
+    been written, and at most every _interval_ seconds, the writer and
+    _out_file_ are flushed and the continuation, page count and output file
+    offset are saved together.
+
+    _target_ describes the scan. A checkpoint saved for a different target
+    can't be resumed.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        target: Dict[str, Any],
+        interval: float = 30.0,
+    ) -> None:
+        self.path = path
+        self.target = target
+        self.interval = interval
+        self.out_file: Optional[TextIO] = None
+        self.started = ""
+
+        # Where the resumed query starts. None means from the beginning,
+        # unless `done` is True.
+        self.continue_params: Optional[Dict[str, Any]] = None
+        self.page_count = 0
+        self.offset: Optional[int] = None
+        self.done = False
+
+        # (last page id, continuation or None, page count) for each batch
+        # that has been queried but not yet written.
+        self._pending: Deque[Tuple[Any, Optional[Dict[str, Any]], int]] = deque()
+        self._lock = threading.Lock()
+        self._saved = time.monotonic()
+
+    def load(self) -> bool:
+        """Read the saved checkpoint, if there is one. Return True if the scan
+        should be resumed."""
+        try:
+            with open(self.path, encoding="utf-8") as fd:
+                state = json.load(fd)
+        except FileNotFoundError:
+            return False
+
+        if state["target"] != self.target:
+            raise CheckpointMismatchError(
+                f"{self.path} was saved by a different scan: {state['target']}"
+            )
+
+        self.continue_params = state["continue"]
+        self.done = state["continue"] is None
+        self.page_count = state["page_count"]
+        self.offset = state["offset"]
+        self.started = state["started"]
+        logging.info(
+            "resuming after %d pages from %s", self.page_count, self.continue_params
+        )
+        return True
+
+    def batch(
+        self,
+        pages: List[Dict[str, Any]],
+        continue_params: Optional[Dict[str, Any]],
+        page_count: int,
+    ) -> None:
+        """Record that _pages_ have been queried, and that the query carries
+        on from _continue_params_, or is finished if that is None."""
+        with self._lock:
+            if pages:
+                self._pending.append(
+                    (pages[-1]["pageid"], continue_params, page_count)
+                )
+            elif self._pending:
+                # Nothing to wait for, so move the previous checkpoint on.
+                pageid, _, _ = self._pending.pop()
+                self._pending.append((pageid, continue_params, page_count))
+
+    def written(self, page: Dict[str, Any], writer: Any) -> None:
+        """Record that _page_ has been given to _writer_."""
+        with self._lock:
+            if not self._pending or self._pending[0][0] != page["pageid"]:
+                return
+            _, continue_params, page_count = self._pending.popleft()
+
+        if time.monotonic() - self._saved < self.interval:
+            return
+
+        writer.flush()
+        self.save(continue_params, page_count)
+
+    def save(self, continue_params: Optional[Dict[str, Any]], page_count: int) -> None:
+        offset = None
+        if self.out_file is not None:
+            self.out_file.flush()
+            offset = self.out_file.tell()
+
+        state = {
+            "target": self.target,
+            "continue": continue_params,
+            "page_count": page_count,
+            "offset": offset,
+            "started": self.started,
+        }
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        with tempfile.NamedTemporaryFile(
+            "w",
+            dir=directory,
+            delete=False,
+            encoding="utf-8",
+        ) as fd:
+            json.dump(state, fd)
+        os.replace(fd.name, self.path)
+
+        self._saved = time.monotonic()
+        logging.debug("checkpoint after %d pages", page_count)
+
+    def remove(self) -> None:
+        """Delete the saved checkpoint, once the scan has finished."""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
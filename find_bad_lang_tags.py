@@ -1,30 +1,148 @@
+import contextlib
 import csv
+import hashlib
+import importlib.metadata
+import importlib.util
 import itertools
 import json
 import logging
+import os
 import re
 import sys
-
+import tempfile
+import threading
+import time
+
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from queue import Full
+from queue import Queue
 from typing import Any
+from typing import Callable
+from typing import Deque
 from typing import Dict
+from typing import FrozenSet
+from typing import Generator
+from typing import List
 from typing import TextIO
 from typing import Iterable
+from typing import Iterator
 from typing import Optional
+from typing import Set
 from typing import Tuple
+from typing import TypeVar
 
 import requests
 from requests.adapters import HTTPAdapter
 from requests.adapters import Retry
 
-from pygments import lexers
-
+from api_scheduler import RequestScheduler
+from api_scheduler import ScheduledSession
+from api_scheduler import received_bytes
+from api_stream import STREAM_CHUNK_SIZE
+from api_stream import QueryStream
+from checkpoint import Checkpoint
+from checkpoint import CheckpointMismatchError
+from mediawiki_dump import dump_query
+from revision_cache import ResultCache
+from revision_cache import RevisionCache
+from run_metrics import METRICS
+from run_metrics import METRICS_FORMATS
+from run_metrics import ProgressReporter
+from run_metrics import write_metrics
+from scan_profile import KindTimes
+from scan_profile import ScanProfile
+from scan_profile import timed_matches
+from tag_scanner import ScanStats
+from tag_scanner import scan_tags
+from tag_scanner import tag_window
+from tag_writers import PAGE_FIELDS
+from tag_writers import TAG_FIELDS
+from tag_writers import CSVWriter
+from tag_writers import JSONLinesWriter
+from tag_writers import PageRow
+from tag_writers import SQLiteWriter
+from tag_writers import TagRow
+from tag_writers import TagWriter
+from tag_writers import columnar_writer
+
+
+T = TypeVar("T")
+
+# A BadLangTag flattened to (lang, tag, kind, start_text, start_start,
+# start_end, start_lineno, end_text, end_start, end_end, end_lineno).
+TagTuple = Tuple[Any, ...]
+
+
+_ALL_LEXERS: Optional[FrozenSet[str]] = None
+
+
+def all_lexers() -> FrozenSet[str]:
+    """Return the set of all Pygments lexer aliases.
+
+    Importing Pygments' lexer mapping and plugins is slow, so the set is
+    built on first use and saved to a small file keyed by the installed
+    Pygments version. Later runs read that file instead of importing
+    Pygments.
+    """
+    global _ALL_LEXERS  # pylint: disable=global-statement
+    if _ALL_LEXERS is not None:
+        return _ALL_LEXERS
+
+    path = lexer_aliases_path()
+
+    try:
+        with open(path, encoding="utf-8") as fd:
+            _ALL_LEXERS = frozenset(json.load(fd))
+            return _ALL_LEXERS
+    except (OSError, ValueError):
+        pass
+
+    from pygments import lexers  # pylint: disable=import-outside-toplevel
+
+    _ALL_LEXERS = frozenset(
+        itertools.chain.from_iterable(lexer[1] for lexer in lexers.get_all_lexers())
+    )
 
-logging.basicConfig(level=logging.DEBUG)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            "w",
+            dir=os.path.dirname(path),
+            delete=False,
+            encoding="utf-8",
+        ) as tmp:
+            json.dump(sorted(_ALL_LEXERS), tmp)
+        os.replace(tmp.name, path)
+    except OSError as err:
+        logging.debug("can't save lexer aliases to %s: %s", path, err)
+
+    return _ALL_LEXERS
+
+
+def lexer_aliases_path() -> str:
+    """Return the path of the saved lexer alias set for the installed
+    version of Pygments."""
+    cache_dir = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(
+        cache_dir,
+        "bad-lang-tags",
+        f"pygments-{importlib.metadata.version('pygments')}-lexers.json",
+    )
 
 
-ALL_LEXERS = set(
-    itertools.chain.from_iterable(lexer[1] for lexer in lexers.get_all_lexers())
-)
+def __getattr__(name: str) -> Any:
+    # ALL_LEXERS used to be a module level set.
+    if name == "ALL_LEXERS":
+        return all_lexers()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 AP_QUERY: Dict[str, Any] = {
@@ -38,6 +156,83 @@ AP_QUERY: Dict[str, Any] = {
     "rvslots": "main",
 }
 
+REVIDS_QUERY: Dict[str, Any] = {
+    "action": "query",
+    "format": "json",
+    "formatversion": "2",
+    "prop": "revisions",
+    "rvprop": "content|timestamp|ids",
+    "rvslots": "main",
+}
+
+# Revision properties to request when content will come from a local cache.
+METADATA_ONLY: Dict[str, Any] = {
+    "rvprop": "timestamp|ids",
+    "rvslots": None,
+}
+
+PAGEIDS_QUERY: Dict[str, Any] = {
+    "action": "query",
+    "format": "json",
+    "formatversion": "2",
+    "prop": "revisions",
+    "rvprop": "content|timestamp|ids",
+    "rvslots": "main",
+}
+
+RC_QUERY: Dict[str, Any] = {
+    "action": "query",
+    "list": "recentchanges",
+    "rctype": "edit|new",
+    "rcprop": "ids|title|timestamp",
+    "rclimit": "max",
+    "curtimestamp": "true",
+    "format": "json",
+    "formatversion": "2",
+}
+
+DELETE_LOG_QUERY: Dict[str, Any] = {
+    "action": "query",
+    "list": "logevents",
+    "leaction": "delete/delete",
+    "leprop": "ids|title",
+    "lelimit": "max",
+    "format": "json",
+    "formatversion": "2",
+}
+
+AP_TITLES_QUERY: Dict[str, Any] = {
+    "action": "query",
+    "list": "allpages",
+    "apfilterredir": "nonredirects",
+    "aplimit": "max",
+    "format": "json",
+    "formatversion": "2",
+}
+
+# The most titles a `list=allpages` request returns for clients without the
+# apihighlimits right.
+AP_TITLES_LIMIT = 500
+
+SEARCH_QUERY: Dict[str, Any] = {
+    "action": "query",
+    "list": "search",
+    "srwhat": "text",
+    "srprop": "",
+    "srinfo": "totalhits",
+    "srlimit": "max",
+    "format": "json",
+    "formatversion": "2",
+}
+
+# CirrusSearch queries that, between them, match every page with a bad tag.
+# Each regex is paired with a plain insource term, which is cheap to look up
+# in the search index, to narrow down the pages the regex is run against.
+SEARCH_QUERIES = (
+    r"insource:lang insource:/\<\/?lang/i",
+    r"insource:syntaxhighlight insource:/\<\/?syntaxhighlight/i",
+)
+
 CM_QUERY: Dict[str, Any] = {
     "action": "query",
     "generator": "categorymembers",
@@ -106,131 +301,1103 @@ RE_BAD_LANG = re.compile(
     re.DOTALL | re.IGNORECASE,
 )
 
+RE_NEWLINE = re.compile(r"\n")
 
-def cm_query(
+# Functions that generate RE_BAD_LANG matches from wiki text, starting at a
+# given index. "tokens" gives the same matches as "regex" in linear time,
+# but must be kept in step with RE_SPEC, which tests/test_tag_scanner.py
+# checks. "regex" is kept as a reference.
+ENGINES: Dict[str, Callable[[str, int], Iterable[Any]]] = {
+    "tokens": scan_tags,
+    "regex": RE_BAD_LANG.finditer,
+}
+
+# Work done by each stage of `find_bad_lang_tags` in this process.
+SCAN_STATS = ScanStats()
+
+# Bump this when a change to find_bad_lang_tags affects its output without
+# changing RE_SPEC, so that cached results are invalidated.
+SCANNER_VERSION = "1"
+
+
+# MediaWiki accepts at most this many ids per request, unless the user has
+# the apihighlimits right.
+MAX_IDS_PER_REQUEST = 50
+
+
+class AdaptiveChunkSize:
+    """The number of pages to ask for in the next request.
+
+    After a truncated response, the size drops to the number of pages the
+    server returned in full. After each complete response it grows by a
+    quarter, up to _maximum_, but stays below the smallest size that was
+    truncated until a run of complete responses suggests pages have got
+    smaller.
+    """
+
+    # Complete responses needed before trying a size that was truncated.
+    PATIENCE = 10
+
+    def __init__(self, size: int, maximum: int = 500) -> None:
+        self.maximum = max(1, maximum)
+        self.size = max(1, min(size, self.maximum))
+        self._ceiling = self.maximum + 1
+        self._complete = 0
+
+    def truncated(self, accepted: int) -> None:
+        self._ceiling = min(self._ceiling, self.size)
+        self._complete = 0
+        size = max(1, min(accepted, self.size - 1))
+        if size != self.size:
+            logging.debug("reducing chunk size from %d to %d", self.size, size)
+        self.size = size
+
+    def complete(self) -> None:
+        self._complete += 1
+        if self._complete >= self.PATIENCE:
+            self._ceiling = self.maximum + 1
+            self._complete = 0
+        size = min(self.size + max(1, self.size // 4), self._ceiling - 1, self.maximum)
+        if size > self.size:
+            logging.debug("increasing chunk size from %d to %d", self.size, size)
+            self.size = size
+
+
+def merge_pages(pages: Dict[Any, Dict[str, Any]], data: Any) -> int:
+    """Add pages from an API response to _pages_, filling in revisions for
+    pages that were seen without them. Return the number of pages that
+    gained revisions."""
+    filled = 0
+    for page in data.get("query", {}).get("pages", []):
+        key = page.get("pageid", page.get("title"))
+        known = pages.get(key)
+        if known is None:
+            pages[key] = page
+            filled += bool(page.get("revisions"))
+        elif not known.get("revisions") and page.get("revisions"):
+            known["revisions"] = page["revisions"]
+            filled += 1
+    return filled
+
+
+def incomplete(page: Dict[str, Any]) -> bool:
+    return not (page.get("revisions") or page.get("missing") or page.get("invalid"))
+
+
+# A generator that yields the parameters of each API request it needs, is
+# sent each decoded response, and returns a result. Request generators hold
+# the query logic shared by the requests and aiohttp backends, which only
+# differ in how requests are made.
+RequestGenerator = Generator[Dict[str, Any], Any, T]
+
+
+def run_requests(
     session: requests.Session,
-    category: str,
+    generator: RequestGenerator[T],
+    *,
+    url: str,
+) -> T:
+    """Make the GET requests asked for by a request _generator_, and return
+    its result."""
+    try:
+        params = next(generator)
+        while True:
+            response = session.get(url, params=params)
+            response.raise_for_status()
+            params = generator.send(response.json())
+    except StopIteration as done:
+        return done.value  # type: ignore[no-any-return]
+
+
+def page_requests(
+    params: Dict[str, Any],
+    chunk_size: Optional[AdaptiveChunkSize] = None,
+) -> RequestGenerator[Tuple[List[Dict[str, Any]], Dict[str, Any]]]:
+    """Make a query for pages with revisions, and return its pages and its
+    `continue` object.
+
+    If the response was truncated, because it would have been too big, the
+    revisions continuation is followed until every page has its revisions.
+    Pages that still have none are logged and left out. _chunk_size_, if
+    given, is told whether the first response was truncated.
+    """
+    pages: Dict[Any, Dict[str, Any]] = {}
+    request = params
+    first = True
+
+    while True:
+        data = yield request
+        truncated = handle_warnings_and_errors(data)
+        filled = merge_pages(pages, data)
+
+        if first and chunk_size is not None:
+            if truncated or any(incomplete(page) for page in pages.values()):
+                chunk_size.truncated(filled)
+            else:
+                chunk_size.complete()
+
+        _continue = data.get("continue", {})
+        if "rvcontinue" not in _continue:
+            break
+
+        if not filled and not first:
+            logging.error("no progress from rvcontinue %s", _continue["rvcontinue"])
+            break
+
+        first = False
+        logging.debug("continue revisions from %s", _continue["rvcontinue"])
+        request = {**params, **_continue}
+
+    for page in pages.values():
+        if incomplete(page):
+            logging.error("skipping '%s', missing revision data", page.get("title"))
+
+    complete = [page for page in pages.values() if not incomplete(page)]
+    return complete, data.get("continue", {})
+
+
+def query_pages(
+    session: requests.Session,
+    params: Dict[str, Any],
+    *,
+    url: str,
+    chunk_size: Optional[AdaptiveChunkSize] = None,
+) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """Make the requests for `page_requests` with _session_."""
+    return run_requests(session, page_requests(params, chunk_size), url=url)
+
+
+def stream_pages(
+    session: requests.Session,
+    params: Dict[str, Any],
+    *,
+    url: str,
+    chunk_size: Optional[AdaptiveChunkSize] = None,
+) -> Generator[Dict[str, Any], None, Dict[str, Any]]:
+    """Like `query_pages`, but decode each response incrementally and yield
+    pages as soon as they have been decoded. Return the `continue` object.
+
+    Pages left without revisions by a truncated response are held back,
+    without content, until the revisions continuation fills them in.
+    """
+    seen: Set[Any] = set()
+    waiting: Dict[Any, Dict[str, Any]] = {}
+    request = params
+    first = True
+
+    while True:
+        filled = 0
+        with session.get(url, params=request, stream=True) as response:
+            response.raise_for_status()
+            stream = QueryStream(response.iter_content(STREAM_CHUNK_SIZE))
+
+            for page in stream.pages():
+                key = page.get("pageid", page.get("title"))
+                if key in seen:
+                    known = waiting.get(key)
+                    if known is not None and page.get("revisions"):
+                        del waiting[key]
+                        known["revisions"] = page["revisions"]
+                        filled += 1
+                        yield known
+                    continue
+
+                seen.add(key)
+                if incomplete(page):
+                    waiting[key] = page
+                    continue
+
+                filled += bool(page.get("revisions"))
+                yield page
+
+            METRICS.inc("api_response_bytes_total", received_bytes(response))
+
+        data = stream.data
+        truncated = handle_warnings_and_errors(data)
+
+        if first and chunk_size is not None:
+            if truncated or waiting:
+                chunk_size.truncated(filled)
+            else:
+                chunk_size.complete()
+
+        _continue = data.get("continue", {})
+        if "rvcontinue" not in _continue:
+            break
+
+        if not filled and not first:
+            logging.error("no progress from rvcontinue %s", _continue["rvcontinue"])
+            break
+
+        first = False
+        logging.debug("continue revisions from %s", _continue["rvcontinue"])
+        request = {**params, **_continue}
+
+    for page in waiting.values():
+        logging.error("skipping '%s', missing revision data", page.get("title"))
+
+    return data.get("continue", {})  # type: ignore[no-any-return]
+
+
+class BatchContinuation:
+    """The state of a query that is made a batch of pages at a time,
+    following continuation tokens until at least _limit_ pages have been
+    received.
+
+    If _limit_key_ is given, the number of pages asked for in each request
+    is adjusted to suit the server, starting from `params[limit_key]`.
+
+    If a _checkpoint_ is given, the query starts from its saved
+    continuation, and the continuation after each batch is recorded in it.
+    """
+
+    def __init__(
+        self,
+        params: Dict[str, Any],
+        *,
+        continue_key: str,
+        limit: int,
+        limit_key: Optional[str] = None,
+        max_chunk_size: int = 500,
+        checkpoint: Optional[Checkpoint] = None,
+    ) -> None:
+        self.params = {**params, "continue": None}
+        self.continue_key = continue_key
+        self.limit = limit
+        self.limit_key = limit_key
+        self.checkpoint = checkpoint
+        self.page_count = 0
+        self.done = False
+
+        if checkpoint is not None:
+            self.params.update(checkpoint.continue_params or {})
+            self.page_count = checkpoint.page_count
+            self.done = checkpoint.done or self.page_count >= limit
+
+        self.chunk_size = (
+            AdaptiveChunkSize(int(self.params[limit_key]), max_chunk_size)
+            if limit_key
+            else None
+        )
+
+    def request(self) -> Dict[str, Any]:
+        """Return the parameters for the next batch."""
+        if self.chunk_size is not None:
+            self.params[self.limit_key] = self.chunk_size.size  # type: ignore[index]
+        return dict(self.params)
+
+    def received(
+        self,
+        _continue: Dict[str, Any],
+        pages: List[Dict[str, Any]],
+        count: int,
+    ) -> None:
+        """Follow the continuation after a batch of _count_ pages, the last
+        of which are _pages_."""
+        key = self.continue_key
+        stop = not _continue.get(key)
+
+        if not stop:
+            self.params[key] = _continue[key]
+            self.params["continue"] = _continue["continue"]
+            logging.debug("continue from %s", self.params[key])
+
+        self.page_count += count
+        logging.debug("received %d pages", count)
+
+        if self.checkpoint is not None:
+            following = None
+            if not stop:
+                following = {key: self.params[key], "continue": self.params["continue"]}
+            self.checkpoint.batch(pages, following, self.page_count)
+
+        self.done = stop or self.page_count >= self.limit
+
+
+def query_batches(
+    session: requests.Session,
+    params: Dict[str, Any],
+    *,
+    url: str,
+    continue_key: str,
+    limit: int,
+    limit_key: Optional[str] = None,
+    max_chunk_size: int = 500,
+    checkpoint: Optional[Checkpoint] = None,
+    stream: bool = False,
+) -> Iterator[Iterable[Dict[str, Any]]]:
+    """Yield a list of pages for each API response, following continuation
+    tokens as described by `BatchContinuation`.
+
+    If _stream_ is True, each batch is a generator of pages decoded from the
+    response as it arrives, instead of a list. Each batch must be consumed
+    in full, on the same thread, before the next one is requested.
+    """
+    batches = BatchContinuation(
+        params,
+        continue_key=continue_key,
+        limit=limit,
+        limit_key=limit_key,
+        max_chunk_size=max_chunk_size,
+        checkpoint=checkpoint,
+    )
+
+    def _stream_batch(request: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        # Hold back the last page until the continuation has been recorded,
+        # so a checkpoint is saved once it has been written.
+        pages = stream_pages(
+            session,
+            request,
+            url=url,
+            chunk_size=batches.chunk_size,
+        )
+        last: List[Dict[str, Any]] = []
+        count = 0
+
+        while True:
+            try:
+                page = next(pages)
+            except StopIteration as done:
+                batches.received(done.value, last, count)
+                break
+            if last:
+                yield last.pop()
+            last.append(page)
+            count += 1
+
+        yield from last
+
+    while not batches.done:
+        request = batches.request()
+        if stream:
+            yield _stream_batch(request)
+        else:
+            pages, _continue = query_pages(
+                session,
+                request,
+                url=url,
+                chunk_size=batches.chunk_size,
+            )
+            batches.received(_continue, pages, len(pages))
+            yield pages
+
+
+def ids_query(
+    session: requests.Session,
+    params: Dict[str, Any],
+    ids: List[int],
     *,
     url: str,
+    ids_key: str,
     chunk_size: int = 20,
-    limit: int = 50,
-) -> Iterable[Dict[str, Any]]:
-    page_count = 0
-    params: Dict[str, Any] = {
-        **CM_QUERY,
-        "gcmtitle": category,
-        "gcmlimit": chunk_size,
-        "continue": None,
-    }
+    sizes: Optional[AdaptiveChunkSize] = None,
+) -> Iterator[Dict[str, Any]]:
+    """Generate pages for _ids_, given as _ids_key_, a chunk at a time.
+
+    Chunk sizes are adjusted to suit the server, starting from _chunk_size_,
+    or carrying on from _sizes_ if it is given.
+    """
+    size = sizes or AdaptiveChunkSize(chunk_size, MAX_IDS_PER_REQUEST)
+    start = 0
+
+    while start < len(ids):
+        chunk = ids[start : start + size.size]
+        start += len(chunk)
+        pages, _ = query_pages(
+            session,
+            {**params, ids_key: "|".join(str(_id) for _id in chunk)},
+            url=url,
+            chunk_size=size,
+        )
+        yield from pages
 
-    response = session.get(url, params=params)
-    response.raise_for_status()
-    data = response.json()
-    handle_warnings_and_errors(data)
 
-    if data.get("continue", {}).get("gcmcontinue"):
-        params["gcmcontinue"] = data["continue"]["gcmcontinue"]
-        params["continue"] = data["continue"]["continue"]
-        logging.debug("continue from %s", params["gcmcontinue"])
+def revids_query(
+    session: requests.Session,
+    revids: List[int],
+    *,
+    url: str,
+    chunk_size: int = 50,
+    sizes: Optional[AdaptiveChunkSize] = None,
+) -> Iterator[Dict[str, Any]]:
+    """Generate pages with content for the given revision ids."""
+    yield from ids_query(
+        session,
+        REVIDS_QUERY,
+        revids,
+        url=url,
+        ids_key="revids",
+        chunk_size=chunk_size,
+        sizes=sizes,
+    )
+
+
+def pageids_query(
+    session: requests.Session,
+    pageids: List[int],
+    *,
+    url: str,
+    chunk_size: int = 20,
+    category: Optional[str] = None,
+    cache: Optional[RevisionCache] = None,
+) -> Iterator[Dict[str, Any]]:
+    """Generate pages with content for the given page ids.
+
+    Pages that no longer exist are skipped. If _category_ is given, so are
+    pages that are not members of that category. If _cache_ is given, only
+    content that isn't already cached is downloaded.
+    """
+    params: Dict[str, Any] = {**PAGEIDS_QUERY}
+    if category:
+        params["prop"] = "revisions|categories"
+        params["clcategories"] = category
+
+    if cache:
+        params.update(METADATA_ONLY)
+
+    pages: Iterable[Dict[str, Any]] = ids_query(
+        session,
+        params,
+        pageids,
+        url=url,
+        ids_key="pageids",
+        chunk_size=chunk_size,
+    )
+
+    if cache:
+        batches = with_cached_content(
+            session,
+            chunked(pages, MAX_IDS_PER_REQUEST),
+            url=url,
+            cache=cache,
+        )
+        pages = itertools.chain.from_iterable(batches)
+
+    for page in pages:
+        if page.get("missing") or page.get("invalid"):
+            continue
+        if category and not page.get("categories"):
+            continue
+        yield page
+
+
+def recent_changes(
+    session: requests.Session,
+    *,
+    url: str,
+    since: str,
+    namespace: Optional[int] = None,
+    prefix: str = "",
+) -> Tuple[List[int], str]:
+    """Return the ids of pages edited or created since the given ISO 8601
+    timestamp, and the server's current time.
 
-    page_count += len(data["query"]["pages"])
-    yield from data["query"]["pages"]
+    _prefix_ is matched against titles without their namespace prefix.
+    """
+    params: Dict[str, Any] = {**RC_QUERY, "rcend": since}
+    if namespace is not None:
+        params["rcnamespace"] = namespace
 
-    stop = False
+    pageids: Dict[int, None] = {}
+    timestamp = ""
 
-    while page_count < limit and not stop:
+    while True:
         response = session.get(url, params=params)
         response.raise_for_status()
         data = response.json()
+        handle_warnings_and_errors(data)
+        timestamp = timestamp or data["curtimestamp"]
+
+        for change in data["query"]["recentchanges"]:
+            title = change["title"]
+            if change["ns"] != 0:
+                title = title.partition(":")[2]
+            if title.startswith(prefix):
+                pageids[change["pageid"]] = None
+
+        if data.get("continue", {}).get("rccontinue"):
+            params.update(data["continue"])
+        else:
+            break
+
+    logging.debug("%d pages changed since %s", len(pageids), since)
+    return sorted(pageids), timestamp
+
+
+def deleted_pages(
+    session: requests.Session,
+    *,
+    url: str,
+    since: str,
+    namespace: Optional[int] = None,
+    prefix: str = "",
+) -> List[int]:
+    """Return the ids of pages deleted since the given ISO 8601 timestamp.
+
+    _prefix_ is matched against titles without their namespace prefix.
+    """
+    params: Dict[str, Any] = {**DELETE_LOG_QUERY, "leend": since}
+    if namespace is not None:
+        params["lenamespace"] = namespace
 
-        if data.get("continue", {}).get("gcmcontinue"):
-            params["gcmcontinue"] = data["continue"]["gcmcontinue"]
-            params["continue"] = data["continue"]["continue"]
-            logging.debug("continue from %s", params["gcmcontinue"])
+    pageids: Dict[int, None] = {}
+
+    while True:
+        response = session.get(url, params=params)
+        response.raise_for_status()
+        data = response.json()
+        handle_warnings_and_errors(data)
+
+        for event in data["query"]["logevents"]:
+            title = event["title"]
+            if event["ns"] != 0:
+                title = title.partition(":")[2]
+            # `logpage` is the id the page had when it was deleted.
+            if event.get("logpage") and title.startswith(prefix):
+                pageids[event["logpage"]] = None
+
+        if data.get("continue", {}).get("lecontinue"):
+            params.update(data["continue"])
         else:
-            stop = True
+            break
 
-        num_pages = len(data["query"]["pages"])
-        page_count += num_pages
-        logging.debug("received %d pages", num_pages)
-        yield from data["query"]["pages"]
+    logging.debug("%d pages deleted since %s", len(pageids), since)
+    return sorted(pageids)
 
 
-def ap_query(
+def search_candidates(
+    session: requests.Session,
+    *,
+    url: str,
+    queries: Iterable[str] = SEARCH_QUERIES,
+    namespace: Optional[int] = None,
+    category: Optional[str] = None,
+    prefix: str = "",
+) -> List[int]:
+    """Return the ids of pages matching any of the search _queries_, sorted.
+
+    Only page ids and titles are fetched, so this is much cheaper than
+    downloading the content of every page. If _namespace_ is None, all
+    namespaces are searched. If _category_ is given, only its members are
+    matched. _prefix_ is matched against titles without their namespace
+    prefix.
+
+    The search index can lag behind recent edits.
+    """
+    pageids: Dict[int, None] = {}
+
+    for query in queries:
+        if category:
+            query += f' incategory:"{category.partition(":")[2] or category}"'
+
+        params: Dict[str, Any] = {
+            **SEARCH_QUERY,
+            "srsearch": query,
+            "srnamespace": "*" if namespace is None else namespace,
+        }
+        hits = 0
+
+        while True:
+            response = session.get(url, params=params)
+            response.raise_for_status()
+            data = response.json()
+            handle_warnings_and_errors(data)
+            if "query" not in data:
+                break
+
+            for result in data["query"]["search"]:
+                hits += 1
+                title = result["title"]
+                if result["ns"] != 0:
+                    title = title.partition(":")[2]
+                if title.startswith(prefix):
+                    pageids[result["pageid"]] = None
+
+            if data.get("continue", {}).get("sroffset"):
+                params.update(data["continue"])
+            else:
+                break
+
+        total = data.get("query", {}).get("searchinfo", {}).get("totalhits", hits)
+        if hits < total:
+            logging.warning(
+                "search %r stopped after %d of %d results, "
+                "try narrowing it with a prefix",
+                query,
+                hits,
+                total,
+            )
+        logging.debug("search %r found %d pages", query, hits)
+
+    logging.debug("%d candidate pages from search", len(pageids))
+    return sorted(pageids)
+
+
+def with_cached_content(
     session: requests.Session,
+    batches: Iterable[Iterable[Dict[str, Any]]],
     *,
     url: str,
+    cache: RevisionCache,
+    chunk_size: int = 50,
+) -> Iterator[List[Dict[str, Any]]]:
+    """Fill in content for batches of pages that were queried without it.
+
+    Content comes from _cache_ where possible. Revisions that aren't cached
+    are fetched by revision id, then added to the cache.
+    """
+    sizes = AdaptiveChunkSize(chunk_size, MAX_IDS_PER_REQUEST)
+
+    for queried in batches:
+        batch = list(queried)
+        missing: Dict[int, Dict[str, Any]] = {}
+
+        for page in batch:
+            if not page.get("revisions"):
+                continue
+
+            revision = page["revisions"][0]
+            slot = cache.get(page["pageid"], revision["revid"])
+            if slot is None:
+                missing[revision["revid"]] = revision
+            else:
+                revision["slots"] = {"main": slot}
+
+        if missing:
+            logging.debug("fetching %d uncached revisions", len(missing))
+            pages = revids_query(session, list(missing), url=url, sizes=sizes)
+            for page in pages:
+                for revision in page.get("revisions", []):
+                    if revision["revid"] not in missing:
+                        continue
+                    missing[revision["revid"]]["slots"] = revision["slots"]
+                    slot = revision["slots"]["main"]
+                    if "content" in slot:
+                        cache.put(page["pageid"], revision["revid"], slot)
+            cache.commit()
+
+        yield batch
+
+
+def prefetch(items: Iterable[T], depth: int) -> Iterator[T]:
+    """Consume _items_ on a background thread, keeping at most _depth_ of them
+    queued ahead of the caller.
+
+    Items are yielded in their original order. Exceptions raised while
+    producing items are re-raised in the consuming thread.
+    """
+    if depth < 1:
+        yield from items
+        return
+
+    queue: "Queue[Any]" = Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def _put(item: Any) -> bool:
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def _produce() -> None:
+        try:
+            for item in items:
+                if not _put(item):
+                    return
+        except BaseException as err:  # pylint: disable=broad-except
+            _put(_PrefetchError(err))
+            return
+        finally:
+            # Let generators clean up on this thread if the consumer stops early.
+            close = getattr(items, "close", None)
+            if close is not None:
+                close()
+        _put(_PREFETCH_DONE)
+
+    thread = threading.Thread(target=_produce, name="prefetch", daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            item = queue.get()
+            if item is _PREFETCH_DONE:
+                break
+            if isinstance(item, _PrefetchError):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+class _PrefetchError:
+    def __init__(self, error: BaseException) -> None:
+        self.error = error
+
+
+_PREFETCH_DONE = object()
+
+
+def cm_params(category: str, chunk_size: int) -> Dict[str, Any]:
+    """Return parameters for a query for pages in _category_."""
+    return {**CM_QUERY, "gcmtitle": category, "gcmlimit": chunk_size}
+
+
+def ap_params(
+    *,
     prefix: str = "",
     namespace: int = 0,
     chunk_size: int = 25,
-    limit: int = 200,
-) -> Iterable[Dict[str, Any]]:
-    page_count = 0
+    start: str = "",
+    end: str = "",
+) -> Dict[str, Any]:
+    """Return parameters for a query for pages in _namespace_, optionally
+    limited to titles with _prefix_ and from _start_ to _end_, inclusive."""
     params: Dict[str, Any] = {
         **AP_QUERY,
         "gaplimit": chunk_size,
         "gapnamespace": namespace,
-        "continue": None,
     }
 
     if prefix:
         params["gapprefix"] = prefix
 
-    response = session.get(url, params=params)
-    response.raise_for_status()
-    data = response.json()
-    handle_warnings_and_errors(data)
-
-    if data.get("continue", {}).get("gapcontinue"):
-        params["gapcontinue"] = data["continue"]["gapcontinue"]
-        params["continue"] = data["continue"]["continue"]
-        logging.debug("continue from %s", params["gapcontinue"])
-        stop = False
-    else:
-        stop = True
+    if start:
+        params["gapfrom"] = start
 
-    page_count += len(data["query"]["pages"])
-    yield from data["query"]["pages"]
+    if end:
+        params["gapto"] = end
 
-    while page_count < limit and not stop:
-        response = session.get(url, params=params)
-        response.raise_for_status()
-        data = response.json()
+    return params
+
+
+def cm_query(
+    session: requests.Session,
+    category: str,
+    *,
+    url: str,
+    chunk_size: int = 20,
+    max_chunk_size: int = 500,
+    limit: int = 50,
+    prefetch_depth: int = 0,
+    cache: Optional[RevisionCache] = None,
+    checkpoint: Optional[Checkpoint] = None,
+    stream: bool = False,
+) -> Iterable[Dict[str, Any]]:
+    params = cm_params(category, chunk_size)
+
+    if cache:
+        params.update(METADATA_ONLY)
+
+    batches = query_batches(
+        session,
+        params,
+        url=url,
+        continue_key="gcmcontinue",
+        limit=limit,
+        limit_key="gcmlimit",
+        max_chunk_size=max_chunk_size,
+        checkpoint=checkpoint,
+        stream=stream and not cache,
+    )
+
+    if cache:
+        batches = with_cached_content(session, batches, url=url, cache=cache)
+    elif stream:
+        # Streamed batches must be consumed in order on one thread, so
+        # prefetch pages instead.
+        yield from prefetch(itertools.chain.from_iterable(batches), prefetch_depth)
+        return
+
+    for batch in prefetch(batches, prefetch_depth):
+        yield from batch
+
+
+def ap_query(
+    session: requests.Session,
+    *,
+    url: str,
+    prefix: str = "",
+    namespace: int = 0,
+    chunk_size: int = 25,
+    max_chunk_size: int = 500,
+    limit: int = 200,
+    prefetch_depth: int = 0,
+    start: str = "",
+    end: str = "",
+    cache: Optional[RevisionCache] = None,
+    checkpoint: Optional[Checkpoint] = None,
+    stream: bool = False,
+) -> Iterable[Dict[str, Any]]:
+    params = ap_params(
+        prefix=prefix,
+        namespace=namespace,
+        chunk_size=chunk_size,
+        start=start,
+        end=end,
+    )
+
+    if cache:
+        params.update(METADATA_ONLY)
+
+    batches = query_batches(
+        session,
+        params,
+        url=url,
+        continue_key="gapcontinue",
+        limit=limit,
+        limit_key="gaplimit",
+        max_chunk_size=max_chunk_size,
+        checkpoint=checkpoint,
+        stream=stream and not cache,
+    )
+
+    if cache:
+        batches = with_cached_content(session, batches, url=url, cache=cache)
+    elif stream:
+        # Streamed batches must be consumed in order on one thread, so
+        # prefetch pages instead.
+        yield from prefetch(itertools.chain.from_iterable(batches), prefetch_depth)
+        return
+
+    for batch in prefetch(batches, prefetch_depth):
+        yield from batch
 
-        if data.get("continue", {}).get("gapcontinue"):
-            params["gapcontinue"] = data["continue"]["gapcontinue"]
-            params["continue"] = data["continue"]["continue"]
-            logging.debug("continue from %s", params["gapcontinue"])
+
+def title_shard_requests(
+    *,
+    prefix: str = "",
+    namespace: int = 0,
+    shards: int = 4,
+    limit: Optional[int] = None,
+) -> RequestGenerator[List[Tuple[str, str]]]:
+    """Split a namespace into at most _shards_ contiguous title ranges with
+    roughly equal numbers of pages.
+
+    Boundaries come from a titles-only `list=allpages` listing, which is
+    much cheaper than fetching page content. Each range is an inclusive
+    `(gapfrom, gapto)` pair. If _limit_ is given, listing stops after that
+    many titles, and the ranges only cover the first _limit_ pages.
+    """
+    params: Dict[str, Any] = {**AP_TITLES_QUERY, "apnamespace": namespace}
+    if prefix:
+        params["apprefix"] = prefix
+    if limit is not None and limit < AP_TITLES_LIMIT:
+        params["aplimit"] = limit
+
+    titles: List[str] = []
+
+    while limit is None or len(titles) < limit:
+        data = yield params
+        handle_warnings_and_errors(data)
+        titles.extend(page["title"] for page in data["query"]["allpages"])
+
+        if data.get("continue", {}).get("apcontinue"):
+            params = {**params, **data["continue"]}
         else:
-            stop = True
+            break
+
+    titles = titles[:limit]
+
+    logging.debug("listed %d titles for sharding", len(titles))
+
+    if not titles:
+        return []
+
+    shards = min(shards, len(titles))
+    starts = [len(titles) * i // shards for i in range(shards)]
+    ends = [idx - 1 for idx in starts[1:]] + [len(titles) - 1]
+    return [(titles[start], titles[end]) for start, end in zip(starts, ends)]
+
+
+def title_shards(
+    session: requests.Session,
+    *,
+    url: str,
+    prefix: str = "",
+    namespace: int = 0,
+    shards: int = 4,
+    limit: Optional[int] = None,
+) -> List[Tuple[str, str]]:
+    """Make the requests for `title_shard_requests` with _session_."""
+    return run_requests(
+        session,
+        title_shard_requests(
+            prefix=prefix, namespace=namespace, shards=shards, limit=limit
+        ),
+        url=url,
+    )
+
+
+def sharded_ap_query(
+    session: requests.Session,
+    *,
+    url: str,
+    prefix: str = "",
+    namespace: int = 0,
+    chunk_size: int = 25,
+    max_chunk_size: int = 500,
+    limit: int = 200,
+    shards: int = 4,
+    cache: Optional[RevisionCache] = None,
+    stream: bool = False,
+) -> Iterable[Dict[str, Any]]:
+    """Like `ap_query`, but query title ranges concurrently.
+
+    Each shard runs its own continuation loop on a worker thread and spools
+    pages to a temporary file, so memory use stays bounded. Pages are
+    yielded shard by shard, in title order, as each shard completes.
+    Shards cover the first _limit_ pages, which are split evenly between
+    them.
+    """
+    ranges = title_shards(
+        session,
+        url=url,
+        prefix=prefix,
+        namespace=namespace,
+        shards=shards,
+        limit=limit,
+    )
 
-        num_pages = len(data["query"]["pages"])
-        page_count += num_pages
-        logging.debug("received %d pages", num_pages)
-        yield from data["query"]["pages"]
+    if not ranges:
+        return
 
+    shard_limit = -(-limit // len(ranges))
+    stop = threading.Event()
 
-def handle_warnings_and_errors(data: Any) -> None:
+    def _fetch(start: str, end: str) -> Optional[TextIO]:
+        spool = tempfile.TemporaryFile("w+", encoding="utf-8")
+        pages = ap_query(
+            session,
+            url=url,
+            prefix=prefix,
+            namespace=namespace,
+            chunk_size=chunk_size,
+            max_chunk_size=max_chunk_size,
+            limit=shard_limit,
+            start=start,
+            end=end,
+            cache=cache,
+            stream=stream,
+        )
+        try:
+            for page in pages:
+                if stop.is_set():
+                    logging.debug("shard %s..%s stopped", start, end)
+                    spool.close()
+                    return None
+                spool.write(json.dumps(page))
+                spool.write("\n")
+        except BaseException:
+            spool.close()
+            raise
+        spool.seek(0)
+        logging.debug("shard %s..%s complete", start, end)
+        return spool
+
+    with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+        futures = [executor.submit(_fetch, start, end) for start, end in ranges]
+        try:
+            for future in futures:
+                spool = future.result()
+                assert spool is not None
+                with spool:
+                    for line in spool:
+                        yield json.loads(line)
+        finally:
+            # If the consumer stops early, stop the shards that are still
+            # running and remove the spools of those that have finished.
+            stop.set()
+            for future in futures:
+                future.cancel()
+            for future in futures:
+                if future.cancelled() or future.exception() is not None:
+                    continue
+                spool = future.result()
+                if spool is not None:
+                    spool.close()
+
+
+def handle_warnings_and_errors(data: Any) -> bool:
+    """Log errors and warnings from an API response. Return True if the
+    response was truncated, because it would have been too big, or if some
+    revisions were left for a continuation request."""
     if data.get("errors"):
         for error in data["errors"]:
             logging.error(json.dumps(error))
     # legacy format
     if data.get("error"):
         logging.error(json.dumps(data["error"]))
-    if data.get("warnings"):
-        for warning in data["warnings"]:
-            logging.warning(json.dumps(warning))
+
+    truncated = "rvcontinue" in data.get("continue", {})
+    warnings = data.get("warnings") or {}
+    # Warnings are keyed by module name, unless an errorformat is given.
+    if isinstance(warnings, dict):
+        warnings = [{module: warning} for module, warning in warnings.items()]
+    for warning in warnings:
+        message = json.dumps(warning)
+        logging.warning(message)
+        if "truncated" in message:
+            truncated = True
+    return truncated
 
 
 class LangTagMatch:
-    def __init__(self, text: str, start: int, end: int, lineno: int) -> None:
-        self.text = text
+    """The text, position and line number of a start or end tag.
+
+    If _source_, the page text, is given, _text_ is not kept and is sliced
+    from _source_ on access instead. That saves memory when the page text is
+    kept around anyway.
+    """
+
+    __slots__ = ("_text", "source", "start", "end", "lineno")
+
+    def __init__(
+        self,
+        text: Optional[str],
+        start: int,
+        end: int,
+        lineno: int,
+        source: Optional[str] = None,
+    ) -> None:
+        self._text = None if source is not None else text
+        self.source = source
         self.start = start
         self.end = end
         self.lineno = lineno
 
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            assert self.source is not None
+            return self.source[self.start : self.end]
+        return self._text
+
+
+class LineIndex:
+    """Map string indices to line numbers using a newline offset index.
+
+    The index is built on first use, so pages without any matches never
+    pay for it.
+    """
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+        self._newlines: Optional[List[int]] = None
+
+    def lineno(self, index: int) -> int:
+        """Return the 1-based line number of the character at _index_."""
+        if self._newlines is None:
+            self._newlines = [m.start() for m in RE_NEWLINE.finditer(self.text)]
+        return bisect_left(self._newlines, index) + 1
+
 
 class BadLangTag:
+    __slots__ = ("lang", "tag", "start", "end", "kind")
+
     def __init__(
         self,
         lang: Optional[str],
@@ -245,17 +1412,204 @@ class BadLangTag:
         self.end = end
         self.kind = kind
 
+    def as_tuple(self) -> TagTuple:
+        """Return this tag as a flat tuple of builtin types."""
+        start = self.start
+        end = self.end
+        if end is None:
+            return (
+                self.lang,
+                self.tag,
+                self.kind,
+                start.text,
+                start.start,
+                start.end,
+                start.lineno,
+                None,
+                None,
+                None,
+                None,
+            )
+        return (
+            self.lang,
+            self.tag,
+            self.kind,
+            start.text,
+            start.start,
+            start.end,
+            start.lineno,
+            end.text,
+            end.start,
+            end.end,
+            end.lineno,
+        )
 
-def find_bad_lang_tags(
-    wiki_text: str,
-    skip_unsupported_langs: bool = False,
-) -> Iterable[BadLangTag]:
-    for match in RE_BAD_LANG.finditer(wiki_text):
-        kind = match.lastgroup
+    @classmethod
+    def from_tuple(cls, tag: TagTuple) -> "BadLangTag":
+        """Inverse of `as_tuple`."""
+        lang, _tag, kind, *start, end_text, end_start, end_end, end_lineno = tag
+        return cls(
+            lang=lang,
+            tag=_tag,
+            start=LangTagMatch(*start),
+            end=(
+                None
+                if end_start is None
+                else LangTagMatch(end_text, end_start, end_end, end_lineno)
+            ),
+            kind=kind,
+        )
+
+
+# Kinds and tag names as stored in a TagBatch.
+KINDS = (
+    "HIGH",
+    "HIGH_NQ",
+    "LANG",
+    "BAREHIGH",
+    "BARE",
+    "LONELANG",
+    "STARTHIGH",
+    "ENDHIGH",
+)
+
+TAG_NAMES = ("highlight", "/highlight", "lang", "/lang")
+
+
+class TagBatch:
+    """Columnar storage for bad tags from many pages.
+
+    Kinds, tag names and languages are stored as small integers, and
+    offsets and line numbers in arrays, with -1 standing in for the missing
+    end of an orphaned tag. Tag text is not stored. Pass the page text to
+    `tag` to get a BadLangTag back.
+    """
+
+    __slots__ = (
+        "page_ids",
+        "kinds",
+        "tags",
+        "langs",
+        "start_starts",
+        "start_ends",
+        "start_linenos",
+        "end_starts",
+        "end_ends",
+        "end_linenos",
+        "lang_names",
+        "_lang_ids",
+    )
+
+    def __init__(self) -> None:
+        self.page_ids = array("l")
+        self.kinds = array("b")
+        self.tags = array("b")
+        self.langs = array("l")
+        self.start_starts = array("l")
+        self.start_ends = array("l")
+        self.start_linenos = array("l")
+        self.end_starts = array("l")
+        self.end_ends = array("l")
+        self.end_linenos = array("l")
+        self.lang_names: List[str] = []
+        self._lang_ids: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.page_ids)
+
+    def append(self, page_id: int, tag: BadLangTag) -> None:
+        self.page_ids.append(page_id)
+        self.kinds.append(KINDS.index(tag.kind))
+        self.tags.append(TAG_NAMES.index(tag.tag))
+        self.langs.append(self._lang_id(tag.lang))
+        self.start_starts.append(tag.start.start)
+        self.start_ends.append(tag.start.end)
+        self.start_linenos.append(tag.start.lineno)
+        end = tag.end
+        self.end_starts.append(-1 if end is None else end.start)
+        self.end_ends.append(-1 if end is None else end.end)
+        self.end_linenos.append(-1 if end is None else end.lineno)
+
+    def extend(self, page_id: int, tags: Iterable[BadLangTag]) -> None:
+        for tag in tags:
+            self.append(page_id, tag)
+
+    def lang(self, index: int) -> Optional[str]:
+        lang_id = self.langs[index]
+        return None if lang_id == -1 else self.lang_names[lang_id]
+
+    def tag(self, index: int, source: str) -> BadLangTag:
+        """Return the tag at _index_, with text sliced lazily from _source_,
+        the text of the page it was found in."""
+        end_start = self.end_starts[index]
+        return BadLangTag(
+            lang=self.lang(index),
+            tag=TAG_NAMES[self.tags[index]],
+            start=LangTagMatch(
+                None,
+                self.start_starts[index],
+                self.start_ends[index],
+                self.start_linenos[index],
+                source=source,
+            ),
+            end=(
+                None
+                if end_start == -1
+                else LangTagMatch(
+                    None,
+                    end_start,
+                    self.end_ends[index],
+                    self.end_linenos[index],
+                    source=source,
+                )
+            ),
+            kind=KINDS[self.kinds[index]],
+        )
+
+    def _lang_id(self, lang: Optional[str]) -> int:
+        if lang is None:
+            return -1
+        lang_id = self._lang_ids.get(lang)
+        if lang_id is None:
+            lang_id = self._lang_ids[lang] = len(self.lang_names)
+            self.lang_names.append(lang)
+        return lang_id
+
+
+def find_bad_lang_tags(
+    wiki_text: str,
+    skip_unsupported_langs: bool = False,
+    engine: str = "tokens",
+    lazy_text: bool = False,
+    stats: Optional[ScanStats] = None,
+    kind_times: Optional[KindTimes] = None,
+) -> Iterable[BadLangTag]:
+    if stats is None:
+        stats = SCAN_STATS
+
+    # Rule out pages without tags, and skip text that can't start one.
+    window = tag_window(wiki_text, stats)
+    if window is None:
+        return
+    start, last = window
+
+    lines = LineIndex(wiki_text)
+    source = wiki_text if lazy_text else None
+
+    matches = ENGINES[engine](wiki_text, start)
+    if kind_times is not None:
+        matches = timed_matches(matches, kind_times)
+
+    for match in matches:
+        if match.start() > last:
+            break
+
+        stats.matches += 1
+        kind = match.lastgroup
 
         if kind == "HIGH":
             lang = match.group("hl_lang")
-            if skip_unsupported_langs or lang.strip().lower() in ALL_LEXERS:
+            if skip_unsupported_langs or lang.strip().lower() in all_lexers():
                 continue
 
             start = match.group("start_high")
@@ -263,7 +1617,8 @@ def find_bad_lang_tags(
                 text=start,
                 start=match.start(),
                 end=match.start() + len(start),
-                lineno=wiki_text[: match.start()].count("\n") + 1,
+                lineno=lines.lineno(match.start()),
+                source=source,
             )
 
             end = match.group("end_high")
@@ -271,7 +1626,8 @@ def find_bad_lang_tags(
                 text=end,
                 start=match.end() - len(end),
                 end=match.end(),
-                lineno=wiki_text[: match.end() - len(end)].count("\n") + 1,
+                lineno=lines.lineno(match.end() - len(end)),
+                source=source,
             )
 
             yield BadLangTag(
@@ -284,7 +1640,7 @@ def find_bad_lang_tags(
 
         if kind == "HIGH_NQ":
             lang = match.group("hl_lang_nq")
-            if skip_unsupported_langs or lang.strip().lower() in ALL_LEXERS:
+            if skip_unsupported_langs or lang.strip().lower() in all_lexers():
                 continue
 
             start = match.group("start_high_nq")
@@ -292,7 +1648,8 @@ def find_bad_lang_tags(
                 text=start,
                 start=match.start(),
                 end=match.start() + len(start),
-                lineno=wiki_text[: match.start()].count("\n") + 1,
+                lineno=lines.lineno(match.start()),
+                source=source,
             )
 
             end = match.group("end_high_nq")
@@ -300,7 +1657,8 @@ def find_bad_lang_tags(
                 text=end,
                 start=match.end() - len(end),
                 end=match.end(),
-                lineno=wiki_text[: match.end() - len(end)].count("\n") + 1,
+                lineno=lines.lineno(match.end() - len(end)),
+                source=source,
             )
 
             yield BadLangTag(
@@ -317,14 +1675,16 @@ def find_bad_lang_tags(
                 text=start,
                 start=match.start(),
                 end=match.start() + len(start),
-                lineno=wiki_text[: match.start()].count("\n") + 1,
+                lineno=lines.lineno(match.start()),
+                source=source,
             )
             end = match.group("end")
             end_match = LangTagMatch(
                 text=end,
                 start=match.end() - len(end),
                 end=match.end(),
-                lineno=wiki_text[: match.end() - len(end)].count("\n") + 1,
+                lineno=lines.lineno(match.end() - len(end)),
+                source=source,
             )
 
             yield BadLangTag(
@@ -341,14 +1701,16 @@ def find_bad_lang_tags(
                 text=start,
                 start=match.start(),
                 end=match.start() + len(start),
-                lineno=wiki_text[: match.start()].count("\n") + 1,
+                lineno=lines.lineno(match.start()),
+                source=source,
             )
             end = match.group("end_bare_high")
             end_match = LangTagMatch(
                 text=end,
                 start=match.end() - len(end),
                 end=match.end(),
-                lineno=wiki_text[: match.end() - len(end)].count("\n") + 1,
+                lineno=lines.lineno(match.end() - len(end)),
+                source=source,
             )
 
             yield BadLangTag(
@@ -365,14 +1727,16 @@ def find_bad_lang_tags(
                 text=start,
                 start=match.start(),
                 end=match.start() + len(start),
-                lineno=wiki_text[: match.start()].count("\n") + 1,
+                lineno=lines.lineno(match.start()),
+                source=source,
             )
             end = match.group("end_bare")
             end_match = LangTagMatch(
                 text=end,
                 start=match.end() - len(end),
                 end=match.end(),
-                lineno=wiki_text[: match.end() - len(end)].count("\n") + 1,
+                lineno=lines.lineno(match.end() - len(end)),
+                source=source,
             )
 
             yield BadLangTag(
@@ -389,7 +1753,8 @@ def find_bad_lang_tags(
                 text=start,
                 start=match.start(),
                 end=match.start() + len(start),
-                lineno=wiki_text[: match.start()].count("\n") + 1,
+                lineno=lines.lineno(match.start()),
+                source=source,
             )
 
             yield BadLangTag(
@@ -406,7 +1771,8 @@ def find_bad_lang_tags(
                 text=start,
                 start=match.start(),
                 end=match.start() + len(start),
-                lineno=wiki_text[: match.start()].count("\n") + 1,
+                lineno=lines.lineno(match.start()),
+                source=source,
             )
 
             yield BadLangTag(
@@ -423,7 +1789,8 @@ def find_bad_lang_tags(
                 text=start,
                 start=match.start(),
                 end=match.start() + len(start),
-                lineno=wiki_text[: match.start()].count("\n") + 1,
+                lineno=lines.lineno(match.start()),
+                source=source,
             )
 
             yield BadLangTag(
@@ -435,56 +1802,268 @@ def find_bad_lang_tags(
             )
 
 
-def get_session() -> requests.Session:
-    """Setup a requests.Session with retries."""
+def get_session(
+    rate_limit: Optional[float] = None,
+    pool_size: int = 10,
+    *,
+    burst: int = 1,
+    concurrency: Optional[int] = None,
+    maxlag: Optional[int] = 5,
+) -> ScheduledSession:
+    """Setup a requests.Session with retries and a RequestScheduler.
+
+    _rate_limit_ is in requests per second, with bursts of up to _burst_.
+    _concurrency_ limits the number of requests in flight to each host.
+    Requests are refused while the wiki's database lag is more than
+    _maxlag_ seconds, then retried.
+    """
+    # 429 and 503 responses are retried by ScheduledSession, which makes
+    # every thread wait, not just the one that got the response.
     retry_strategy = Retry(
         total=5,
-        status_forcelist=[429, 500, 502, 503, 504],
+        status_forcelist=[500, 502, 504],
         allowed_methods=["HEAD", "GET", "OPTIONS"],
     )
-    adapter = HTTPAdapter(max_retries=retry_strategy)
-    session = requests.Session()
+    adapter = HTTPAdapter(
+        max_retries=retry_strategy,
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+    )
+    scheduler = RequestScheduler(
+        rate=rate_limit,
+        burst=burst,
+        concurrency=concurrency,
+        maxlag=maxlag,
+    )
+    session = ScheduledSession(scheduler)
     session.headers.update({"User-Agent": "Find bad lang tags bot"})
     session.mount("https://", adapter)
     session.mount("http://", adapter)
     return session
 
 
+def scanner_version(skip_unsupported_langs: bool) -> str:
+    """Return a fingerprint of everything that affects the output of
+    `find_bad_lang_tags`, suitable for use as a cache key."""
+    digest = hashlib.sha256()
+    digest.update(SCANNER_VERSION.encode())
+    digest.update(json.dumps(RE_SPEC).encode())
+    if not skip_unsupported_langs:
+        digest.update(json.dumps(sorted(all_lexers())).encode())
+    return digest.hexdigest()[:16]
+
+
+def page_content(page: Dict[str, Any]) -> str:
+    """Return the wiki text of a page's latest revision, or exit if we can't
+    handle it."""
+    if not page.get("revisions"):
+        logging.error(f"missing revision data for '{page}'")
+        sys.exit(1)
+
+    content_format = page["revisions"][0]["slots"]["main"]["contentformat"]
+    if not content_format == "text/x-wiki":
+        logging.error(f"can't handle format {content_format} for '{page}'")
+        sys.exit(1)
+
+    return page["revisions"][0]["slots"]["main"]["content"]
+
+
+def _scan_tuples(
+    wiki_texts: List[str],
+    skip_unsupported_langs: bool,
+) -> Tuple[List[List[TagTuple]], ScanStats]:
+    """Process pool entry point. Results are returned as plain tuples, which
+    are much cheaper to pickle than BadLangTag objects, along with the work
+    done scanning them."""
+    stats = ScanStats()
+    started = time.thread_time()
+    tags = [
+        [
+            tag.as_tuple()
+            for tag in find_bad_lang_tags(text, skip_unsupported_langs, stats=stats)
+        ]
+        for text in wiki_texts
+    ]
+    stats.cpu_time += time.thread_time() - started
+    return tags, stats
+
+
+def _scan(
+    page: Dict[str, Any],
+    wiki_text: str,
+    skip_unsupported_langs: bool,
+    profile: Optional[ScanProfile] = None,
+) -> List[BadLangTag]:
+    """Scan _wiki_text_ inline, adding the CPU time taken to SCAN_STATS, and
+    recording _page_ in _profile_ if given."""
+    kind_times = KindTimes() if profile is not None else None
+    started = time.thread_time()
+    tags = list(
+        find_bad_lang_tags(wiki_text, skip_unsupported_langs, kind_times=kind_times)
+    )
+    seconds = time.thread_time() - started
+    SCAN_STATS.cpu_time += seconds
+
+    if profile is not None:
+        assert kind_times is not None
+        profile.record(page, wiki_text, seconds, kind_times, len(tags))
+    return tags
+
+
+def _scan_metrics() -> Dict[str, float]:
+    return {
+        "scan_pages_total": SCAN_STATS.pages,
+        "scan_chars_total": SCAN_STATS.chars,
+        "scan_prescreened_pages_total": SCAN_STATS.prescreened,
+        "scan_window_chars_total": SCAN_STATS.window_chars,
+        "scan_matches_total": SCAN_STATS.matches,
+        "scan_cpu_seconds_total": SCAN_STATS.cpu_time,
+    }
+
+
+METRICS.add_collector(_scan_metrics)
+
+
+def scan_pages(
+    pages: Iterable[Dict[str, Any]],
+    skip_unsupported_langs: bool = True,
+    workers: int = 0,
+    batch_size: int = 16,
+    results: Optional[ResultCache] = None,
+    profile: Optional[ScanProfile] = None,
+) -> Iterable[Tuple[Dict[str, Any], Iterable[BadLangTag]]]:
+    """Pair each page with its bad lang tags.
+
+    If _workers_ is greater than zero, pages are scanned in a pool of that
+    many processes, _batch_size_ pages at a time. Results are yielded in the
+    same order as _pages_, and at most a few batches per worker are in
+    flight at once.
+
+    If a _results_ cache is given, revisions that have already been scanned
+    are not scanned again.
+
+    If a _profile_ is given, the time taken to scan each page is recorded in
+    it. Profiling needs pages to be scanned inline, with no _workers_.
+    """
+    if profile is not None and workers > 0:
+        raise ValueError("scans can only be profiled without workers")
+
+    if workers < 1:
+        for batch in chunked(pages, batch_size):
+            for page in batch:
+                content = page_content(page)
+                if results is None:
+                    yield page, _scan(page, content, skip_unsupported_langs, profile)
+                    continue
+
+                revid = page["revisions"][0]["revid"]
+                tags = results.get(revid)
+                if tags is None:
+                    tags = [
+                        tag.as_tuple()
+                        for tag in _scan(page, content, skip_unsupported_langs, profile)
+                    ]
+                    results.put(revid, tags)
+                yield page, [BadLangTag.from_tuple(tag) for tag in tags]
+
+            # Counted once per batch, which costs less than a lock per page.
+            METRICS.inc("pages_total", len(batch))
+            if results is not None:
+                results.commit()
+        return
+
+    max_pending = workers * 4
+    pending: Deque[
+        Tuple[
+            List[Dict[str, Any]],
+            List[Optional[List[TagTuple]]],
+            "Future[Tuple[List[List[TagTuple]], ScanStats]]",
+        ]
+    ]
+    pending = deque()
+
+    def _results() -> Iterator[Tuple[Dict[str, Any], Iterable[BadLangTag]]]:
+        batch, cached, future = pending.popleft()
+        tuples, stats = future.result()
+        SCAN_STATS.add(stats)
+        METRICS.inc("pages_total", len(batch))
+        scanned = iter(tuples)
+        for page, tags in zip(batch, cached):
+            if tags is None:
+                tags = next(scanned)
+                if results is not None:
+                    results.put(page["revisions"][0]["revid"], tags)
+            yield page, [BadLangTag.from_tuple(tag) for tag in tags]
+
+        if results is not None:
+            results.commit()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for batch in chunked(pages, batch_size):
+            contents = [page_content(page) for page in batch]
+            cached = [
+                results.get(page["revisions"][0]["revid"]) if results else None
+                for page in batch
+            ]
+            future = executor.submit(
+                _scan_tuples,
+                [content for content, tags in zip(contents, cached) if tags is None],
+                skip_unsupported_langs,
+            )
+            pending.append((batch, cached, future))
+            if len(pending) >= max_pending:
+                yield from _results()
+
+        while pending:
+            yield from _results()
+
+
+def chunked(items: Iterable[T], size: int) -> Iterator[List[T]]:
+    """Yield lists of up to _size_ consecutive items."""
+    it = iter(items)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if not chunk:
+            break
+        yield chunk
+
+
 def cm_find_bad_lang_tags(
     session: requests.Session,
     category: str,
     *,
     url: str,
     chunk_size: int = 20,
+    max_chunk_size: int = 500,
     page_limit: int = 60,
     skip_unsupported_langs: bool = True,
+    prefetch_depth: int = 0,
+    workers: int = 0,
+    cache: Optional[RevisionCache] = None,
+    results: Optional[ResultCache] = None,
+    checkpoint: Optional[Checkpoint] = None,
+    stream: bool = False,
+    profile: Optional[ScanProfile] = None,
 ) -> Iterable[Tuple[Dict[str, Any], Iterable[BadLangTag]]]:
     pages = cm_query(
         session,
         category,
         url=url,
         chunk_size=chunk_size,
+        max_chunk_size=max_chunk_size,
         limit=page_limit,
+        prefetch_depth=prefetch_depth,
+        cache=cache,
+        checkpoint=checkpoint,
+        stream=stream,
+    )
+    yield from scan_pages(
+        pages,
+        skip_unsupported_langs,
+        workers,
+        results=results,
+        profile=profile,
     )
-    for page in pages:
-        if not page.get("revisions"):
-            logging.error(
-                f"missing revision data for '{page}', try reducing chunk_size"
-            )
-            sys.exit(1)
-
-        content_format = page["revisions"][0]["slots"]["main"]["contentformat"]
-        if not content_format == "text/x-wiki":
-            logging.error(f"can't handle format {content_format} for '{page}'")
-            sys.exit(1)
-
-        yield (
-            page,
-            find_bad_lang_tags(
-                page["revisions"][0]["slots"]["main"]["content"],
-                skip_unsupported_langs,
-            ),
-        )
 
 
 def ap_find_bad_lang_tags(
@@ -494,111 +2073,269 @@ def ap_find_bad_lang_tags(
     prefix: str = "",
     namespace: int = 0,
     chunk_size: int = 20,
+    max_chunk_size: int = 500,
     page_limit: int = 60,
     skip_unsupported_langs: bool = True,
+    prefetch_depth: int = 0,
+    shards: int = 1,
+    workers: int = 0,
+    cache: Optional[RevisionCache] = None,
+    results: Optional[ResultCache] = None,
+    checkpoint: Optional[Checkpoint] = None,
+    stream: bool = False,
+    profile: Optional[ScanProfile] = None,
 ) -> Iterable[Tuple[Dict[str, Any], Iterable[BadLangTag]]]:
-    pages = ap_query(
+    if shards > 1:
+        pages = sharded_ap_query(
+            session,
+            url=url,
+            prefix=prefix,
+            namespace=namespace,
+            chunk_size=chunk_size,
+            max_chunk_size=max_chunk_size,
+            limit=page_limit,
+            shards=shards,
+            cache=cache,
+            stream=stream,
+        )
+    else:
+        pages = ap_query(
+            session,
+            url=url,
+            prefix=prefix,
+            namespace=namespace,
+            chunk_size=chunk_size,
+            max_chunk_size=max_chunk_size,
+            limit=page_limit,
+            prefetch_depth=prefetch_depth,
+            cache=cache,
+            checkpoint=checkpoint,
+            stream=stream,
+        )
+
+    yield from scan_pages(
+        pages,
+        skip_unsupported_langs,
+        workers,
+        results=results,
+        profile=profile,
+    )
+
+
+def pageids_find_bad_lang_tags(
+    session: requests.Session,
+    pageids: List[int],
+    *,
+    url: str,
+    category: Optional[str] = None,
+    chunk_size: int = 20,
+    skip_unsupported_langs: bool = True,
+    workers: int = 0,
+    cache: Optional[RevisionCache] = None,
+    results: Optional[ResultCache] = None,
+    profile: Optional[ScanProfile] = None,
+) -> Iterable[Tuple[Dict[str, Any], Iterable[BadLangTag]]]:
+    pages = pageids_query(
         session,
+        pageids,
         url=url,
+        chunk_size=chunk_size,
+        category=category,
+        cache=cache,
+    )
+    yield from scan_pages(
+        pages,
+        skip_unsupported_langs,
+        workers,
+        results=results,
+        profile=profile,
+    )
+
+
+def dump_find_bad_lang_tags(
+    path: str,
+    *,
+    prefix: str = "",
+    namespace: Optional[int] = None,
+    page_limit: Optional[int] = None,
+    skip_unsupported_langs: bool = True,
+    workers: int = 0,
+    results: Optional[ResultCache] = None,
+    profile: Optional[ScanProfile] = None,
+) -> Iterable[Tuple[Dict[str, Any], Iterable[BadLangTag]]]:
+    pages = dump_query(
+        path,
         prefix=prefix,
         namespace=namespace,
-        chunk_size=chunk_size,
         limit=page_limit,
     )
+    yield from scan_pages(
+        pages,
+        skip_unsupported_langs,
+        workers,
+        results=results,
+        profile=profile,
+    )
 
-    for page in pages:
-        if not page.get("revisions"):
-            logging.error(
-                f"missing revision data for '{page}', try reducing chunk_size"
-            )
-            sys.exit(1)
 
-        content_format = page["revisions"][0]["slots"]["main"]["contentformat"]
-        if not content_format == "text/x-wiki":
-            logging.error(f"can't handle format {content_format} for '{page}'")
-            sys.exit(1)
+CSV_HEADER = PAGE_FIELDS + TAG_FIELDS
 
-        yield (
-            page,
-            find_bad_lang_tags(
-                page["revisions"][0]["slots"]["main"]["content"],
-                skip_unsupported_langs,
-            ),
+# Number of pages `write_tags` writes between updates to METRICS.
+WRITE_METRICS_BATCH_SIZE = 100
+
+
+def tag_rows(
+    page: Dict[str, Any],
+    tags: Iterable[BadLangTag],
+) -> Tuple[PageRow, List[TagRow]]:
+    """Return a row of metadata for _page_ and a row for each of its _tags_,
+    in the order given by PAGE_COLUMNS and TAG_FIELDS."""
+    revision = page["revisions"][0]
+    page_row = (
+        page["pageid"],
+        page["title"],
+        revision["revid"],
+        revision["timestamp"],
+        page.get("ns"),
+    )
+
+    rows = []
+    for tag in tags:
+        orphaned = True if tag.end is None else False
+        # An unsupported lang check isn't needed for tags without a lang,
+        # so runs with --skip_unsupported_langs never load the lexers.
+        unsupported = (
+            True
+            if tag.tag == "highlight"
+            and (tag.lang is None or tag.lang not in all_lexers())
+            else False
         )
+        end_lineno = tag.end.lineno if tag.end is not None else None
+        end_start_index = tag.end.start if tag.end is not None else None
+        end_end_index = tag.end.end if tag.end is not None else None
+        rows.append(
+            (
+                tag.lang,
+                tag.tag,
+                tag.start.lineno,
+                end_lineno,
+                unsupported,
+                orphaned,
+                tag.start.text,
+                tag.end.text if tag.end else None,
+                tag.start.start,
+                tag.start.end,
+                end_start_index,
+                end_end_index,
+                tag.kind,
+            )
+        )
+
+    return page_row, rows
+
+
+def write_tags(
+    tags: Iterable[Tuple[Dict[str, Any], Iterable[BadLangTag]]],
+    writer: TagWriter,
+    checkpoint: Optional[Checkpoint] = None,
+) -> None:
+    """Write every page and its tags with _writer_, then flush it. Progress is
+    recorded in _checkpoint_, if given."""
+    # Counts are added to METRICS in batches, which costs less than a lock
+    # per page.
+    written = 0
+    kinds: Counter = Counter()
+
+    for page, _tags in tags:
+        page_row, rows = tag_rows(page, _tags)
+        writer.write(page_row, rows)
+        if checkpoint is not None:
+            checkpoint.written(page, writer)
+
+        written += 1
+        for row in rows:
+            kinds[row[-1]] += 1
+        if written == WRITE_METRICS_BATCH_SIZE:
+            METRICS.inc("pages_written_total", written)
+            METRICS.inc_labelled("tags_written_total", "kind", kinds)
+            written = 0
+            kinds.clear()
+
+    writer.flush()
+    METRICS.inc("pages_written_total", written)
+    METRICS.inc_labelled("tags_written_total", "kind", kinds)
 
 
 def to_csv(
     tags: Iterable[Tuple[Dict[str, Any], Iterable[BadLangTag]]],
     *,
     out_file: TextIO = sys.stdout,
+    header: bool = True,
+    checkpoint: Optional[Checkpoint] = None,
+):
+    write_tags(tags, CSVWriter(out_file, header=header), checkpoint)
+
+
+def merge_csv(
+    tags: Iterable[Tuple[Dict[str, Any], Iterable[BadLangTag]]],
+    *,
+    previous: TextIO,
+    replace: Iterable[int],
+    out_file: TextIO = sys.stdout,
 ):
+    """Copy rows from a _previous_ CSV file, except those for pages in
+    _replace_, then write rows for _tags_."""
+    stale = set(replace)
+    reader = csv.reader(previous)
     writer = csv.writer(out_file, quoting=csv.QUOTE_ALL)
-    writer.writerow(
-        (
-            "page_id",
-            "page_title",
-            "revision_id",
-            "revision_timestamp",
-            "lang",
-            "tag",
-            "start_lineno",
-            "end_lineno",
-            "unsupported_lang",
-            "orphaned",
-            "start",
-            "end",
-            "start_start_index",
-            "start_end_index",
-            "end_start_index",
-            "end_end_index",
-            "kind",
-        )
-    )
+    writer.writerow(next(reader))
 
-    for page, _tags in tags:
-        revision = page["revisions"][0]
-        row = [
-            page["pageid"],
-            page["title"],
-            revision["revid"],
-            revision["timestamp"],
-        ]
+    for row in reader:
+        if int(row[0]) not in stale:
+            writer.writerow(row)
 
-        for tag in _tags:
-            orphaned = True if tag.end is None else False
-            unsupported = (
-                True if tag.tag == "highlight" and tag.lang not in ALL_LEXERS else False
-            )
-            end_lineno = tag.end.lineno if tag.end is not None else None
-            end_start_index = tag.end.start if tag.end is not None else None
-            end_end_index = tag.end.end if tag.end is not None else None
-            writer.writerow(
-                row
-                + [
-                    tag.lang,
-                    tag.tag,
-                    tag.start.lineno,
-                    end_lineno,
-                    unsupported,
-                    orphaned,
-                    tag.start.text,
-                    tag.end.text if tag.end else None,
-                    tag.start.start,
-                    tag.start.end,
-                    end_start_index,
-                    end_end_index,
-                    tag.kind,
-                ]
-            )
+    to_csv(tags, out_file=out_file, header=False)
+
+
+def merge_jsonl(
+    tags: Iterable[Tuple[Dict[str, Any], Iterable[BadLangTag]]],
+    *,
+    previous: TextIO,
+    replace: Iterable[int],
+    out_file: TextIO = sys.stdout,
+):
+    """Copy lines from a _previous_ JSON Lines file, except those for pages
+    in _replace_, then write lines for _tags_."""
+    stale = set(replace)
+
+    for line in previous:
+        if json.loads(line)["page_id"] not in stale:
+            out_file.write(line)
+
+    write_tags(tags, JSONLinesWriter(out_file))
+
+
+OUTPUT_FORMATS = ("csv", "jsonl", "columnar", "sqlite")
+
+
+def server_timestamp(session: requests.Session, url: str) -> str:
+    """Return the MediaWiki server's current time as an ISO 8601 string."""
+    response = session.get(
+        url,
+        params={"action": "query", "curtimestamp": "true", "format": "json"},
+    )
+    response.raise_for_status()
+    return response.json()["curtimestamp"]
 
 
 if __name__ == "__main__":
     import argparse
+    import atexit
 
     URL = "https://rosettacode.org/w/api.php"
 
     parser = argparse.ArgumentParser(description="Find bad lang tags on Rosetta Code.")
-    group = parser.add_mutually_exclusive_group(required=True)
+    group = parser.add_mutually_exclusive_group()
 
     group.add_argument(
         "--category",
@@ -611,6 +2348,14 @@ if __name__ == "__main__":
         help="target all pages in a Rosetta Code namespace, given as an integer",
     )
 
+    parser.add_argument(
+        "--dump",
+        help=(
+            "scan a MediaWiki XML dump (optionally .bz2 or .gz) instead of "
+            "querying the API, --namespace and --prefix filter pages"
+        ),
+    )
+
     parser.add_argument(
         "--prefix",
         default="",
@@ -631,7 +2376,27 @@ if __name__ == "__main__":
         type=int,
         default=20,
         dest="chunk_size",
-        help="maximum number of pages to fetch per request (default: 20)",
+        help=(
+            "number of pages to fetch in the first request, later requests "
+            "fetch more or fewer pages to suit the server (default: 20)"
+        ),
+    )
+
+    parser.add_argument(
+        "--max-chunk-size",
+        type=int,
+        default=500,
+        dest="max_chunk_size",
+        help="maximum number of pages to fetch per request (default: 500)",
+    )
+
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help=(
+            "decode API responses incrementally, scanning each page as soon "
+            "as it arrives, --prefetch then counts pages instead of responses"
+        ),
     )
 
     parser.add_argument(
@@ -642,53 +2407,645 @@ if __name__ == "__main__":
         help="maximum(ish) number of pages to fetch per session (default: 500)",
     )
 
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=2,
+        dest="prefetch_depth",
+        help=(
+            "number of API responses to fetch ahead of the scanner, "
+            "0 to disable (default: 2)"
+        ),
+    )
+
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        help=(
+            "split a namespace into this many title ranges and fetch them "
+            "concurrently, --page-limit is split between shards "
+            "(default: 1, ignored when targeting a category)"
+        ),
+    )
+
+    parser.add_argument(
+        "--rate-limit",
+        type=float,
+        default=None,
+        dest="rate_limit",
+        help="average number of API requests per second, shared by all shards",
+    )
+
+    parser.add_argument(
+        "--burst",
+        type=int,
+        default=1,
+        help="number of API requests allowed at once under --rate-limit (default: 1)",
+    )
+
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=None,
+        help="maximum number of API requests in flight at once (default: no limit)",
+    )
+
+    parser.add_argument(
+        "--maxlag",
+        type=int,
+        default=5,
+        help=(
+            "wait and retry while the wiki's database lag is more than this many "
+            "seconds, -1 to disable (default: 5)"
+        ),
+    )
+
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="scan pages in this many worker processes, 0 to scan inline (default: 0)",
+    )
+
+    parser.add_argument(
+        "--cache",
+        help=(
+            "path to an SQLite cache of page content and scan results, only "
+            "revisions that are not already cached are downloaded or scanned"
+        ),
+    )
+
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=1024,
+        dest="cache_size",
+        help="maximum size of the revision cache in MiB (default: 1024)",
+    )
+
     parser.add_argument(
         "--url",
         default=URL,
         help=f"target MediaWiki URL (default: {URL})",
     )
 
+    parser.add_argument(
+        "--search",
+        action="store_true",
+        help=(
+            "find candidate pages with CirrusSearch insource: queries, then "
+            "download content for those pages only"
+        ),
+    )
+
+    parser.add_argument(
+        "--search-query",
+        action="append",
+        dest="search_queries",
+        metavar="QUERY",
+        help=(
+            "search for candidate pages with this query instead of the "
+            "default insource: queries, can be given more than once"
+        ),
+    )
+
+    parser.add_argument(
+        "--since",
+        help=(
+            "only rescan pages edited since this ISO 8601 timestamp, merging "
+            "their rows into the existing --outfile and dropping rows for "
+            "pages deleted since then"
+        ),
+    )
+
+    parser.add_argument(
+        "--state-file",
+        dest="state_file",
+        help=(
+            "read --since from this JSON file, if it exists, and record the "
+            "start time of each successful run to it"
+        ),
+    )
+
+    parser.add_argument(
+        "--checkpoint",
+        help=(
+            "periodically save progress through a --namespace or --category "
+            "scan to this JSON file, it is deleted when the scan finishes"
+        ),
+    )
+
+    parser.add_argument(
+        "--checkpoint-interval",
+        type=float,
+        default=30,
+        dest="checkpoint_interval",
+        help="minimum number of seconds between checkpoints (default: 30)",
+    )
+
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help=(
+            "carry on from the last --checkpoint, if there is one, appending to "
+            "the existing --outfile"
+        ),
+    )
+
     parser.add_argument(
         "--outfile",
         "-o",
-        nargs="?",
-        type=argparse.FileType("w"),
-        default=sys.stdout,
+        default="-",
         help="destination file (default: stdout)",
     )
-    # parser.add_argument(
-    #     "--debug",
-    #     "-d",
-    #     action="store_true",
-    #     help="enable debugging output (default: false)",
-    # )
+
+    parser.add_argument(
+        "--format",
+        choices=OUTPUT_FORMATS,
+        default="csv",
+        dest="output_format",
+        help=(
+            "output format, 'columnar' writes page and tag tables to a Parquet "
+            "directory if pyarrow is installed, or an SQLite database otherwise, "
+            "'sqlite' always writes an SQLite database, updating it in place "
+            "(default: csv)"
+        ),
+    )
+    parser.add_argument(
+        "--backend",
+        choices=("requests", "aiohttp"),
+        default="requests",
+        help=(
+            "HTTP client used to fetch pages, 'aiohttp' fetches all shards over "
+            "one connection pool on an event loop and needs aiohttp "
+            "(default: requests)"
+        ),
+    )
+
+    parser.add_argument(
+        "--progress-interval",
+        type=float,
+        default=30,
+        dest="progress_interval",
+        help=(
+            "seconds between progress reports on stderr, 0 to report only at "
+            "the end (default: 30)"
+        ),
+    )
+
+    parser.add_argument(
+        "--metrics",
+        help="write requests, latency, throughput and tag counts to this file at exit",
+    )
+
+    parser.add_argument(
+        "--metrics-format",
+        choices=METRICS_FORMATS,
+        default="json",
+        dest="metrics_format",
+        help=(
+            "format of the --metrics file, 'prometheus' writes the text format "
+            "read by node_exporter's textfile collector (default: json)"
+        ),
+    )
+
+    parser.add_argument(
+        "--profile-scan",
+        dest="profile_scan",
+        metavar="FILE",
+        help=(
+            "time the scan of every page and of each kind of match, and write "
+            "a report with the slowest pages to FILE at exit"
+        ),
+    )
+
+    parser.add_argument(
+        "--profile-slowest",
+        type=int,
+        default=20,
+        dest="profile_slowest",
+        help="number of pages to list in the --profile-scan report (default: 20)",
+    )
+
+    parser.add_argument(
+        "--profile-patterns",
+        action="store_true",
+        dest="profile_patterns",
+        help=(
+            "also run each RE_SPEC pattern on its own over the slowest pages, "
+            "to see which one is expensive"
+        ),
+    )
+
+    parser.add_argument(
+        "--debug",
+        "-d",
+        action="store_true",
+        help="enable debugging output, including every HTTP request (default: false)",
+    )
 
     args = parser.parse_args()
-    session = get_session()
 
-    if args.namespace is not None:
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+
+    if args.dump is None and args.namespace is None and args.category is None:
+        parser.error("one of the arguments --category --namespace --dump is required")
+
+    if args.dump is not None and args.category is not None:
+        parser.error("argument --category: not allowed with argument --dump")
+
+    if args.dump is not None and (args.since or args.state_file):
+        parser.error("arguments --since and --state-file: not allowed with --dump")
+
+    if args.backend == "aiohttp" and (args.dump or args.cache):
+        parser.error("argument --backend: aiohttp can't be used with --dump or --cache")
+
+    if args.backend == "aiohttp" and importlib.util.find_spec("aiohttp") is None:
+        parser.error(
+            "argument --backend: aiohttp isn't installed, install it with "
+            "'python -m pip install -r requirements-optional.txt'"
+        )
+
+    if args.search_queries and not args.search:
+        parser.error("argument --search-query: needs --search")
+
+    if args.search and (
+        args.dump or args.since or args.shards > 1 or args.backend == "aiohttp"
+    ):
+        parser.error(
+            "argument --search: not allowed with --dump, --since, --shards "
+            "or --backend=aiohttp"
+        )
+
+    if args.stream and (
+        args.dump or args.cache or args.search or args.backend == "aiohttp"
+    ):
+        parser.error(
+            "argument --stream: not allowed with --dump, --cache, --search "
+            "or --backend=aiohttp"
+        )
+
+    since = args.since
+    if since is None and args.state_file and os.path.exists(args.state_file):
+        with open(args.state_file, encoding="utf-8") as fd:
+            since = json.load(fd)["timestamp"]
+
+    if since is not None and not os.path.isfile(args.outfile):
+        parser.error("incremental scans need an existing --outfile to merge into")
+
+    if args.output_format in ("columnar", "sqlite") and args.outfile == "-":
+        parser.error(
+            f"argument --format: {args.output_format} output needs an --outfile"
+        )
+
+    if args.output_format == "columnar" and since is not None:
+        parser.error("argument --format: columnar output can't be merged into")
+
+    if args.profile_patterns and not args.profile_scan:
+        parser.error("argument --profile-patterns: needs --profile-scan")
+
+    if args.profile_scan and args.workers > 0:
+        parser.error("argument --profile-scan: not allowed with --workers")
+
+    if args.profile_slowest < 1:
+        parser.error("argument --profile-slowest: must be at least 1")
+
+    if args.resume and not args.checkpoint:
+        parser.error("argument --resume: needs a --checkpoint file")
+
+    if args.checkpoint:
+        if args.dump is not None or since is not None or args.search:
+            parser.error(
+                "argument --checkpoint: not allowed with --dump, --since or --search"
+            )
+        if args.shards > 1 or args.backend != "requests":
+            parser.error(
+                "argument --checkpoint: not allowed with --shards or --backend"
+            )
+        if args.outfile == "-" or args.output_format == "columnar":
+            parser.error(
+                "argument --checkpoint: needs a csv, jsonl or sqlite --outfile"
+            )
+
+    checkpoint = None
+    resuming = False
+    if args.checkpoint:
+        checkpoint = Checkpoint(
+            args.checkpoint,
+            target={
+                "url": args.url,
+                "namespace": args.namespace,
+                "category": args.category,
+                "prefix": args.prefix,
+                "skip_unsupported_langs": args.skip_unsupported_langs,
+                "format": args.output_format,
+                "outfile": os.path.abspath(args.outfile),
+            },
+            interval=args.checkpoint_interval,
+        )
+        if args.resume:
+            try:
+                resuming = checkpoint.load()
+            except CheckpointMismatchError as err:
+                parser.error(f"argument --resume: {err}")
+            if resuming and not os.path.exists(args.outfile):
+                parser.error("argument --resume: --outfile is missing")
+
+    profile = None
+    if args.profile_scan:
+        profile = ScanProfile(
+            slowest=args.profile_slowest,
+            patterns=(
+                [
+                    (name, re.compile(pattern, RE_BAD_LANG.flags))
+                    for name, pattern in RE_SPEC
+                ]
+                if args.profile_patterns
+                else None
+            ),
+        )
+
+    # Report and save metrics, and the profile, however the run ends.
+    if profile is not None:
+        atexit.register(profile.write, args.profile_scan)
+    if args.metrics:
+        atexit.register(write_metrics, args.metrics, args.metrics_format)
+    atexit.register(ProgressReporter(METRICS, args.progress_interval).start().stop)
+
+    session = get_session(
+        rate_limit=args.rate_limit,
+        pool_size=max(10, args.shards),
+        burst=args.burst,
+        concurrency=args.concurrency,
+        maxlag=args.maxlag if args.maxlag >= 0 else None,
+    )
+
+    cache = (
+        RevisionCache(args.cache, max_bytes=args.cache_size * 1024 * 1024)
+        if args.cache
+        else None
+    )
+
+    results = (
+        ResultCache(
+            args.cache,
+            skip_unsupported_langs=args.skip_unsupported_langs,
+            scanner_version=scanner_version(args.skip_unsupported_langs),
+        )
+        if args.cache
+        else None
+    )
+
+    category = None
+    if args.category:
+        category = (
+            args.category
+            if args.category.startswith("Category:")
+            else "Category:" + args.category
+        )
+
+    started = ""
+    pageids: List[int] = []
+    deleted: List[int] = []
+
+    if since is not None:
+        pageids, started = recent_changes(
+            session,
+            url=args.url,
+            since=since,
+            namespace=args.namespace,
+            prefix=args.prefix if category is None else "",
+        )
+        # Deleted pages aren't in recent changes, and we don't know which
+        # categories they were in, so drop rows for every one of them.
+        deleted = deleted_pages(
+            session,
+            url=args.url,
+            since=since,
+            namespace=args.namespace,
+            prefix=args.prefix if category is None else "",
+        )
+        tags = pageids_find_bad_lang_tags(
+            session,
+            pageids,
+            url=args.url,
+            category=category,
+            chunk_size=args.chunk_size,
+            skip_unsupported_langs=args.skip_unsupported_langs,
+            workers=args.workers,
+            cache=cache,
+            results=results,
+            profile=profile,
+        )
+    elif args.search:
+        if args.state_file:
+            started = server_timestamp(session, args.url)
+        pageids = search_candidates(
+            session,
+            url=args.url,
+            queries=args.search_queries or SEARCH_QUERIES,
+            namespace=args.namespace,
+            category=category,
+            prefix=args.prefix if category is None else "",
+        )
+        tags = pageids_find_bad_lang_tags(
+            session,
+            pageids[: args.page_limit],
+            url=args.url,
+            category=category,
+            chunk_size=args.chunk_size,
+            skip_unsupported_langs=args.skip_unsupported_langs,
+            workers=args.workers,
+            cache=cache,
+            results=results,
+            profile=profile,
+        )
+    elif args.dump is not None:
+        tags = dump_find_bad_lang_tags(
+            args.dump,
+            prefix=args.prefix,
+            namespace=args.namespace,
+            page_limit=args.page_limit,
+            skip_unsupported_langs=args.skip_unsupported_langs,
+            workers=args.workers,
+            results=results,
+            profile=profile,
+        )
+    elif args.backend == "aiohttp":
+        import async_api
+
+        if args.state_file:
+            started = server_timestamp(session, args.url)
+
+        def _async_pages(session: "async_api.AsyncSession") -> Any:
+            if category is not None:
+                return async_api.cm_query(
+                    session,
+                    category,
+                    url=args.url,
+                    chunk_size=args.chunk_size,
+                    max_chunk_size=args.max_chunk_size,
+                    limit=args.page_limit,
+                )
+            if args.shards > 1:
+                return async_api.sharded_ap_query(
+                    session,
+                    url=args.url,
+                    prefix=args.prefix,
+                    namespace=args.namespace,
+                    chunk_size=args.chunk_size,
+                    max_chunk_size=args.max_chunk_size,
+                    limit=args.page_limit,
+                    shards=args.shards,
+                )
+            return async_api.ap_query(
+                session,
+                url=args.url,
+                prefix=args.prefix,
+                namespace=args.namespace,
+                chunk_size=args.chunk_size,
+                max_chunk_size=args.max_chunk_size,
+                limit=args.page_limit,
+            )
+
+        pages = async_api.iterate(
+            _async_pages,
+            prefetch_depth=args.prefetch_depth,
+            scheduler=session.scheduler,
+            pool_size=max(10, args.shards),
+        )
+        tags = scan_pages(
+            pages,
+            args.skip_unsupported_langs,
+            args.workers,
+            profile=profile,
+        )
+    elif args.namespace is not None:
+        if args.state_file:
+            started = (checkpoint and checkpoint.started) or server_timestamp(
+                session, args.url
+            )
         tags = ap_find_bad_lang_tags(
             session,
             url=args.url,
             prefix=args.prefix,
             namespace=args.namespace,
             chunk_size=args.chunk_size,
+            max_chunk_size=args.max_chunk_size,
             page_limit=args.page_limit,
             skip_unsupported_langs=args.skip_unsupported_langs,
+            prefetch_depth=args.prefetch_depth,
+            shards=args.shards,
+            workers=args.workers,
+            cache=cache,
+            results=results,
+            profile=profile,
+            checkpoint=checkpoint,
+            stream=args.stream,
         )
     else:
-        category = (
-            args.category
-            if args.category.startswith("Category:")
-            else "Category:" + args.category
-        )
+        assert category is not None
+        if args.state_file:
+            started = (checkpoint and checkpoint.started) or server_timestamp(
+                session, args.url
+            )
         tags = cm_find_bad_lang_tags(
             session,
             category,
             url=args.url,
             chunk_size=args.chunk_size,
+            max_chunk_size=args.max_chunk_size,
             page_limit=args.page_limit,
             skip_unsupported_langs=args.skip_unsupported_langs,
+            prefetch_depth=args.prefetch_depth,
+            workers=args.workers,
+            cache=cache,
+            results=results,
+            profile=profile,
+            checkpoint=checkpoint,
+            stream=args.stream,
         )
 
-    to_csv(tags, out_file=args.outfile)
+    if checkpoint:
+        checkpoint.started = started
+
+    if args.output_format == "sqlite":
+        # Pages are upserted, so incremental runs update the database in place.
+        with SQLiteWriter(
+            args.outfile,
+            scanner_version=scanner_version(args.skip_unsupported_langs),
+        ) as store:
+            store.delete_pages(deleted)
+            write_tags(tags, store, checkpoint)
+    elif since is not None:
+        merge = merge_jsonl if args.output_format == "jsonl" else merge_csv
+        # Write to a temporary file first, so a failed run leaves the
+        # previous results in place.
+        handle, merged_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(args.outfile))
+        )
+        try:
+            with open(args.outfile, newline="", encoding="utf-8") as previous:
+                with open(handle, "w", newline="", encoding="utf-8") as merged:
+                    merge(
+                        tags,
+                        previous=previous,
+                        replace=pageids + deleted,
+                        out_file=merged,
+                    )
+            os.replace(merged_path, args.outfile)
+        except BaseException:
+            os.remove(merged_path)
+            raise
+    elif args.output_format == "columnar":
+        with columnar_writer(
+            args.outfile,
+            scanner_version=scanner_version(args.skip_unsupported_langs),
+        ) as writer:
+            write_tags(tags, writer)
+    else:
+        resume = False
+        if checkpoint and checkpoint.offset is not None:
+            # Drop rows written after the checkpoint, they'll be written again.
+            with open(args.outfile, "r+b") as previous_output:
+                previous_output.truncate(checkpoint.offset)
+            resume = True
+
+        with contextlib.ExitStack() as stack:
+            output: TextIO = sys.stdout
+            if args.outfile != "-":
+                output = stack.enter_context(
+                    open(
+                        args.outfile,
+                        "a" if resume else "w",
+                        newline="",
+                        encoding="utf-8",
+                    )
+                )
+            if checkpoint:
+                checkpoint.out_file = output
+            if args.output_format == "jsonl":
+                write_tags(tags, JSONLinesWriter(output), checkpoint)
+            else:
+                to_csv(
+                    tags,
+                    out_file=output,
+                    header=not resume,
+                    checkpoint=checkpoint,
+                )
+
+    if checkpoint:
+        checkpoint.remove()
+
+    if cache:
+        cache.close()
+
+    if results:
+        results.close()
+
+    logging.info(SCAN_STATS.report())
+
+    if args.state_file and started:
+        with open(args.state_file, "w", encoding="utf-8") as fd:
+            json.dump({"timestamp": started}, fd)
@@ -1,20 +1,48 @@
 import json
 import logging
+import os
 import sys
+import time
 
+from collections import Counter
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any
+from typing import Callable
+from typing import Deque
 from typing import Dict
 from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import TextIO
+from typing import Tuple
 
 import requests
 
+from api_scheduler import TokenBucket
 from bot_login import login
 
 from find_bad_lang_tags import BadLangTag
+from find_bad_lang_tags import LangTagMatch
 from find_bad_lang_tags import ap_find_bad_lang_tags
+from find_bad_lang_tags import cm_find_bad_lang_tags
+from find_bad_lang_tags import dump_find_bad_lang_tags
+from find_bad_lang_tags import find_bad_lang_tags
 from find_bad_lang_tags import get_session
+from find_bad_lang_tags import pageids_query
+from find_bad_lang_tags import scan_pages
+from find_bad_lang_tags import scanner_version
 
-logging.basicConfig(level=logging.DEBUG)
+from revision_cache import ResultCache
+from revision_cache import RevisionCache
+
+from run_metrics import METRICS
+from run_metrics import METRICS_FORMATS
+from run_metrics import ProgressReporter
+from run_metrics import write_metrics
 
 
 def post_page_edit(
@@ -44,40 +72,78 @@ def post_page_edit(
     resp = session.post(url, data=params)
     resp.raise_for_status()
 
-    logging.debug(json.dumps(resp.json(), indent=4))
+    data = resp.json()
+    logging.debug(json.dumps(data, indent=4))
+    return data
 
 
 class NoLegacyTagsError(Exception):
     """Exception raised when no legacy lang tags are found in a page."""
 
 
+class UneditablePageError(Exception):
+    """Exception raised when a page has no revision content, or content that
+    isn't wiki text."""
+
+
+def editable_content(page: Dict[str, Any]) -> str:
+    """Return the wiki text of a page's latest revision. Unlike
+    `find_bad_lang_tags.page_content`, raise an UneditablePageError, with an
+    edit log code, instead of exiting, so it is safe to call from a worker
+    thread."""
+    if not page.get("revisions"):
+        raise UneditablePageError("missing-revision")
+
+    slot = page["revisions"][0]["slots"]["main"]
+    if slot["contentformat"] != "text/x-wiki":
+        raise UneditablePageError("unsupported-content-format")
+
+    return slot["content"]
+
+
+def legacy_replacements(
+    tags: Iterable[BadLangTag],
+) -> Iterator[Tuple[LangTagMatch, str]]:
+    """Generate (match, replacement) for the start and end tag of every legacy
+    lang tag in _tags_, in order."""
+    for tag in tags:
+        if tag.kind not in ("LANG", "BARE"):
+            continue
+
+        assert tag.end
+        lang = tag.lang.strip().lower() if tag.lang else None
+        if lang:
+            yield tag.start, f'<syntaxhighlight lang="{lang}">'
+        else:
+            # note that we're not setting a lang attribute if the legacy
+            # tag did not have one.
+            yield tag.start, "<syntaxhighlight>"
+        yield tag.end, "</syntaxhighlight>"
+
+
 def replace_legacy_lang(
     wiki_text: str,
     page: Dict[str, Any],
     tags: Iterable[BadLangTag],
 ) -> str:
-    legacy_tags = [t for t in tags if t.kind in ("LANG", "BARE")]
-    if not legacy_tags:
+    replacements = list(legacy_replacements(tags))
+    if not replacements:
         # Force the caller to deal with this.
         raise NoLegacyTagsError(page["title"])
+    return apply_replacements(wiki_text, replacements)
+
 
+def apply_replacements(
+    wiki_text: str,
+    replacements: Iterable[Tuple[LangTagMatch, str]],
+) -> str:
     parts = []
     idx = 0
 
-    for tag in legacy_tags:
-        assert tag.end
-        lang = tag.lang.strip().lower() if tag.lang else None
-        parts.append(wiki_text[idx : tag.start.start])
-        if lang:
-            parts.append(f'<syntaxhighlight lang="{lang}">')
-        else:
-            # note that we're not setting a lang attribute if the legacy
-            # tag did not have one.
-            parts.append(f"<syntaxhighlight>")
-        idx = tag.start.end
-        parts.append(wiki_text[idx : tag.end.start])
-        parts.append("</syntaxhighlight>")
-        idx = tag.end.end
+    for match, replacement in replacements:
+        parts.append(wiki_text[idx : match.start])
+        parts.append(replacement)
+        idx = match.end
 
     parts.append(wiki_text[idx:])
     return "".join(parts)
@@ -121,23 +187,703 @@ def replace_one(
     )
 
 
+# Edit errors that are worth trying again after a pause.
+RETRY_EDIT_ERRORS = frozenset(["ratelimited", "maxlag", "readonly"])
+RETRY_EDIT_DELAY = 10.0
+
+# Statuses of pages that a resumed run doesn't need to look at again.
+DONE_STATUSES = frozenset(["edited", "nochange", "no-legacy-tags"])
+
+
+class EditLog:
+    """A JSON Lines record of the outcome of each page edit, so an interrupted
+    run can skip pages that have already been dealt with.
+
+    _out_file_ is not closed.
+    """
+
+    def __init__(self, out_file: TextIO, done: Optional[Set[int]] = None) -> None:
+        self.out_file = out_file
+        self.done = done or set()
+        self.counts: Counter = Counter()
+
+    @classmethod
+    def read_done(cls, path: str) -> Set[int]:
+        """Return the ids of pages in the log at _path_ that are done."""
+        done: Set[int] = set()
+        if not os.path.exists(path):
+            return done
+
+        with open(path, encoding="utf-8") as fd:
+            for line in fd:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A partly written last line from an interrupted run.
+                    continue
+                if record["status"] in DONE_STATUSES:
+                    done.add(record["page_id"])
+        return done
+
+    def record(self, page: Dict[str, Any], status: str, **details: Any) -> None:
+        self.counts[status] += 1
+        self.out_file.write(
+            json.dumps(
+                {
+                    "page_id": page["pageid"],
+                    "page_title": page["title"],
+                    "revision_id": page["revisions"][0]["revid"],
+                    "status": status,
+                    **details,
+                },
+                ensure_ascii=False,
+            )
+            + "\n"
+        )
+        self.out_file.flush()
+
+
+def fix_page(
+    session: requests.Session,
+    page: Dict[str, Any],
+    tags: Iterable[BadLangTag],
+    *,
+    url: str,
+    csrf_token: str,
+    start_timestamp: str,
+    edits: Optional[TokenBucket] = None,
+    attempts: int = 3,
+    fetch_pages: Optional[Callable[[List[int]], List[Dict[str, Any]]]] = None,
+) -> Tuple[str, Dict[str, Any]]:
+    """Replace legacy lang tags on one page, and return a status and details
+    for the edit log.
+
+    If someone else has edited the page since it was scanned, the page is
+    fetched and scanned again, then the edit is retried, up to _attempts_
+    times. _edits_ limits the rate at which edits are submitted.
+    _fetch_pages_ is called with a list of page ids to fetch pages again,
+    defaulting to `pageids_query` with _session_.
+
+    Raise an UneditablePageError if the page, or the page fetched again
+    after an edit conflict, has no wiki text to edit.
+    """
+    details: Dict[str, Any] = {}
+
+    for attempt in range(attempts):
+        old_wiki_text = editable_content(page)
+        revision = page["revisions"][0]
+
+        try:
+            new_wiki_text = replace_legacy_lang(old_wiki_text, page, tags)
+        except NoLegacyTagsError:
+            return "no-legacy-tags", details
+
+        if old_wiki_text.count("\n") != new_wiki_text.count("\n"):
+            return "error", {**details, "code": "line-count-changed"}
+
+        if edits:
+            edits.acquire()
+
+        data = post_page_edit(
+            session,
+            url,
+            csrf_token,
+            start_timestamp,
+            new_wiki_text,
+            page["pageid"],
+            revision["revid"],
+            revision["timestamp"],
+        )
+
+        if "edit" in data:
+            result = data["edit"]
+            if result.get("result") != "Success":
+                return "error", {**details, "code": result.get("result")}
+            if "nochange" in result:
+                return "nochange", details
+            return "edited", {**details, "new_revision_id": result.get("newrevid")}
+
+        code = data.get("error", {}).get("code", "unknown")
+        details["attempts"] = attempt + 1
+
+        if code == "editconflict":
+            logging.info("edit conflict on '%s', fetching it again", page["title"])
+            pages = (
+                fetch_pages([page["pageid"]])
+                if fetch_pages
+                else list(pageids_query(session, [page["pageid"]], url=url))
+            )
+            if not pages:
+                return "error", {**details, "code": "missing"}
+            page = pages[0]
+            # The page text is kept anyway, so tags can slice theirs from it.
+            tags = list(
+                find_bad_lang_tags(editable_content(page), True, lazy_text=True)
+            )
+            details["refetched_revision_id"] = page["revisions"][0]["revid"]
+        elif code in RETRY_EDIT_ERRORS:
+            logging.warning("%s editing '%s', trying again", code, page["title"])
+            time.sleep(RETRY_EDIT_DELAY)
+        else:
+            return "error", {**details, "code": code}
+
+    return "error", {**details, "code": "too-many-attempts"}
+
+
+def fix_pages(
+    session: requests.Session,
+    tags: Iterable[Tuple[Dict[str, Any], Iterable[BadLangTag]]],
+    *,
+    url: str,
+    csrf_token: str,
+    start_timestamp: str,
+    log: EditLog,
+    workers: int = 2,
+    edits_per_minute: float = 10,
+    fetch_pages: Optional[Callable[[List[int]], List[Dict[str, Any]]]] = None,
+) -> Counter:
+    """Replace legacy lang tags on every page in _tags_ that has some,
+    submitting edits from a pool of _workers_ threads.
+
+    Edits are submitted at no more than _edits_per_minute_ on average,
+    regardless of the number of workers. Pages already done according to
+    _log_ are skipped. Return counts of edit statuses.
+
+    _fetch_pages_ is passed on to `fix_page`, and must be safe to call from
+    any worker thread.
+    """
+    edits = TokenBucket(edits_per_minute / 60) if edits_per_minute else None
+    max_pending = workers * 2
+    pending: Deque[Tuple[Dict[str, Any], "Future[Tuple[str, Dict[str, Any]]]"]]
+    pending = deque()
+
+    def _record() -> None:
+        page, future = pending.popleft()
+        try:
+            status, details = future.result()
+        except requests.RequestException as err:
+            status, details = "error", {"code": type(err).__name__}
+        except UneditablePageError as err:
+            logging.error("can't edit '%s': %s", page["title"], err)
+            status, details = "error", {"code": str(err)}
+        logging.info("%s: %s", page["title"], status)
+        METRICS.inc("edits_total", status=status)
+        log.record(page, status, **details)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for page, _tags in tags:
+            if page["pageid"] in log.done:
+                continue
+
+            legacy = [tag for tag in _tags if tag.kind in ("LANG", "BARE")]
+            if not legacy:
+                continue
+
+            future = executor.submit(
+                fix_page,
+                session,
+                page,
+                legacy,
+                url=url,
+                csrf_token=csrf_token,
+                start_timestamp=start_timestamp,
+                edits=edits,
+                fetch_pages=fetch_pages,
+            )
+            pending.append((page, future))
+            if len(pending) >= max_pending:
+                _record()
+
+        while pending:
+            _record()
+
+    return log.counts
+
+
+def unified_diff(
+    page: Dict[str, Any],
+    old_lines: List[str],
+    new_lines: List[str],
+    changed: List[int],
+    *,
+    context: int = 1,
+) -> Iterator[str]:
+    """Generate the lines of a unified diff between _old_lines_ and
+    _new_lines_, which have the same length and differ only at the 0-based
+    line numbers in _changed_.
+
+    Only changed lines and up to _context_ lines either side of them are
+    visited, so large pages with few changes are cheap to diff.
+    """
+    title = page["title"]
+    revision_id = page["revisions"][0]["revid"]
+    yield f"--- {title}\trevision {revision_id}\n"
+    yield f"+++ {title}\tproposed\n"
+
+    # Group changed lines into hunks whose context would touch or overlap.
+    hunks: List[List[int]] = []
+    for lineno in changed:
+        if hunks and lineno - hunks[-1][-1] <= 2 * context + 1:
+            hunks[-1].append(lineno)
+        else:
+            hunks.append([lineno])
+
+    for hunk in hunks:
+        start = max(0, hunk[0] - context)
+        stop = min(len(old_lines), hunk[-1] + context + 1)
+        yield f"@@ -{start + 1},{stop - start} +{start + 1},{stop - start} @@\n"
+
+        lineno = start
+        while lineno < stop:
+            if old_lines[lineno] == new_lines[lineno]:
+                yield f" {old_lines[lineno]}\n"
+                lineno += 1
+                continue
+
+            run = lineno
+            while run < stop and old_lines[run] != new_lines[run]:
+                run += 1
+            for line in old_lines[lineno:run]:
+                yield f"-{line}\n"
+            for line in new_lines[lineno:run]:
+                yield f"+{line}\n"
+            lineno = run
+
+
+def changed_spans(
+    page: Dict[str, Any],
+    wiki_text: str,
+    replacements: List[Tuple[LangTagMatch, str]],
+) -> Dict[str, Any]:
+    """Return a JSON serializable record of each tag that would be replaced
+    on _page_."""
+    return {
+        "page_id": page["pageid"],
+        "page_title": page["title"],
+        "revision_id": page["revisions"][0]["revid"],
+        "changes": [
+            {
+                "lineno": match.lineno,
+                "start": match.start,
+                "end": match.end,
+                "old": wiki_text[match.start : match.end],
+                "new": replacement,
+            }
+            for match, replacement in replacements
+        ],
+    }
+
+
+def dry_run(
+    tags: Iterable[Tuple[Dict[str, Any], Iterable[BadLangTag]]],
+    out_file: TextIO,
+    *,
+    diff_format: str = "unified",
+    context: int = 1,
+) -> Counter:
+    """Write the changes that `fix_pages` would make to each page in _tags_
+    to _out_file_, without editing anything.
+
+    _diff_format_ is "unified" for a unified diff of every changed page, or
+    "spans" for JSON Lines with one object per page listing the replaced
+    tags. Each page is written as soon as it has been scanned, then
+    discarded. Return counts of page statuses.
+    """
+    counts: Counter = Counter()
+
+    for page, _tags in tags:
+        replacements = list(legacy_replacements(_tags))
+        if not replacements:
+            continue
+
+        try:
+            wiki_text = editable_content(page)
+        except UneditablePageError as err:
+            logging.error("can't edit '%s': %s", page["title"], err)
+            counts[str(err)] += 1
+            continue
+
+        # Replacements never contain newlines, so a replaced tag that spans
+        # one would change the line count. `fix_page` refuses those edits.
+        if any("\n" in wiki_text[m.start : m.end] for m, _ in replacements):
+            logging.warning("line count would change on '%s'", page["title"])
+            counts["line-count-changed"] += 1
+            continue
+
+        if diff_format == "spans":
+            out_file.write(
+                json.dumps(
+                    changed_spans(page, wiki_text, replacements),
+                    ensure_ascii=False,
+                )
+                + "\n"
+            )
+            counts["changed"] += 1
+            continue
+
+        new_wiki_text = apply_replacements(wiki_text, replacements)
+        changed = sorted({match.lineno - 1 for match, _ in replacements})
+        out_file.writelines(
+            unified_diff(
+                page,
+                wiki_text.split("\n"),
+                new_wiki_text.split("\n"),
+                changed,
+                context=context,
+            )
+        )
+        counts["changed"] += 1
+
+    return counts
+
+
 if __name__ == "__main__":
-    raise Exception(
-        f"{sys.argv[0]} is incomplete and is not being actively developed. "
-        "You can create an issue at https://github.com/jg-rp/bad-lang-tags/issues "
-        "if you'd like to see this script completed."
-    )
-    # URL = "https://rosettacode.org/w/api.php"
-    # PREFIX = "Define a primitive data type"  # XXX
-
-    # session, csrf_token, start_timestamp = login(
-    #     get_session(), URL, sys.argv[1], sys.argv[2]
-    # )
-
-    # replace_one(
-    #     session,
-    #     csrf_token,
-    #     start_timestamp,
-    #     URL,
-    #     PREFIX,
-    # )
+    import argparse
+    import atexit
+    import contextlib
+    import functools
+    import getpass
+    import importlib.util
+
+    URL = "https://rosettacode.org/w/api.php"
+
+    parser = argparse.ArgumentParser(
+        description="Replace legacy lang tags with syntaxhighlight tags."
+    )
+    group = parser.add_mutually_exclusive_group()
+
+    group.add_argument(
+        "--category",
+        help="target a Rosetta Code category, e.g. 'Category:Programming Tasks'",
+    )
+
+    group.add_argument(
+        "--namespace",
+        type=int,
+        help="target all pages in a Rosetta Code namespace, given as an integer",
+    )
+
+    parser.add_argument(
+        "--dump",
+        help=(
+            "read pages from a MediaWiki XML dump instead of the API, only "
+            "with --dry-run, --namespace and --prefix filter pages"
+        ),
+    )
+
+    parser.add_argument(
+        "--prefix",
+        default="",
+        help="only edit pages with the given title prefix (ignored for categories)",
+    )
+
+    parser.add_argument(
+        "--page-limit",
+        type=int,
+        default=500,
+        dest="page_limit",
+        help="maximum(ish) number of pages to scan (default: 500)",
+    )
+
+    parser.add_argument(
+        "--username",
+        help="bot user name, the password is read from $BOT_PASSWORD or prompted for",
+    )
+
+    parser.add_argument(
+        "--dry-run",
+        metavar="FILE",
+        dest="dry_run",
+        help=(
+            "don't edit anything, write the changes that would be made to "
+            "FILE instead, or to stdout if FILE is '-'"
+        ),
+    )
+
+    parser.add_argument(
+        "--diff-format",
+        choices=["unified", "spans"],
+        default="unified",
+        dest="diff_format",
+        help=(
+            "write dry run changes as unified diffs, or as JSON Lines listing "
+            "the replaced tags on each page (default: unified)"
+        ),
+    )
+
+    parser.add_argument(
+        "--context",
+        type=int,
+        default=1,
+        help="number of context lines in unified diffs (default: 1)",
+    )
+
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=2,
+        help="number of edits to have in flight at once (default: 2)",
+    )
+
+    parser.add_argument(
+        "--edits-per-minute",
+        type=float,
+        default=10,
+        dest="edits_per_minute",
+        help="maximum average edit rate, 0 for no limit (default: 10)",
+    )
+
+    parser.add_argument(
+        "--rate-limit",
+        type=float,
+        default=None,
+        dest="rate_limit",
+        help="maximum number of API requests per second, including edits",
+    )
+
+    parser.add_argument(
+        "--backend",
+        choices=("requests", "aiohttp"),
+        default="requests",
+        help=(
+            "HTTP client used to read pages, 'aiohttp' reads them over one "
+            "connection pool on an event loop and needs aiohttp, logins and "
+            "edits always use requests (default: requests)"
+        ),
+    )
+
+    parser.add_argument(
+        "--cache",
+        help=(
+            "path to an SQLite cache of page content and scan results, as "
+            "written by find_bad_lang_tags.py --cache"
+        ),
+    )
+
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=1024,
+        dest="cache_size",
+        help="maximum size of the revision cache in MiB (default: 1024)",
+    )
+
+    parser.add_argument(
+        "--log",
+        default="fix_legacy_lang_tags.jsonl",
+        help=(
+            "append the outcome of each edit to this JSON Lines file, pages "
+            "already done are skipped (default: fix_legacy_lang_tags.jsonl)"
+        ),
+    )
+
+    parser.add_argument(
+        "--url",
+        default=URL,
+        help=f"target MediaWiki URL (default: {URL})",
+    )
+
+    parser.add_argument(
+        "--progress-interval",
+        type=float,
+        default=30,
+        dest="progress_interval",
+        help=(
+            "seconds between progress reports on stderr, 0 to report only at "
+            "the end (default: 30)"
+        ),
+    )
+
+    parser.add_argument(
+        "--metrics",
+        help="write requests, latency, throughput and edit counts to this file at exit",
+    )
+
+    parser.add_argument(
+        "--metrics-format",
+        choices=METRICS_FORMATS,
+        default="json",
+        dest="metrics_format",
+        help="format of the --metrics file, json or prometheus (default: json)",
+    )
+
+    parser.add_argument(
+        "--debug",
+        "-d",
+        action="store_true",
+        help="enable debugging output, including every HTTP request (default: false)",
+    )
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+
+    if args.dump is None and args.namespace is None and args.category is None:
+        parser.error("one of the arguments --category --namespace --dump is required")
+
+    if args.dump is not None and args.category is not None:
+        parser.error("argument --category: not allowed with argument --dump")
+
+    if args.dump is not None and args.dry_run is None:
+        parser.error("argument --dump: only allowed with --dry-run")
+
+    if args.dry_run is None and not args.username:
+        parser.error("argument --username is required unless --dry-run is given")
+
+    if args.context < 0:
+        parser.error("argument --context: must not be negative")
+
+    if args.backend == "aiohttp" and (args.dump or args.cache):
+        parser.error("argument --backend: aiohttp can't be used with --dump or --cache")
+
+    if args.backend == "aiohttp" and importlib.util.find_spec("aiohttp") is None:
+        parser.error(
+            "argument --backend: aiohttp isn't installed, install it with "
+            "'python -m pip install -r requirements-optional.txt'"
+        )
+
+    # Report and save metrics however the run ends.
+    if args.metrics:
+        atexit.register(write_metrics, args.metrics, args.metrics_format)
+    atexit.register(ProgressReporter(METRICS, args.progress_interval).start().stop)
+
+    session = get_session(rate_limit=args.rate_limit)
+    # Shared by both backends, so reads and edits keep to one rate limit.
+    scheduler = session.scheduler
+    if args.dry_run is None:
+        password = os.environ.get("BOT_PASSWORD") or getpass.getpass()
+        session, csrf_token, start_timestamp = login(
+            session,
+            args.url,
+            args.username,
+            password,
+        )
+
+    cache = (
+        RevisionCache(args.cache, max_bytes=args.cache_size * 1024 * 1024)
+        if args.cache
+        else None
+    )
+
+    results = (
+        ResultCache(
+            args.cache,
+            skip_unsupported_langs=True,
+            scanner_version=scanner_version(True),
+        )
+        if args.cache
+        else None
+    )
+
+    category = None
+    if args.category:
+        category = (
+            args.category
+            if args.category.startswith("Category:")
+            else "Category:" + args.category
+        )
+
+    tags: Iterable[Tuple[Dict[str, Any], Iterable[BadLangTag]]]
+    if args.dump is not None:
+        tags = dump_find_bad_lang_tags(
+            args.dump,
+            prefix=args.prefix,
+            namespace=args.namespace,
+            page_limit=args.page_limit,
+            results=results,
+        )
+    elif args.backend == "aiohttp":
+        import async_api
+
+        def _async_pages(session: "async_api.AsyncSession") -> Any:
+            if category is not None:
+                return async_api.cm_query(
+                    session,
+                    category,
+                    url=args.url,
+                    limit=args.page_limit,
+                )
+            return async_api.ap_query(
+                session,
+                url=args.url,
+                prefix=args.prefix,
+                namespace=args.namespace,
+                limit=args.page_limit,
+            )
+
+        pages = async_api.iterate(_async_pages, scheduler=scheduler)
+        tags = scan_pages(pages, True)
+    elif category is not None:
+        tags = cm_find_bad_lang_tags(
+            session,
+            category,
+            url=args.url,
+            page_limit=args.page_limit,
+            prefetch_depth=2,
+            cache=cache,
+            results=results,
+        )
+    else:
+        tags = ap_find_bad_lang_tags(
+            session,
+            url=args.url,
+            prefix=args.prefix,
+            namespace=args.namespace,
+            page_limit=args.page_limit,
+            prefetch_depth=2,
+            cache=cache,
+            results=results,
+        )
+
+    if args.dry_run is not None:
+        out_file = (
+            sys.stdout
+            if args.dry_run == "-"
+            else open(args.dry_run, "w", encoding="utf-8")
+        )
+        try:
+            counts = dry_run(
+                tags,
+                out_file,
+                diff_format=args.diff_format,
+                context=args.context,
+            )
+        finally:
+            if out_file is not sys.stdout:
+                out_file.close()
+    else:
+        done = EditLog.read_done(args.log)
+        with contextlib.ExitStack() as stack:
+            fetch_pages = None
+            if args.backend == "aiohttp":
+                import async_api
+
+                reads = stack.enter_context(
+                    async_api.BackgroundSession(
+                        scheduler, pool_size=max(10, args.workers)
+                    )
+                )
+                fetch_pages = functools.partial(reads.pageids_query, url=args.url)
+
+            fd = stack.enter_context(open(args.log, "a", encoding="utf-8"))
+            counts = fix_pages(
+                session,
+                tags,
+                url=args.url,
+                csrf_token=csrf_token,
+                start_timestamp=start_timestamp,
+                log=EditLog(fd, done),
+                workers=args.workers,
+                edits_per_minute=args.edits_per_minute,
+                fetch_pages=fetch_pages,
+            )
+
+    if cache:
+        cache.close()
+
+    if results:
+        results.close()
+
+    # Keep the summary out of a dry run written to stdout.
+    summary = sys.stderr if args.dry_run == "-" else sys.stdout
+    print(json.dumps(dict(counts)), file=summary)
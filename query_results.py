@@ -0,0 +1,177 @@
+"""Report on scan results stored by `find_bad_lang_tags.py --format=sqlite`.
+
+Reports are written to stdout as CSV.
+"""
+
+import csv
+import sqlite3
+import sys
+
+from typing import Any
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import TextIO
+from typing import Tuple
+
+
+# Columns that tag counts can be grouped by.
+GROUP_BY = {
+    "kind": "t.kind",
+    "lang": "t.lang",
+    "tag": "t.tag",
+    "ns": "p.ns",
+    "page": "p.page_title",
+}
+
+
+def _where(
+    *,
+    kind: Optional[str] = None,
+    lang: Optional[str] = None,
+    ns: Optional[int] = None,
+    orphaned: Optional[bool] = None,
+    unsupported: Optional[bool] = None,
+) -> Tuple[str, List[Any]]:
+    clauses = []
+    params: List[Any] = []
+
+    if kind is not None:
+        clauses.append("t.kind = ?")
+        params.append(kind)
+
+    if lang is not None:
+        clauses.append("t.lang = ? COLLATE NOCASE")
+        params.append(lang)
+
+    if ns is not None:
+        clauses.append("p.ns = ?")
+        params.append(ns)
+
+    if orphaned is not None:
+        clauses.append("t.orphaned = ?")
+        params.append(int(orphaned))
+
+    if unsupported is not None:
+        clauses.append("t.unsupported_lang = ?")
+        params.append(int(unsupported))
+
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    return where, params
+
+
+def pages_with_tags(
+    db: sqlite3.Connection,
+    **filters: Any,
+) -> Iterable[Sequence[Any]]:
+    """Generate (page_id, page_title, revision_id, tag_count) for every page
+    with tags matching _filters_, most tags first."""
+    where, params = _where(**filters)
+    return db.execute(
+        "SELECT p.page_id, p.page_title, p.revision_id, COUNT(*) AS tag_count "
+        f"FROM tags t JOIN pages p ON p.page_id = t.page_id {where} "
+        "GROUP BY p.page_id ORDER BY tag_count DESC, p.page_title",
+        params,
+    )
+
+
+def tag_counts(
+    db: sqlite3.Connection,
+    by: str,
+    **filters: Any,
+) -> Iterable[Sequence[Any]]:
+    """Generate (value, tag_count) for each value of the column named by _by_,
+    counting tags matching _filters_, most tags first."""
+    column = GROUP_BY[by]
+    where, params = _where(**filters)
+    return db.execute(
+        f"SELECT {column} AS value, COUNT(*) AS tag_count "
+        f"FROM tags t JOIN pages p ON p.page_id = t.page_id {where} "
+        "GROUP BY value ORDER BY tag_count DESC, value",
+        params,
+    )
+
+
+def to_csv(
+    header: Sequence[str],
+    rows: Iterable[Sequence[Any]],
+    *,
+    out_file: TextIO = sys.stdout,
+) -> None:
+    writer = csv.writer(out_file)
+    writer.writerow(header)
+    writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("database", help="SQLite database written by --format=sqlite")
+
+    filters = argparse.ArgumentParser(add_help=False)
+    filters.add_argument("--kind", help="only count tags of this kind, e.g. LANG")
+    filters.add_argument(
+        "--lang",
+        help="only count tags with this lang, ignoring case, e.g. python",
+    )
+    filters.add_argument(
+        "--namespace",
+        type=int,
+        dest="ns",
+        help="only count tags on pages in this namespace, given as an integer",
+    )
+    filters.add_argument(
+        "--orphaned",
+        action="store_true",
+        default=None,
+        help="only count orphaned tags",
+    )
+    filters.add_argument(
+        "--unsupported",
+        action="store_true",
+        default=None,
+        help="only count tags with an unsupported lang",
+    )
+
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser(
+        "pages",
+        parents=[filters],
+        help="list pages with matching tags",
+    )
+
+    counts = commands.add_parser(
+        "counts",
+        parents=[filters],
+        help="count matching tags",
+    )
+    counts.add_argument(
+        "--by",
+        choices=sorted(GROUP_BY),
+        default="kind",
+        help="group counts by this column (default: kind)",
+    )
+
+    args = parser.parse_args()
+
+    db = sqlite3.connect(f"file:{args.database}?mode=ro", uri=True)
+    selected = {
+        "kind": args.kind,
+        "lang": args.lang,
+        "ns": args.ns,
+        "orphaned": args.orphaned,
+        "unsupported": args.unsupported,
+    }
+
+    if args.command == "pages":
+        to_csv(
+            ("page_id", "page_title", "revision_id", "tag_count"),
+            pages_with_tags(db, **selected),
+        )
+    else:
+        to_csv((args.by, "tag_count"), tag_counts(db, args.by, **selected))
+
+    db.close()
@@ -0,0 +1,249 @@
+import json
+import logging
+import sqlite3
+import threading
+
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+
+SCHEMA = """\
+CREATE TABLE IF NOT EXISTS revisions (
+    page_id INTEGER NOT NULL,
+    revision_id INTEGER NOT NULL,
+    content_model TEXT NOT NULL,
+    content_format TEXT NOT NULL,
+    content TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used INTEGER NOT NULL,
+    PRIMARY KEY (page_id, revision_id)
+);
+CREATE INDEX IF NOT EXISTS revisions_last_used ON revisions (last_used);
+"""
+
+# Number of cache hits to remember before writing their last used times.
+TOUCH_BATCH_SIZE = 1000
+
+
+class RevisionCache:
+    """An SQLite backed store of page content, keyed by page id and revision
+    id.
+
+    Only the latest revision of a page is kept. When the total size of stored
+    content exceeds _max_bytes_, least recently used revisions are evicted.
+    Instances can be shared between threads.
+
+    Cache hits are remembered in memory, and their last used times are
+    written in batches, with the next commit or after TOUCH_BATCH_SIZE hits,
+    so that reading from a warm cache doesn't write to the database for
+    every page.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 1024 * 1024 * 1024) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        size, clock = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0), COALESCE(MAX(last_used), 0) FROM revisions"
+        ).fetchone()
+        self._size: int = size
+        self._clock: int = clock
+        self._touched: Dict[Tuple[int, int], int] = {}
+        self._evict()
+        self._db.commit()
+
+    def get(self, page_id: int, revision_id: int) -> Optional[Dict[str, Any]]:
+        """Return the main slot for the given revision, or None if it is not
+        cached."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT content_model, content_format, content FROM revisions "
+                "WHERE page_id = ? AND revision_id = ?",
+                (page_id, revision_id),
+            ).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._clock += 1
+            self._touched[(page_id, revision_id)] = self._clock
+            if len(self._touched) >= TOUCH_BATCH_SIZE:
+                self._write_touched()
+                self._db.commit()
+
+        return {"contentmodel": row[0], "contentformat": row[1], "content": row[2]}
+
+    def put(self, page_id: int, revision_id: int, slot: Dict[str, Any]) -> None:
+        """Store the main slot of a revision, replacing any other revision of
+        the same page."""
+        content = slot["content"]
+        size = len(content.encode("utf-8"))
+
+        with self._lock:
+            (old_size,) = self._db.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM revisions WHERE page_id = ?",
+                (page_id,),
+            ).fetchone()
+            self._db.execute("DELETE FROM revisions WHERE page_id = ?", (page_id,))
+
+            self._clock += 1
+            self._db.execute(
+                "INSERT INTO revisions VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    page_id,
+                    revision_id,
+                    slot["contentmodel"],
+                    slot["contentformat"],
+                    content,
+                    size,
+                    self._clock,
+                ),
+            )
+            self._size += size - old_size
+            self._evict()
+
+    def commit(self) -> None:
+        with self._lock:
+            self._write_touched()
+            self._db.commit()
+
+    def close(self) -> None:
+        logging.debug(
+            "revision cache: %d hits, %d misses, %d bytes",
+            self.hits,
+            self.misses,
+            self._size,
+        )
+        with self._lock:
+            self._write_touched()
+            self._db.commit()
+            self._db.close()
+
+    def _write_touched(self) -> None:
+        if not self._touched:
+            return
+        self._db.executemany(
+            "UPDATE revisions SET last_used = ? "
+            "WHERE page_id = ? AND revision_id = ?",
+            [
+                (clock, page_id, revision_id)
+                for (page_id, revision_id), clock in self._touched.items()
+            ],
+        )
+        self._touched.clear()
+
+    def _evict(self) -> None:
+        if self._size > self.max_bytes:
+            # Evict by up to date last used times.
+            self._write_touched()
+
+        while self._size > self.max_bytes:
+            rows = self._db.execute(
+                "SELECT page_id, revision_id, size FROM revisions "
+                "ORDER BY last_used LIMIT 64"
+            ).fetchall()
+
+            if not rows:
+                break
+
+            for page_id, revision_id, size in rows:
+                self._db.execute(
+                    "DELETE FROM revisions WHERE page_id = ? AND revision_id = ?",
+                    (page_id, revision_id),
+                )
+                self._size -= size
+                if self._size <= self.max_bytes:
+                    break
+
+
+RESULTS_SCHEMA = """\
+CREATE TABLE IF NOT EXISTS results (
+    revision_id INTEGER NOT NULL,
+    skip_unsupported_langs INTEGER NOT NULL,
+    scanner_version TEXT NOT NULL,
+    tags TEXT NOT NULL,
+    PRIMARY KEY (revision_id, skip_unsupported_langs, scanner_version)
+);
+"""
+
+
+class ResultCache:
+    """An SQLite backed store of serialized scan results, keyed by revision
+    id, the skip_unsupported_langs option and a scanner version.
+
+    Results from other versions of the scanner are deleted when the cache is
+    opened. Instances can be shared between threads.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        skip_unsupported_langs: bool,
+        scanner_version: str,
+    ) -> None:
+        self.path = path
+        self.skip_unsupported_langs = skip_unsupported_langs
+        self.scanner_version = scanner_version
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(RESULTS_SCHEMA)
+        self._db.execute(
+            "DELETE FROM results "
+            "WHERE skip_unsupported_langs = ? AND scanner_version != ?",
+            (skip_unsupported_langs, scanner_version),
+        )
+        self._db.commit()
+
+    def get(self, revision_id: int) -> Optional[List[Any]]:
+        """Return cached tags for the given revision, or None if it has not
+        been scanned by this version of the scanner."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT tags FROM results WHERE revision_id = ? "
+                "AND skip_unsupported_langs = ? AND scanner_version = ?",
+                (revision_id, self.skip_unsupported_langs, self.scanner_version),
+            ).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+
+        tags: List[Any] = json.loads(row[0])
+        return tags
+
+    def put(self, revision_id: int, tags: List[Any]) -> None:
+        """Store tags for a revision. _tags_ must be JSON serializable."""
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                (
+                    revision_id,
+                    self.skip_unsupported_langs,
+                    self.scanner_version,
+                    json.dumps(tags),
+                ),
+            )
+
+    def commit(self) -> None:
+        with self._lock:
+            self._db.commit()
+
+    def close(self) -> None:
+        logging.debug("result cache: %d hits, %d misses", self.hits, self.misses)
+        with self._lock:
+            self._db.commit()
+            self._db.close()
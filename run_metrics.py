@@ -0,0 +1,302 @@
+"""Counters and histograms describing a run, for progress reports and a
+summary at exit.
+
+`METRICS` is shared by every thread in the process. API sessions record
+requests, retries, bytes received and latency in it, and the scanner and
+writers record pages and tags. Values that are kept elsewhere, like
+`find_bad_lang_tags.SCAN_STATS`, are read from collectors when a report is
+made. A `ProgressReporter` logs a one line summary every few seconds, and
+`write_metrics` saves everything as JSON or in the Prometheus text format.
+"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from bisect import bisect_left
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Mapping
+from typing import Optional
+from typing import Tuple
+
+
+# Upper bounds, in seconds, of the API latency histogram buckets.
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Prefix for metric names in the Prometheus text format.
+PROMETHEUS_PREFIX = "bad_lang_tags_"
+
+METRICS_FORMATS = ("json", "prometheus")
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """Counts of observed values falling at or below each of _buckets_."""
+
+    __slots__ = ("buckets", "counts", "count", "sum", "max")
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """Return (upper bound, count) for each bucket, including "+Inf",
+        counting every value at or below the bound."""
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            result.append((f"{bound:g}", total))
+        result.append(("+Inf", self.count))
+        return result
+
+
+class Metrics:
+    """Named counters and histograms, each with optional labels, that can be
+    updated from any thread."""
+
+    def __init__(self) -> None:
+        self.started = time.monotonic()
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self._collectors: List[Callable[[], Dict[str, float]]] = []
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels: Any) -> None:
+        """Add _value_ to the counter _name_ with _labels_."""
+        key = (name, _labels(labels) if labels else ())
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        """Add _value_ to the histogram _name_ with _labels_."""
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def response(
+        self,
+        method: str,
+        status: Any,
+        seconds: float,
+        size: Optional[int] = None,
+    ) -> None:
+        """Record an API request that got a response with _status_ after
+        _seconds_, and a body of _size_ bytes if known."""
+        method = method.upper()
+        self.inc("api_requests_total", method=method, status=status)
+        self.observe("api_request_seconds", seconds, method=method)
+        if size is not None:
+            self.inc("api_response_bytes_total", size)
+
+    def inc_labelled(self, name: str, label: str, counts: Mapping[Any, float]) -> None:
+        """Add each value in _counts_ to the counter _name_, labelled with its
+        key as _label_."""
+        with self._lock:
+            for value, count in counts.items():
+                key = (name, ((label, str(value)),))
+                self._counters[key] = self._counters.get(key, 0) + count
+
+    def add_collector(self, collector: Callable[[], Dict[str, float]]) -> None:
+        """Call _collector_ for more unlabelled values whenever a report is
+        made."""
+        self._collectors.append(collector)
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return every metric as a JSON serializable dict. Labelled values
+        are keyed by their labels, like "method=GET,status=200"."""
+        counters: Dict[str, Any] = {}
+        histograms: Dict[str, Any] = {}
+
+        for name, labels, value in self._counter_items():
+            if labels:
+                counters.setdefault(name, {})[_label_key(labels)] = value
+            else:
+                counters[name] = value
+
+        for name, labels, histogram in self._histogram_items():
+            summary = {
+                "count": histogram.count,
+                "sum": histogram.sum,
+                "max": histogram.max,
+                "buckets": dict(histogram.cumulative()),
+            }
+            if labels:
+                histograms.setdefault(name, {})[_label_key(labels)] = summary
+            else:
+                histograms[name] = summary
+
+        elapsed = self.elapsed()
+        return {
+            "elapsed_seconds": elapsed,
+            "pages_per_second": counters.get("pages_total", 0) / elapsed,
+            "counters": counters,
+            "histograms": histograms,
+        }
+
+    def prometheus(self) -> str:
+        """Return every metric in the Prometheus text exposition format."""
+        lines = []
+        typed = set()
+
+        def _type(name: str, kind: str) -> None:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {PROMETHEUS_PREFIX}{name} {kind}")
+
+        for name, labels, value in self._counter_items():
+            _type(name, "counter" if name.endswith("_total") else "gauge")
+            lines.append(
+                f"{PROMETHEUS_PREFIX}{name}{_prometheus_labels(labels)} {value}"
+            )
+
+        for name, labels, histogram in self._histogram_items():
+            _type(name, "histogram")
+            metric = PROMETHEUS_PREFIX + name
+            for bound, count in histogram.cumulative():
+                bucket = _prometheus_labels(labels + (("le", bound),))
+                lines.append(f"{metric}_bucket{bucket} {count}")
+            lines.append(f"{metric}_sum{_prometheus_labels(labels)} {histogram.sum}")
+            lines.append(
+                f"{metric}_count{_prometheus_labels(labels)} {histogram.count}"
+            )
+
+        _type("elapsed_seconds", "gauge")
+        lines.append(f"{PROMETHEUS_PREFIX}elapsed_seconds {self.elapsed()}")
+        return "\n".join(lines) + "\n"
+
+    def progress(self) -> str:
+        """Return a one line summary of the run so far."""
+        snapshot = self.snapshot()
+        counters = snapshot["counters"]
+        requests = sum(_values(counters.get("api_requests_total", 0)))
+        latency = snapshot["histograms"].get("api_request_seconds", {})
+        count = sum(summary["count"] for summary in latency.values())
+        seconds = sum(summary["sum"] for summary in latency.values())
+        slowest = max((summary["max"] for summary in latency.values()), default=0.0)
+
+        return (
+            f"{counters.get('pages_total', 0):.0f} pages "
+            f"({snapshot['pages_per_second']:.1f}/s), "
+            f"{sum(_values(counters.get('tags_written_total', 0))):.0f} tags written, "
+            f"{requests:.0f} requests, "
+            f"{sum(_values(counters.get('api_retries_total', 0))):.0f} retries, "
+            f"{counters.get('api_response_bytes_total', 0) / 1e6:.2f} MB received, "
+            f"latency mean {seconds / count if count else 0:.2f}s "
+            f"max {slowest:.2f}s, "
+            f"scan CPU {counters.get('scan_cpu_seconds_total', 0):.1f}s"
+        )
+
+    def _counter_items(self) -> List[Tuple[str, Labels, float]]:
+        with self._lock:
+            items = [
+                (name, labels, value)
+                for (name, labels), value in self._counters.items()
+            ]
+        for collector in self._collectors:
+            items.extend((name, (), value) for name, value in collector().items())
+        return sorted(items)
+
+    def _histogram_items(self) -> List[Tuple[str, Labels, Histogram]]:
+        with self._lock:
+            return sorted(
+                (
+                    (name, labels, histogram)
+                    for (name, labels), histogram in self._histograms.items()
+                ),
+                key=lambda item: item[:2],
+            )
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _label_key(labels: Labels) -> str:
+    return ",".join(f"{key}={value}" for key, value in labels)
+
+
+def _prometheus_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (key, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def _values(value: Any) -> List[float]:
+    return list(value.values()) if isinstance(value, dict) else [value]
+
+
+METRICS = Metrics()
+
+
+class ProgressReporter:
+    """Log `Metrics.progress` every _interval_ seconds on a background thread,
+    and once more when stopped."""
+
+    def __init__(self, metrics: Metrics = METRICS, interval: float = 30.0) -> None:
+        self.metrics = metrics
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> "ProgressReporter":
+        if self.interval > 0:
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        logging.info(self.metrics.progress())
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            logging.info(self.metrics.progress())
+
+
+def write_metrics(path: str, metrics_format: str, metrics: Metrics = METRICS) -> None:
+    """Save _metrics_ to _path_ as "json" or "prometheus", replacing the file
+    in one step so a collector never reads half of it."""
+    if metrics_format == "prometheus":
+        text = metrics.prometheus()
+    else:
+        text = json.dumps(metrics.snapshot(), indent=2) + "\n"
+
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile(
+        "w",
+        dir=directory,
+        delete=False,
+        encoding="utf-8",
+    ) as fd:
+        fd.write(text)
+    os.replace(fd.name, path)
@@ -0,0 +1,276 @@
+"""Find out which pages, and which `RE_SPEC` patterns, make a scan slow.
+
+A `ScanProfile` records the CPU time taken to scan each page, and the time
+the engine spent finding matches of each kind, including skip regions like
+NOWIKI and COMMENT that never become tags. It keeps the slowest pages and,
+if asked to, runs each pattern on its own over them to show which one is
+expensive. `ScanProfile.write` saves a plain text report, for attaching to
+a ticket.
+"""
+
+import heapq
+import re
+import time
+
+from collections import Counter
+from collections import defaultdict
+from typing import Any
+from typing import DefaultDict
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import TextIO
+from typing import Tuple
+
+
+# Time spent after the last match, looking for another one.
+NO_MATCH = "(no match)"
+
+
+class KindTimes:
+    """The number of matches of each kind, and the CPU seconds spent finding
+    them."""
+
+    __slots__ = ("counts", "seconds")
+
+    def __init__(self) -> None:
+        self.counts: Counter = Counter()
+        self.seconds: DefaultDict[str, float] = defaultdict(float)
+
+    def add(self, other: "KindTimes") -> None:
+        self.counts.update(other.counts)
+        for kind, seconds in other.seconds.items():
+            self.seconds[kind] += seconds
+
+    def slowest(self, count: Optional[int] = None) -> List[Tuple[str, float]]:
+        """Return (kind, seconds) for the _count_ kinds that took longest, or
+        for every kind, slowest first."""
+        return _slowest(self.seconds, count)
+
+
+def timed_matches(matches: Iterable[Any], times: KindTimes) -> Iterator[Any]:
+    """Yield from _matches_, adding the CPU time taken to find each match to
+    _times_ under its `lastgroup`.
+
+    The time includes any failed attempts since the previous match, so a
+    pattern that backtracks a long way before failing is charged to the
+    kind of the next match found.
+    """
+    it = iter(matches)
+    while True:
+        started = time.thread_time()
+        match = next(it, None)
+        seconds = time.thread_time() - started
+
+        if match is None:
+            times.seconds[NO_MATCH] += seconds
+            return
+
+        times.counts[match.lastgroup] += 1
+        times.seconds[match.lastgroup] += seconds
+        yield match
+
+
+class ScanProfile:
+    """Scan times for every page, and the _slowest_ of them.
+
+    If _patterns_ are given, as (name, compiled pattern) pairs, each pattern
+    is also run on its own over the slowest pages when the report is
+    written. Their text is kept until then.
+    """
+
+    def __init__(
+        self,
+        *,
+        slowest: int = 20,
+        patterns: Optional[Sequence[Tuple[str, "re.Pattern[str]"]]] = None,
+    ) -> None:
+        self.slowest = slowest
+        self.patterns = patterns
+        self.pages = 0
+        self.chars = 0
+        self.seconds = 0.0
+        self.kinds = KindTimes()
+        # A min-heap of (seconds, page number, details), so the fastest of
+        # the slowest pages is the one to go.
+        self._slowest: List[Tuple[float, int, Dict[str, Any]]] = []
+
+    def record(
+        self,
+        page: Dict[str, Any],
+        wiki_text: str,
+        seconds: float,
+        times: KindTimes,
+        tag_count: int,
+    ) -> None:
+        """Record that scanning _page_ took _seconds_ and found _tag_count_
+        tags."""
+        self.pages += 1
+        self.chars += len(wiki_text)
+        self.seconds += seconds
+        self.kinds.add(times)
+
+        if len(self._slowest) == self.slowest and seconds <= self._slowest[0][0]:
+            return
+
+        details = {
+            "page_id": page.get("pageid"),
+            "title": page.get("title"),
+            "chars": len(wiki_text),
+            "tags": tag_count,
+            "kinds": times,
+            "wiki_text": wiki_text if self.patterns else None,
+        }
+        entry = (seconds, self.pages, details)
+        if len(self._slowest) < self.slowest:
+            heapq.heappush(self._slowest, entry)
+        else:
+            heapq.heapreplace(self._slowest, entry)
+
+    def slowest_pages(self) -> List[Tuple[float, Dict[str, Any]]]:
+        """Return (seconds, details) for the slowest pages, slowest first."""
+        return [
+            (seconds, details)
+            for seconds, _, details in sorted(self._slowest, reverse=True)
+        ]
+
+    def pattern_times(self, wiki_text: str) -> List[Tuple[str, int, float]]:
+        """Run each pattern on its own over _wiki_text_, and return (name,
+        match count, CPU seconds) for each of them."""
+        assert self.patterns is not None
+        result = []
+        for name, pattern in self.patterns:
+            started = time.thread_time()
+            count = sum(1 for _ in pattern.finditer(wiki_text))
+            result.append((name, count, time.thread_time() - started))
+        return result
+
+    def write(self, path: str) -> None:
+        """Write the report to the file at _path_."""
+        with open(path, "w", encoding="utf-8") as fd:
+            self.report(fd)
+
+    def report(self, out_file: TextIO) -> None:
+        """Write the profile to _out_file_ as plain text."""
+        out_file.write(
+            f"Scanned {self.pages} pages, {self.chars} characters, in "
+            f"{self.seconds:.3f} CPU seconds.\n\n"
+        )
+
+        out_file.write("Time finding matches, by kind:\n\n")
+        kinds = self.kinds
+        rows: List[Sequence[Any]] = [
+            (
+                kind,
+                kinds.counts[kind],
+                f"{seconds:.4f}",
+                _percent(seconds, self.seconds),
+                (
+                    f"{1e6 * seconds / kinds.counts[kind]:.1f}"
+                    if kinds.counts[kind]
+                    else ""
+                ),
+            )
+            for kind, seconds in kinds.slowest()
+        ]
+        other = self.seconds - sum(kinds.seconds.values())
+        rows.append(
+            (
+                "(prescreen and tags)",
+                "",
+                f"{other:.4f}",
+                _percent(other, self.seconds),
+                "",
+            )
+        )
+        _table(out_file, ("kind", "matches", "seconds", "share", "µs/match"), rows)
+
+        pages = self.slowest_pages()
+        out_file.write(f"\nSlowest {len(pages)} pages:\n\n")
+        _table(
+            out_file,
+            ("seconds", "chars", "tags", "slowest kinds", "page_id", "title"),
+            [
+                (
+                    f"{seconds:.4f}",
+                    details["chars"],
+                    details["tags"],
+                    _slowest_kinds(details["kinds"], seconds),
+                    details["page_id"],
+                    details["title"],
+                )
+                for seconds, details in pages
+            ],
+        )
+
+        if not self.patterns:
+            return
+
+        out_file.write(
+            f"\nEach pattern run on its own over the slowest {len(pages)} pages:\n\n"
+        )
+        totals: DefaultDict[str, float] = defaultdict(float)
+        counts: Counter = Counter()
+        for _, details in pages:
+            out_file.write(f"{details['page_id']} {details['title']}\n")
+            times = self.pattern_times(details["wiki_text"])
+            for name, count, seconds in times:
+                totals[name] += seconds
+                counts[name] += count
+            _table(
+                out_file,
+                ("pattern", "matches", "seconds"),
+                [
+                    (name, count, f"{seconds:.4f}")
+                    for name, count, seconds in sorted(
+                        times, key=lambda item: item[2], reverse=True
+                    )
+                ],
+                indent="  ",
+            )
+
+        out_file.write("\nTotal for each pattern:\n\n")
+        _table(
+            out_file,
+            ("pattern", "matches", "seconds"),
+            [
+                (name, counts[name], f"{seconds:.4f}")
+                for name, seconds in _slowest(totals)
+            ],
+        )
+
+
+def _slowest_kinds(times: KindTimes, seconds: float, count: int = 3) -> str:
+    return ", ".join(
+        f"{kind} {_percent(kind_seconds, seconds)}"
+        for kind, kind_seconds in times.slowest(count)
+    )
+
+
+def _slowest(
+    seconds: Dict[str, float], count: Optional[int] = None
+) -> List[Tuple[str, float]]:
+    return sorted(seconds.items(), key=lambda item: item[1], reverse=True)[:count]
+
+
+def _percent(part: float, whole: float) -> str:
+    return f"{100 * part / whole:.1f}%" if whole else "-"
+
+
+def _table(
+    out_file: TextIO,
+    headers: Sequence[str],
+    rows: Sequence[Sequence[Any]],
+    *,
+    indent: str = "",
+) -> None:
+    """Write _rows_ in columns under _headers_. Every column but the last is
+    padded to the same width."""
+    cells = [[str(cell) for cell in row] for row in [headers, *rows]]
+    widths = [max(len(row[i]) for row in cells) for i in range(len(headers) - 1)]
+    for row in cells:
+        padded = [cell.ljust(width) for cell, width in zip(row, widths)]
+        out_file.write(indent + "  ".join([*padded, row[-1]]).rstrip() + "\n")
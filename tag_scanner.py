@@ -0,0 +1,634 @@
+"""A single pass replacement for `RE_BAD_LANG.finditer`.
+
+`RE_BAD_LANG` is an alternation of DOTALL patterns with lazy bodies. When a
+start tag has no matching end tag, each lazy body scans to the end of the
+page before giving up, and the same happens again from every later start
+tag, so pathological pages take quadratic time or worse.
+
+`scan_tags` produces exactly the same matches, but instead of rescanning,
+it answers "where is the next end tag / `>` / attribute after position x"
+with a bisect over positions collected once per page. Each alternative is
+then decided at each candidate `<` with a handful of lookups.
+
+The semantics of every `RE_SPEC` pattern, including how the regex engine
+backtracks, are reproduced here. If you change a pattern in `RE_SPEC`,
+change it here too, and run tests/test_tag_scanner.py.
+
+`tag_window` is a cheap first pass that rules out pages without any tags,
+and narrows the rest down to the part that needs scanning.
+"""
+
+import re
+
+from bisect import bisect_left
+from bisect import bisect_right
+from typing import Callable
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+Span = Tuple[int, int]
+
+FLAGS = re.DOTALL | re.IGNORECASE
+
+# Every RE_SPEC alternative starts with one of these. Where only one
+# alternative can start with a prefix and its start tag can't fail to match
+# once found, the whole start tag is included.
+RE_CANDIDATE = re.compile(
+    r"<(?:"
+    r"(?P<lang>lang)|"
+    r"(?P<end_lang>/lang)|"
+    r"(?P<high>syntaxhighlight)|"
+    r"(?P<end_high>/syntaxhighlight\s*>)|"
+    r"(?P<nowiki>nowiki\s*>)|"
+    r"(?P<comment>!--)|"
+    r"(?P<pre>pre\s*>)|"
+    r"(?P<code>code\s*>))",
+    FLAGS,
+)
+
+RE_NOWIKI_END = re.compile(r"</nowiki\s*>", FLAGS)
+RE_PRE_END = re.compile(r"</pre\s*>", FLAGS)
+RE_CODE_END = re.compile(r"</code\s*>", FLAGS)
+RE_COMMENT_END = re.compile(r"-->", FLAGS)
+RE_BARE_HIGH_START = re.compile(r"<syntaxhighlight\s*>", FLAGS)
+RE_HIGH_END = re.compile(r"</syntaxhighlight\s*>", FLAGS)
+RE_BARE_START = re.compile(r"<lang\s*>", FLAGS)
+RE_LANG_END = re.compile(r"</lang\s*>", FLAGS)
+
+# `lang` attributes, as matched by HIGH, HIGH_NQ and STARTHIGH. Lookaheads
+# find every position at which an attribute starts, even when they overlap.
+RE_ATTR_QUOTED = re.compile(
+    r"(?=lang\s*=\s*(?P<quote>[\"'])(?P<value>[^\s>]+)(?P=quote))", FLAGS
+)
+RE_ATTR_UNQUOTED = re.compile(r"(?=lang\s*=\s*(?P<value>[^\s>]+))", FLAGS)
+RE_ATTR_MAYBE_QUOTED = re.compile(
+    r"(?=lang\s*=\s*(?P<quote>[\"']?)(?P<value>[^\s>]+)(?P=quote))", FLAGS
+)
+
+RE_WHITESPACE = re.compile(r"\s*")
+RE_GT = re.compile(r">")
+RE_LINE_BREAK = re.compile(r"[\n\r]")
+
+# Candidates that start a region to skip, and the end tag of that region.
+SKIP_REGIONS: Dict[str, Tuple[str, "re.Pattern[str]"]] = {
+    "nowiki": ("NOWIKI", RE_NOWIKI_END),
+    "comment": ("COMMENT", RE_COMMENT_END),
+    "pre": ("PRE", RE_PRE_END),
+    "code": ("CODE", RE_CODE_END),
+}
+
+# Every bad tag starts with one of these, once case folded. They stop short
+# of the "i"s in "syntaxhighlight", which IGNORECASE also matches to "İ" and
+# "ı", neither of which case folds to "i".
+TAG_LITERALS = ("<lang", "</lang", "<syntaxh", "</syntaxh")
+
+RE_TAG_LITERAL = re.compile(r"</?(?:lang|syntaxh)", FLAGS)
+
+# The start of every RE_SPEC alternative that is not a tag.
+RE_SKIP_START = re.compile(r"<(?:nowiki\s*>|!--|pre\s*>|code\s*>)", FLAGS)
+
+HIGH_LEN = len("<syntaxhighlight")
+LANG_LEN = len("<lang")
+END_LANG_LEN = len("</lang")
+
+
+class TagMatch:
+    """The parts of the `re.Match` interface that `find_bad_lang_tags` uses,
+    with the same group names as `RE_BAD_LANG`."""
+
+    __slots__ = ("string", "lastgroup", "_spans")
+
+    def __init__(self, string: str, lastgroup: str, spans: Dict[str, Span]):
+        self.string = string
+        self.lastgroup = lastgroup
+        self._spans = spans
+
+    def span(self, group: str = "") -> Span:
+        return self._spans.get(group or self.lastgroup, (-1, -1))
+
+    def start(self, group: str = "") -> int:
+        return self.span(group)[0]
+
+    def end(self, group: str = "") -> int:
+        return self.span(group)[1]
+
+    def group(self, group: object = 0) -> Optional[str]:
+        name = self.lastgroup if group == 0 else str(group)
+        span = self._spans.get(name)
+        if span is None:
+            return None
+        return self.string[span[0] : span[1]]
+
+    def groupdict(self) -> Dict[str, Optional[str]]:
+        return {name: self.group(name) for name in self._spans}
+
+
+class _Positions:
+    """Sorted start and end offsets of every match of a pattern."""
+
+    __slots__ = ("starts", "ends")
+
+    def __init__(self, pattern: "re.Pattern[str]", text: str) -> None:
+        self.starts: List[int] = []
+        self.ends: List[int] = []
+        for match in pattern.finditer(text):
+            self.starts.append(match.start())
+            self.ends.append(match.end())
+
+    def next(self, index: int) -> Optional[Span]:
+        """Return the span of the first match starting at or after _index_."""
+        i = bisect_left(self.starts, index)
+        if i == len(self.starts):
+            return None
+        return self.starts[i], self.ends[i]
+
+
+class _Attributes:
+    """Every position at which a `lang` attribute pattern matches."""
+
+    __slots__ = ("starts", "matches")
+
+    def __init__(self, pattern: "re.Pattern[str]", text: str) -> None:
+        self.starts: List[int] = []
+        self.matches: List[Tuple[Optional[Span], Span]] = []
+        quoted = "quote" in pattern.groupindex
+        for match in pattern.finditer(text):
+            self.starts.append(match.start())
+            self.matches.append(
+                (match.span("quote") if quoted else None, match.span("value"))
+            )
+
+    def next(self, index: int) -> Optional[Tuple[Optional[Span], Span]]:
+        """Return quote and value spans of the first attribute starting at or
+        after _index_."""
+        i = bisect_left(self.starts, index)
+        if i == len(self.starts):
+            return None
+        return self.matches[i]
+
+    def at(self, index: int) -> Optional[Tuple[Optional[Span], Span]]:
+        """Return quote and value spans of an attribute starting at _index_."""
+        i = bisect_left(self.starts, index)
+        if i == len(self.starts) or self.starts[i] != index:
+            return None
+        return self.matches[i]
+
+
+class _NextChar:
+    """Find the next occurrence of a single character pattern, remembering
+    which parts of the text have been searched so that none are searched
+    twice."""
+
+    __slots__ = ("pattern", "text", "froms", "tos")
+
+    def __init__(self, pattern: "re.Pattern[str]", text: str) -> None:
+        self.pattern = pattern
+        self.text = text
+        # Sorted, disjoint intervals [froms[i], tos[i]] in which the only
+        # occurrence is at tos[i], or none if tos[i] == len(text).
+        self.froms: List[int] = []
+        self.tos: List[int] = []
+
+    def next(self, index: int) -> Optional[int]:
+        """Return the index of the first occurrence at or after _index_."""
+        froms = self.froms
+        tos = self.tos
+        i = bisect_right(froms, index) - 1
+
+        if i >= 0 and index <= tos[i]:
+            found = tos[i]
+        else:
+            # Search up to the next interval we already know about.
+            i += 1
+            stop = froms[i] if i < len(froms) else len(self.text)
+            match = self.pattern.search(self.text, index, stop)
+
+            if match:
+                found = match.start()
+                froms.insert(i, index)
+                tos.insert(i, found)
+            elif i < len(froms):
+                found = tos[i]
+                froms[i] = index
+            else:
+                found = len(self.text)
+                froms.append(index)
+                tos.append(found)
+
+        return None if found == len(self.text) else found
+
+
+class _Page:
+    """Lazily built position indexes for one page of wiki text."""
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+        self._positions: Dict["re.Pattern[str]", _Positions] = {}
+        self._attributes: Dict["re.Pattern[str]", _Attributes] = {}
+        self._gts = _NextChar(RE_GT, text)
+        self._line_breaks = _NextChar(RE_LINE_BREAK, text)
+        self._whitespace: Dict[int, int] = {}
+
+    def positions(self, pattern: "re.Pattern[str]") -> _Positions:
+        positions = self._positions.get(pattern)
+        if positions is None:
+            positions = self._positions[pattern] = _Positions(pattern, self.text)
+        return positions
+
+    def attributes(self, pattern: "re.Pattern[str]") -> _Attributes:
+        attributes = self._attributes.get(pattern)
+        if attributes is None:
+            attributes = self._attributes[pattern] = _Attributes(pattern, self.text)
+        return attributes
+
+    def next_gt(self, index: int) -> Optional[int]:
+        return self._gts.next(index)
+
+    def next_line_break(self, index: int) -> int:
+        line_break = self._line_breaks.next(index)
+        return len(self.text) if line_break is None else line_break
+
+    def skip_whitespace(self, index: int) -> int:
+        match = RE_WHITESPACE.match(self.text, index)
+        assert match
+        return match.end()
+
+    def is_whitespace(self, index: int) -> bool:
+        return index < len(self.text) and self.text[index].isspace()
+
+    def whitespace_before(self, index: int) -> int:
+        """Return the start of the run of whitespace that ends at _index_."""
+        starts = self._whitespace
+        if index not in starts:
+            start = index
+            while start > 0 and self.text[start - 1].isspace():
+                start -= 1
+            starts[index] = start
+        return starts[index]
+
+    def lazy_tag_end(self, start: int) -> Optional[Tuple[int, int]]:
+        """Match `[^\\n\\r]+?\\s*>` at _start_.
+
+        Return the end of the lazy group and the index of the `>`, or None if
+        there's no match.
+        """
+        if start >= len(self.text) or self.text[start] in "\n\r":
+            return None
+
+        gt = self.next_gt(start + 1)
+        if gt is None:
+            return None
+
+        group_end = max(start + 1, self.whitespace_before(gt))
+        if self.next_line_break(start) < group_end:
+            return None
+        return group_end, gt
+
+
+class ScanStats:
+    """Counts of the work done by each stage of a scan, across many pages."""
+
+    __slots__ = ("pages", "chars", "prescreened", "window_chars", "matches", "cpu_time")
+
+    def __init__(self) -> None:
+        # Pages and characters given to `tag_window`.
+        self.pages = 0
+        self.chars = 0
+        # Pages with a tag literal, and characters in their candidate windows.
+        self.prescreened = 0
+        self.window_chars = 0
+        # Matches classified from candidate windows.
+        self.matches = 0
+        # CPU seconds spent scanning, as measured by the caller.
+        self.cpu_time = 0.0
+
+    def add(self, other: "ScanStats") -> None:
+        for name in self.__slots__:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+    def report(self) -> str:
+        return (
+            f"scanned {self.pages} pages, "
+            f"{self.prescreened} passed the prescreen "
+            f"({_percent(self.prescreened, self.pages)}), "
+            f"{self.window_chars} of {self.chars} characters were in candidate "
+            f"windows ({_percent(self.window_chars, self.chars)}), "
+            f"{self.matches} matches classified in {self.cpu_time:.1f} CPU seconds"
+        )
+
+
+def _percent(part: int, whole: int) -> str:
+    return f"{100 * part / whole:.1f}%" if whole else "-"
+
+
+def tag_window(text: str, stats: Optional[ScanStats] = None) -> Optional[Span]:
+    """Return the span of _text_ in which every match that could be a bad tag
+    starts, or None if there can't be any.
+
+    First, the case folded text is searched for tag literals. Pages without
+    any are ruled out. Otherwise the window runs from the first candidate
+    to the start of the last tag literal. Scanning from the start of the
+    window gives the same matches as scanning from the start of the text,
+    because every `RE_SPEC` alternative starts with a tag literal or a skip
+    region, so skip regions that contain tags are still skipped. Matches
+    starting after the window can only be skip regions.
+    """
+    if stats is not None:
+        stats.pages += 1
+        stats.chars += len(text)
+
+    folded = text.casefold()
+    firsts = [i for i in (folded.find(literal) for literal in TAG_LITERALS) if i >= 0]
+    if not firsts:
+        return None
+
+    if len(folded) == len(text):
+        first = min(firsts)
+        last = max(folded.rfind(literal) for literal in TAG_LITERALS)
+    else:
+        # Case folding lengthened some characters, so indices into the folded
+        # text don't line up with _text_.
+        literals = [match.start() for match in RE_TAG_LITERAL.finditer(text)]
+        if not literals:
+            return None
+        first = literals[0]
+        last = literals[-1]
+
+    skip_start = RE_SKIP_START.search(text, 0, first)
+    if skip_start:
+        first = skip_start.start()
+
+    if stats is not None:
+        stats.prescreened += 1
+        stats.window_chars += last - first + 1
+    return first, last
+
+
+def scan_tags(text: str, pos: int = 0) -> Iterator[TagMatch]:
+    """Generate the same matches as `RE_BAD_LANG.finditer(text, pos)`."""
+    page = _Page(text)
+    candidate = RE_CANDIDATE.search(text, pos)
+
+    while candidate:
+        start = candidate.start()
+        kind = candidate.lastgroup
+        assert kind
+        match: Optional[TagMatch]
+
+        if kind in SKIP_REGIONS:
+            name, end_tag = SKIP_REGIONS[kind]
+            end = page.positions(end_tag).next(candidate.end())
+            match = (
+                None if end is None else TagMatch(text, name, {name: (start, end[1])})
+            )
+        elif kind == "end_high":
+            match = TagMatch(text, "ENDHIGH", {"ENDHIGH": candidate.span()})
+        else:
+            match = _MATCHERS[kind](page, start)
+
+        if match is None:
+            candidate = RE_CANDIDATE.search(text, candidate.end())
+        else:
+            yield match
+            candidate = RE_CANDIDATE.search(text, match.end())
+
+
+def _high(page: _Page, start: int) -> Optional[TagMatch]:
+    return (
+        _high_with_lang(page, start, quoted=True)
+        or _high_with_lang(page, start, quoted=False)
+        or _bare_high(page, start)
+        or _start_high(page, start)
+    )
+
+
+def _high_with_lang(page: _Page, start: int, *, quoted: bool) -> Optional[TagMatch]:
+    """HIGH and HIGH_NQ.
+
+    `\\s+.*?lang...` can only start the attribute after the whitespace, and
+    everything after the attribute is a lazy search for the first `>` and
+    the first end tag after that. If those searches fail for the first
+    attribute, they fail for every later attribute too.
+    """
+    if not page.is_whitespace(start + HIGH_LEN):
+        return None
+
+    attrs = page.attributes(RE_ATTR_QUOTED if quoted else RE_ATTR_UNQUOTED)
+    attr = attrs.next(page.skip_whitespace(start + HIGH_LEN))
+    if attr is None:
+        return None
+
+    quote, value = attr
+    gt = page.next_gt(value[1] + 1 if quoted else value[1])
+    if gt is None:
+        return None
+
+    end = page.positions(RE_HIGH_END).next(gt + 1)
+    if end is None:
+        return None
+
+    if quoted:
+        assert quote
+        return TagMatch(
+            page.text,
+            "HIGH",
+            {
+                "HIGH": (start, end[1]),
+                "start_high": (start, gt + 1),
+                "attr_quote": quote,
+                "hl_lang": value,
+                "end_high": end,
+            },
+        )
+
+    return TagMatch(
+        page.text,
+        "HIGH_NQ",
+        {
+            "HIGH_NQ": (start, end[1]),
+            "start_high_nq": (start, gt + 1),
+            "hl_lang_nq": value,
+            "end_high_nq": end,
+        },
+    )
+
+
+def _bare_high(page: _Page, start: int) -> Optional[TagMatch]:
+    tag = RE_BARE_HIGH_START.match(page.text, start)
+    if not tag:
+        return None
+
+    end = page.positions(RE_HIGH_END).next(tag.end())
+    if end is None:
+        return None
+
+    return TagMatch(
+        page.text,
+        "BAREHIGH",
+        {
+            "BAREHIGH": (start, end[1]),
+            "start_bare_high": tag.span(),
+            "end_bare_high": end,
+        },
+    )
+
+
+def _start_high(page: _Page, start: int) -> Optional[TagMatch]:
+    """STARTHIGH.
+
+    `\\s+.+?` must consume at least one character after the whitespace, so
+    attributes after the first non-space character are tried first. Only
+    then does the engine backtrack into the whitespace, which lets an
+    attribute start at the first non-space character, but only if there
+    was more than one whitespace character.
+    """
+    if not page.is_whitespace(start + HIGH_LEN):
+        return None
+
+    after_space = page.skip_whitespace(start + HIGH_LEN)
+    attrs = page.attributes(RE_ATTR_MAYBE_QUOTED)
+    attr = attrs.next(after_space + 1)
+    match = _start_high_match(page, start, attr)
+
+    if match is None and after_space - (start + HIGH_LEN) >= 2:
+        match = _start_high_match(page, start, attrs.at(after_space))
+
+    return match
+
+
+def _start_high_match(
+    page: _Page,
+    start: int,
+    attr: Optional[Tuple[Optional[Span], Span]],
+) -> Optional[TagMatch]:
+    if attr is None:
+        return None
+
+    quote, value = attr
+    assert quote
+    gt = page.next_gt(value[1] + (quote[1] - quote[0]))
+    if gt is None:
+        return None
+
+    return TagMatch(
+        page.text,
+        "STARTHIGH",
+        {
+            "STARTHIGH": (start, gt + 1),
+            "s_attr_quote": quote,
+            "s_hl_lang": value,
+        },
+    )
+
+
+def _lang(page: _Page, start: int) -> Optional[TagMatch]:
+    return (
+        _lang_with_lang(page, start)
+        or _bare(page, start)
+        or _lone_lang(page, start, LANG_LEN)
+    )
+
+
+def _lang_starts(page: _Page, index: int) -> Iterator[int]:
+    """Generate possible starts of the lazy group in `\\s+[^\\n\\r]+?`, in the
+    order the regex engine tries them, from the end of the whitespace at
+    _index_ backwards."""
+    after_space = page.skip_whitespace(index)
+    return iter(range(after_space, index, -1))
+
+
+def _lang_with_lang(page: _Page, start: int) -> Optional[TagMatch]:
+    """LANG.
+
+    For each way of splitting `\\s+` from the lazy group, the group ends at
+    the first `>` it can reach without crossing a line break. If there's no
+    end tag after that `>`, later `>`s won't help, but giving whitespace
+    back to the group might, as the group can then end at an earlier `>`.
+    """
+    if not page.is_whitespace(start + LANG_LEN):
+        return None
+
+    ends = page.positions(RE_LANG_END)
+    tried: Dict[int, Optional[Span]] = {}
+
+    for group_start in _lang_starts(page, start + LANG_LEN):
+        tag_end = page.lazy_tag_end(group_start)
+        if tag_end is None:
+            continue
+
+        group_end, gt = tag_end
+        if gt not in tried:
+            tried[gt] = ends.next(gt + 1)
+
+        end = tried[gt]
+        if end is None:
+            continue
+
+        return TagMatch(
+            page.text,
+            "LANG",
+            {
+                "LANG": (start, end[1]),
+                "start": (start, gt + 1),
+                "lang": (group_start, group_end),
+                "end": end,
+            },
+        )
+
+    return None
+
+
+def _bare(page: _Page, start: int) -> Optional[TagMatch]:
+    tag = RE_BARE_START.match(page.text, start)
+    if not tag:
+        return None
+
+    end = page.positions(RE_LANG_END).next(tag.end())
+    if end is None:
+        return None
+
+    return TagMatch(
+        page.text,
+        "BARE",
+        {
+            "BARE": (start, end[1]),
+            "start_bare": tag.span(),
+            "end_bare": end,
+        },
+    )
+
+
+def _lone_lang(page: _Page, start: int, prefix_len: int) -> Optional[TagMatch]:
+    """LONELANG, where the optional group is tried before skipping it."""
+    index = start + prefix_len
+
+    if page.is_whitespace(index):
+        for group_start in _lang_starts(page, index):
+            tag_end = page.lazy_tag_end(group_start)
+            if tag_end is not None:
+                group_end, gt = tag_end
+                return TagMatch(
+                    page.text,
+                    "LONELANG",
+                    {"LONELANG": (start, gt + 1), "lone_lang": (index, group_end)},
+                )
+
+    gt = page.skip_whitespace(index)
+    if gt < len(page.text) and page.text[gt] == ">":
+        return TagMatch(page.text, "LONELANG", {"LONELANG": (start, gt + 1)})
+
+    return None
+
+
+def _end_lang(page: _Page, start: int) -> Optional[TagMatch]:
+    return _lone_lang(page, start, END_LANG_LEN)
+
+
+_MATCHERS: Dict[str, Callable[[_Page, int], Optional[TagMatch]]] = {
+    "lang": _lang,
+    "end_lang": _end_lang,
+    "high": _high,
+}
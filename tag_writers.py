@@ -0,0 +1,334 @@
+import abc
+import csv
+import json
+import logging
+import os
+import sqlite3
+
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import TextIO
+from typing import Tuple
+from typing import TypeVar
+
+try:
+    import pyarrow  # type: ignore
+    import pyarrow.parquet  # type: ignore
+except ImportError:  # pragma: no cover
+    pyarrow = None
+
+
+PAGE_FIELDS = (
+    "page_id",
+    "page_title",
+    "revision_id",
+    "revision_timestamp",
+)
+
+# Writers are given page rows with these fields. CSV output leaves out the
+# namespace, for compatibility with earlier versions.
+PAGE_COLUMNS = PAGE_FIELDS + ("ns",)
+
+TAG_FIELDS = (
+    "lang",
+    "tag",
+    "start_lineno",
+    "end_lineno",
+    "unsupported_lang",
+    "orphaned",
+    "start",
+    "end",
+    "start_start_index",
+    "start_end_index",
+    "end_start_index",
+    "end_end_index",
+    "kind",
+)
+
+PageRow = Tuple[Any, ...]
+TagRow = Tuple[Any, ...]
+Batch = List[Tuple[PageRow, List[TagRow]]]
+
+W = TypeVar("W", bound="TagWriter")
+
+
+class TagWriter(abc.ABC):
+    """Base class for output formats.
+
+    Rows are buffered and handed to `write_batch`, which subclasses must
+    implement, _batch_size_ pages at a time. Call `close` when done, or use
+    the writer as a context manager, to write the last batch.
+    """
+
+    def __init__(self, batch_size: int = 500) -> None:
+        self.batch_size = batch_size
+        self._batch: Batch = []
+
+    def write(self, page: PageRow, tags: List[TagRow]) -> None:
+        """Write a row of page metadata, in PAGE_COLUMNS order, and a row for
+        each of its tags, in TAG_FIELDS order. _tags_ may be empty."""
+        self._batch.append((page, tags))
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._batch:
+            self.write_batch(self._batch)
+            self._batch = []
+
+    @abc.abstractmethod
+    def write_batch(self, batch: Batch) -> None:
+        """Write a batch of page rows and their tag rows."""
+
+    def close(self) -> None:
+        self.flush()
+
+    def __enter__(self: W) -> W:
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+
+class CSVWriter(TagWriter):
+    """Write one row per tag, repeating page metadata on every row. Pages
+    without tags are not written. _out_file_ is not closed."""
+
+    def __init__(
+        self,
+        out_file: TextIO,
+        *,
+        header: bool = True,
+        batch_size: int = 500,
+    ) -> None:
+        super().__init__(batch_size)
+        self._writer = csv.writer(out_file, quoting=csv.QUOTE_ALL)
+        if header:
+            self._writer.writerow(PAGE_FIELDS + TAG_FIELDS)
+
+    def write_batch(self, batch: Batch) -> None:
+        fields = len(PAGE_FIELDS)
+        self._writer.writerows(
+            page[:fields] + tag for page, tags in batch for tag in tags
+        )
+
+
+class JSONLinesWriter(TagWriter):
+    """Write one JSON object per page, with its tags in a list. Pages without
+    tags are written too. _out_file_ is not closed."""
+
+    def __init__(self, out_file: TextIO, *, batch_size: int = 500) -> None:
+        super().__init__(batch_size)
+        self.out_file = out_file
+
+    def write_batch(self, batch: Batch) -> None:
+        self.out_file.write(
+            "".join(
+                json.dumps(
+                    {
+                        **dict(zip(PAGE_COLUMNS, page)),
+                        "tags": [dict(zip(TAG_FIELDS, tag)) for tag in tags],
+                    },
+                    ensure_ascii=False,
+                )
+                + "\n"
+                for page, tags in batch
+            )
+        )
+
+
+SQLITE_SCHEMA = """\
+CREATE TABLE IF NOT EXISTS pages (
+    page_id INTEGER PRIMARY KEY,
+    page_title TEXT NOT NULL,
+    revision_id INTEGER NOT NULL,
+    revision_timestamp TEXT NOT NULL,
+    ns INTEGER,
+    scanner_version TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tags (
+    page_id INTEGER NOT NULL REFERENCES pages (page_id),
+    lang TEXT,
+    tag TEXT NOT NULL,
+    start_lineno INTEGER NOT NULL,
+    end_lineno INTEGER,
+    unsupported_lang INTEGER NOT NULL,
+    orphaned INTEGER NOT NULL,
+    start TEXT NOT NULL,
+    "end" TEXT,
+    start_start_index INTEGER NOT NULL,
+    start_end_index INTEGER NOT NULL,
+    end_start_index INTEGER,
+    end_end_index INTEGER,
+    kind TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pages_revision_id ON pages (revision_id);
+CREATE INDEX IF NOT EXISTS pages_ns ON pages (ns);
+CREATE INDEX IF NOT EXISTS tags_page_id ON tags (page_id);
+CREATE INDEX IF NOT EXISTS tags_kind ON tags (kind);
+CREATE INDEX IF NOT EXISTS tags_lang ON tags (lang COLLATE NOCASE);
+"""
+
+# SQLite's default limit on the number of parameters in a statement.
+SQLITE_MAX_VARIABLES = 999
+
+
+class SQLiteWriter(TagWriter):
+    """Write page metadata to a `pages` table and tags to a `tags` table,
+    keyed by page id, in an SQLite database at _path_.
+
+    Each batch is written in one transaction. Pages that are already in the
+    database are updated in place, but their tags are only rewritten if the
+    revision id or _scanner_version_ has changed, so repeated and incremental
+    runs can share a database.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        scanner_version: str = "",
+        batch_size: int = 1000,
+    ) -> None:
+        super().__init__(batch_size)
+        self.path = path
+        self.scanner_version = scanner_version
+        self.written = 0
+        self.unchanged = 0
+        self._db = sqlite3.connect(path)
+        self._db.executescript(SQLITE_SCHEMA)
+
+    def write_batch(self, batch: Batch) -> None:
+        stored = self._stored_revisions([page[0] for page, _ in batch])
+        changed = [
+            (page, tags)
+            for page, tags in batch
+            if stored.get(page[0]) != (page[2], self.scanner_version)
+        ]
+        self.written += len(changed)
+        self.unchanged += len(batch) - len(changed)
+
+        with self._db:
+            # Titles and timestamps can change without a new revision, when
+            # a page is moved or a null edit is made.
+            self._db.executemany(
+                "INSERT INTO pages VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (page_id) DO UPDATE SET "
+                "page_title = excluded.page_title, "
+                "revision_id = excluded.revision_id, "
+                "revision_timestamp = excluded.revision_timestamp, "
+                "ns = excluded.ns, "
+                "scanner_version = excluded.scanner_version",
+                (page + (self.scanner_version,) for page, _ in batch),
+            )
+            self._db.executemany(
+                "DELETE FROM tags WHERE page_id = ?",
+                ((page[0],) for page, _ in changed),
+            )
+            self._db.executemany(
+                "INSERT INTO tags VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                ((page[0],) + tag for page, tags in changed for tag in tags),
+            )
+
+    def delete_pages(self, page_ids: List[int]) -> None:
+        """Remove pages, and their tags, from the database."""
+        with self._db:
+            self._db.executemany(
+                "DELETE FROM tags WHERE page_id = ?",
+                ((page_id,) for page_id in page_ids),
+            )
+            self._db.executemany(
+                "DELETE FROM pages WHERE page_id = ?",
+                ((page_id,) for page_id in page_ids),
+            )
+
+    def close(self) -> None:
+        super().close()
+        logging.debug(
+            "result store: %d pages written, %d unchanged",
+            self.written,
+            self.unchanged,
+        )
+        self._db.close()
+
+    def _stored_revisions(self, page_ids: List[int]) -> Dict[int, Tuple[int, str]]:
+        stored: Dict[int, Tuple[int, str]] = {}
+        for i in range(0, len(page_ids), SQLITE_MAX_VARIABLES):
+            chunk = page_ids[i : i + SQLITE_MAX_VARIABLES]
+            rows = self._db.execute(
+                "SELECT page_id, revision_id, scanner_version FROM pages "
+                f"WHERE page_id IN ({', '.join('?' * len(chunk))})",
+                chunk,
+            )
+            stored.update((row[0], (row[1], row[2])) for row in rows)
+        return stored
+
+
+class ParquetWriter(TagWriter):
+    """Write page metadata to `pages.parquet` and tags to `tags.parquet`,
+    keyed by page id, in the directory at _path_. Each batch is written as
+    a row group. Needs pyarrow."""
+
+    def __init__(self, path: str, *, batch_size: int = 10000) -> None:
+        if pyarrow is None:
+            raise ImportError("the parquet output format needs pyarrow")
+
+        super().__init__(batch_size)
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+        types: Dict[str, Any] = {
+            "page_id": pyarrow.int64(),
+            "revision_id": pyarrow.int64(),
+            "ns": pyarrow.int64(),
+            "start_lineno": pyarrow.int64(),
+            "end_lineno": pyarrow.int64(),
+            "unsupported_lang": pyarrow.bool_(),
+            "orphaned": pyarrow.bool_(),
+            "start_start_index": pyarrow.int64(),
+            "start_end_index": pyarrow.int64(),
+            "end_start_index": pyarrow.int64(),
+            "end_end_index": pyarrow.int64(),
+        }
+
+        def _schema(fields: Tuple[str, ...]) -> Any:
+            return pyarrow.schema(
+                [(name, types.get(name, pyarrow.string())) for name in fields]
+            )
+
+        self._pages = pyarrow.parquet.ParquetWriter(
+            os.path.join(path, "pages.parquet"), _schema(PAGE_COLUMNS)
+        )
+        self._tags = pyarrow.parquet.ParquetWriter(
+            os.path.join(path, "tags.parquet"), _schema(("page_id",) + TAG_FIELDS)
+        )
+
+    def write_batch(self, batch: Batch) -> None:
+        pages = [page for page, _ in batch]
+        tags = [(page[0],) + tag for page, tags in batch for tag in tags]
+        self._pages.write_table(_table(pages, PAGE_COLUMNS, self._pages.schema))
+        self._tags.write_table(
+            _table(tags, ("page_id",) + TAG_FIELDS, self._tags.schema)
+        )
+
+    def close(self) -> None:
+        super().close()
+        self._pages.close()
+        self._tags.close()
+
+
+def _table(rows: List[Tuple[Any, ...]], fields: Tuple[str, ...], schema: Any) -> Any:
+    columns = list(zip(*rows)) if rows else [()] * len(fields)
+    return pyarrow.table(
+        {name: list(column) for name, column in zip(fields, columns)},
+        schema=schema,
+    )
+
+
+def columnar_writer(path: str, *, scanner_version: str = "") -> TagWriter:
+    """Return a ParquetWriter if pyarrow is installed, or an SQLiteWriter
+    otherwise."""
+    if pyarrow is not None:
+        return ParquetWriter(path)
+    return SQLiteWriter(path, scanner_version=scanner_version)
@@ -0,0 +1,337 @@
+"""A stub MediaWiki API, served over HTTP on localhost.
+
+It answers the queries made by `find_bad_lang_tags`, `async_api` and
+`fix_legacy_lang_tags`, with the continuation and truncation behaviour of
+the real API, for a handful of pages held in memory.
+"""
+
+import json
+import re
+import threading
+
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from urllib.parse import parse_qsl
+from urllib.parse import urlsplit
+
+TRUNCATED_WARNING = {
+    "result": {
+        "warnings": "This result was truncated because it would otherwise "
+        "be larger than the limit."
+    }
+}
+
+MAXLAG_ERROR = {
+    "error": {
+        "code": "maxlag",
+        "info": "Waiting for a database server: 6 seconds lagged.",
+    }
+}
+
+
+class StubPage:
+    def __init__(
+        self,
+        pageid: int,
+        title: str,
+        content: str,
+        *,
+        ns: int = 0,
+        revid: Optional[int] = None,
+        categories: Optional[List[str]] = None,
+    ) -> None:
+        self.pageid = pageid
+        self.title = title
+        self.content = content
+        self.ns = ns
+        self.revid = revid or pageid * 100
+        self.timestamp = "2025-01-01T00:00:00Z"
+        self.categories = categories or []
+
+    def unprefixed_title(self) -> str:
+        return self.title.partition(":")[2] if self.ns else self.title
+
+    def revision(self, content: bool) -> Dict[str, Any]:
+        revision: Dict[str, Any] = {"revid": self.revid, "timestamp": self.timestamp}
+        if content:
+            revision["slots"] = {
+                "main": {
+                    "contentmodel": "wikitext",
+                    "contentformat": "text/x-wiki",
+                    "content": self.content,
+                }
+            }
+        return revision
+
+
+class StubWiki:
+    """Serve a MediaWiki API for _pages_ until `close` is called.
+
+    A response with more than _max_content_ characters of page content is
+    truncated, leaving out revisions that don't fit, like MediaWiki does
+    when a response would be too big. Every request's parameters are
+    recorded in `requests`.
+
+    The next _lagged_ requests with a maxlag parameter are refused with a
+    maxlag error, as if the database replicas were lagging.
+    """
+
+    def __init__(self, pages: List[StubPage], *, max_content: int = 1 << 20) -> None:
+        self.pages = {page.pageid: page for page in pages}
+        self.max_content = max_content
+        self.requests: List[Dict[str, str]] = []
+        self.edits: List[Dict[str, str]] = []
+        self.lagged = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        self.url = f"http://127.0.0.1:{self._server.server_port}/w/api.php"
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self) -> "StubWiki":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def edit(self, pageid: int, content: str) -> None:
+        """Save a new revision of a page, as if someone else had edited it."""
+        with self._lock:
+            page = self.pages[pageid]
+            page.content = content
+            page.revid += 1
+
+    def requests_for(self, key: str) -> List[Dict[str, str]]:
+        return [request for request in self.requests if key in request]
+
+    def answer(self, params: Dict[str, str]) -> Any:
+        with self._lock:
+            self.requests.append(params)
+            if self.lagged and "maxlag" in params:
+                self.lagged -= 1
+                return MAXLAG_ERROR
+            if params.get("action") == "edit":
+                return self._edit(params)
+            if params.get("generator") == "allpages":
+                return self._generator(params, "gap", self._allpages(params, "gap"))
+            if params.get("generator") == "categorymembers":
+                return self._generator(params, "gcm", self._members(params))
+            if params.get("list") == "allpages":
+                return self._list_allpages(params)
+            if params.get("list") == "search":
+                return self._search(params)
+            if "pageids" in params or "revids" in params:
+                return self._ids(params)
+            if params.get("curtimestamp"):
+                return {"curtimestamp": "2025-06-01T00:00:00Z"}
+        return {"error": {"code": "badparams", "info": "not stubbed"}}
+
+    def _allpages(self, params: Dict[str, str], prefix: str) -> List[StubPage]:
+        namespace = int(params.get(f"{prefix}namespace", 0))
+        title_prefix = params.get(f"{prefix}prefix", "")
+        start = params.get(f"{prefix}from", "")
+        end = params.get(f"{prefix}to")
+        return sorted(
+            (
+                page
+                for page in self.pages.values()
+                if page.ns == namespace
+                and page.unprefixed_title().startswith(title_prefix)
+                and page.unprefixed_title() >= start
+                and (end is None or page.unprefixed_title() <= end)
+            ),
+            key=lambda page: page.unprefixed_title(),
+        )
+
+    def _members(self, params: Dict[str, str]) -> List[StubPage]:
+        return sorted(
+            (
+                page
+                for page in self.pages.values()
+                if params["gcmtitle"] in page.categories
+            ),
+            key=lambda page: page.title,
+        )
+
+    def _generator(
+        self,
+        params: Dict[str, str],
+        prefix: str,
+        pages: List[StubPage],
+    ) -> Any:
+        """Answer a generator query, continuing from an opaque offset."""
+        rvcontinue = params.get("rvcontinue")
+        if rvcontinue:
+            offset, limit, first = (int(part) for part in rvcontinue.split("|"))
+        else:
+            offset = int(params.get(f"{prefix}continue", 0))
+            limit = int(params[f"{prefix}limit"])
+            first = 0
+
+        batch = sorted(pages[offset : offset + limit], key=lambda page: page.pageid)
+        data = self._revisions(params, batch, first)
+        following = offset + limit
+        if following < len(pages):
+            data.setdefault("continue", {})[f"{prefix}continue"] = str(following)
+            data["continue"]["continue"] = f"{prefix}continue||"
+        if "rvcontinue" in data.get("continue", {}):
+            data["continue"]["rvcontinue"] = f"{offset}|{limit}|" + str(
+                data["continue"]["rvcontinue"]
+            )
+            data["continue"].setdefault("continue", f"{prefix}continue||")
+        return data
+
+    def _revisions(
+        self,
+        params: Dict[str, str],
+        batch: List[StubPage],
+        first: int = 0,
+    ) -> Dict[str, Any]:
+        """Return pages in _batch_, with revisions for those with ids of at
+        least _first_, until the response is too big."""
+        content = "content" in params.get("rvprop", "")
+        size = 0
+        pages: List[Dict[str, Any]] = []
+        rest: Optional[int] = None
+
+        for page in batch:
+            record: Dict[str, Any] = {
+                "pageid": page.pageid,
+                "ns": page.ns,
+                "title": page.title,
+            }
+            if "clcategories" in params and params["clcategories"] in page.categories:
+                record["categories"] = [{"ns": 14, "title": params["clcategories"]}]
+
+            if page.pageid >= first and rest is None:
+                size += len(page.content) if content else 0
+                if size > self.max_content and any(
+                    "revisions" in known for known in pages
+                ):
+                    rest = page.pageid
+                else:
+                    record["revisions"] = [page.revision(content)]
+            pages.append(record)
+
+        data: Dict[str, Any] = {"query": {"pages": pages}}
+        if rest is not None:
+            data["warnings"] = TRUNCATED_WARNING
+            data["continue"] = {"rvcontinue": rest}
+        else:
+            data["batchcomplete"] = True
+        return data
+
+    def _list_allpages(self, params: Dict[str, str]) -> Any:
+        pages = self._allpages(params, "ap")
+        offset = int(params.get("apcontinue", 0))
+        limit = 2
+        data: Dict[str, Any] = {
+            "query": {
+                "allpages": [
+                    {"pageid": page.pageid, "ns": page.ns, "title": page.title}
+                    for page in pages[offset : offset + limit]
+                ]
+            }
+        }
+        if offset + limit < len(pages):
+            data["continue"] = {"apcontinue": str(offset + limit), "continue": "-||"}
+        return data
+
+    def _search(self, params: Dict[str, str]) -> Any:
+        pattern = re.search(r"insource:/(.*)/i", params["srsearch"])
+        assert pattern is not None
+        regex = re.compile(pattern.group(1), re.I)
+        category = re.search(r'incategory:"(.*)"', params["srsearch"])
+        namespace = params.get("srnamespace", "*")
+
+        hits = [
+            page
+            for page in sorted(self.pages.values(), key=lambda page: page.pageid)
+            if regex.search(page.content)
+            and (namespace == "*" or page.ns == int(namespace))
+            and (category is None or f"Category:{category.group(1)}" in page.categories)
+        ]
+
+        offset = int(params.get("sroffset", 0))
+        limit = 2
+        data: Dict[str, Any] = {
+            "query": {
+                "searchinfo": {"totalhits": len(hits)},
+                "search": [
+                    {"ns": page.ns, "title": page.title, "pageid": page.pageid}
+                    for page in hits[offset : offset + limit]
+                ],
+            }
+        }
+        if offset + limit < len(hits):
+            data["continue"] = {"sroffset": offset + limit, "continue": "-||"}
+        return data
+
+    def _ids(self, params: Dict[str, str]) -> Any:
+        if "pageids" in params:
+            ids = [int(_id) for _id in params["pageids"].split("|")]
+            batch = [self.pages[_id] for _id in ids if _id in self.pages]
+            missing = [_id for _id in ids if _id not in self.pages]
+        else:
+            revids = {int(_id) for _id in params["revids"].split("|")}
+            batch = [page for page in self.pages.values() if page.revid in revids]
+            missing = []
+
+        batch.sort(key=lambda page: page.pageid)
+        first = int(params["rvcontinue"]) if "rvcontinue" in params else 0
+        data = self._revisions(params, batch, first)
+        data["query"]["pages"].extend(
+            {"pageid": _id, "missing": True} for _id in missing
+        )
+        return data
+
+    def _edit(self, params: Dict[str, str]) -> Any:
+        self.edits.append(params)
+        page = self.pages[int(params["pageid"])]
+        if int(params["baserevid"]) != page.revid:
+            return {"error": {"code": "editconflict", "info": "Edit conflict."}}
+        if params["text"] == page.content:
+            return {"edit": {"result": "Success", "nochange": True}}
+        page.content = params["text"]
+        page.revid += 1
+        return {"edit": {"result": "Success", "newrevid": page.revid}}
+
+    def _handler(self) -> Callable[..., BaseHTTPRequestHandler]:
+        wiki = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:  # pylint: disable=invalid-name
+                self._reply(dict(parse_qsl(urlsplit(self.path).query)))
+
+            def do_POST(self) -> None:  # pylint: disable=invalid-name
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length).decode("utf-8")
+                self._reply(dict(parse_qsl(body)))
+
+            def _reply(self, params: Dict[str, str]) -> None:
+                answer = wiki.answer(params)
+                body = json.dumps(answer).encode("utf-8")
+                self.send_response(200)
+                if answer is MAXLAG_ERROR:
+                    self.send_header("MediaWiki-API-Error", "maxlag")
+                    self.send_header("Retry-After", "0")
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+        return Handler
@@ -0,0 +1,47 @@
+"""Stand-ins for the MediaWiki API used by the tests."""
+
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+# A tag row, in TAG_FIELDS order, for a `<lang python>` tag.
+TAG_ROW: Tuple[Any, ...] = (
+    "python",
+    "lang",
+    1,
+    1,
+    False,
+    False,
+    "<lang python>",
+    "</lang>",
+    0,
+    13,
+    20,
+    27,
+    "LANG",
+)
+
+
+class CannedResponse:
+    def __init__(self, data: Any) -> None:
+        self.data = data
+
+    def raise_for_status(self) -> None:
+        pass
+
+    def json(self) -> Any:
+        return self.data
+
+
+class ReplaySession:
+    """Answer GET requests with canned responses, in order, recording the
+    parameters of each request."""
+
+    def __init__(self, responses: List[Any]) -> None:
+        self.responses = list(responses)
+        self.requests: List[Dict[str, Any]] = []
+
+    def get(self, url: str, params: Dict[str, Any]) -> CannedResponse:
+        self.requests.append(dict(params))
+        return CannedResponse(self.responses.pop(0))
@@ -0,0 +1,156 @@
+"""Check that `QueryStream` decodes responses however they are split into
+chunks, and that streamed queries match buffered ones."""
+
+import json
+import random
+
+from typing import Any
+from typing import Dict
+from typing import Iterator
+from typing import List
+
+import pytest
+
+from api_stream import QueryStream
+from find_bad_lang_tags import ap_params
+from find_bad_lang_tags import get_session
+from find_bad_lang_tags import query_pages
+from find_bad_lang_tags import stream_pages
+from stub_wiki import StubPage
+from stub_wiki import StubWiki
+
+CONTENT = (
+    '=={{header|C}}==\n<lang c>printf("%s\\n", "tab\\there");</lang>\n'
+    "<!-- Ünïcödé ß İ 日本語 -->\n<lang python>print('😀')</lang>\r\n"
+)
+
+RESPONSES: List[Dict[str, Any]] = [
+    # formatversion=2, with everything around the pages.
+    {
+        "batchcomplete": False,
+        "continue": {"gapcontinue": "Bravo", "continue": "gapcontinue||"},
+        "warnings": {"main": {"warnings": 'Unrecognized "parameter" \\ value.'}},
+        "query": {
+            "normalized": [{"fromencoded": False, "from": "alpha", "to": "Alpha"}],
+            "pages": [
+                {
+                    "pageid": 1,
+                    "ns": 0,
+                    "title": "Alpha",
+                    "revisions": [
+                        {
+                            "revid": 100,
+                            "timestamp": "2025-01-01T00:00:00Z",
+                            "slots": {
+                                "main": {
+                                    "contentmodel": "wikitext",
+                                    "contentformat": "text/x-wiki",
+                                    "content": CONTENT,
+                                }
+                            },
+                        }
+                    ],
+                },
+                {"pageid": 2, "ns": 0, "title": "Ärger", "missing": True},
+                {"pageid": 3, "ns": 0, "title": "Zero", "length": 0, "x": None},
+                {"ns": 0, "title": "<Invalid>", "invalid": True, "n": -1.5e-3},
+            ],
+            "searchinfo": {"totalhits": 12},
+        },
+    },
+    # The legacy format, with pages keyed by page id.
+    {
+        "query": {
+            "pages": {
+                "-1": {"ns": 0, "title": "Nope", "missing": ""},
+                "7": {"pageid": 7, "ns": 0, "title": "Zürich", "nested": [[], {}]},
+            }
+        }
+    },
+    # No pages at all.
+    {"batchcomplete": True, "query": {"pages": []}},
+    {"query": {"pages": {}}},
+    {"error": {"code": "maxlag", "info": "Waiting for 10.0.0.1: 5 seconds lagged"}},
+]
+
+
+def bodies() -> Iterator[bytes]:
+    for response in RESPONSES:
+        yield json.dumps(response, ensure_ascii=False).encode("utf-8")
+        yield json.dumps(response).encode("utf-8")
+        yield json.dumps(response, ensure_ascii=False, indent=2).encode("utf-8")
+
+
+def split(body: bytes, rng: random.Random) -> Iterator[bytes]:
+    start = 0
+    while start < len(body):
+        stop = start + rng.randint(1, 7)
+        yield body[start:stop]
+        start = stop
+
+
+@pytest.mark.parametrize("body", list(bodies()))
+def test_chunked_responses_decode_like_json_loads(body: bytes) -> None:
+    expected = json.loads(body)
+    query = expected.get("query", {})
+    pages = query.pop("pages", [])
+    expected_pages = list(pages.values()) if isinstance(pages, dict) else pages
+
+    # Each seed splits escapes and multibyte characters in different places.
+    for seed in range(20):
+        stream = QueryStream(split(body, random.Random(seed)))
+        assert list(stream.pages()) == expected_pages
+        assert stream.data == expected
+
+
+@pytest.mark.parametrize(
+    "ensure_ascii,encoded",
+    [(False, "😀".encode("utf-8")), (True, b"\\ud83d\\ude00")],
+)
+def test_every_split_of_a_character(ensure_ascii: bool, encoded: bytes) -> None:
+    body = json.dumps(RESPONSES[0], ensure_ascii=ensure_ascii).encode("utf-8")
+    start = body.index(encoded)
+    for cut in range(start, start + len(encoded) + 1):
+        stream = QueryStream([body[:cut], body[cut:]])
+        pages = list(stream.pages())
+        assert pages[0]["revisions"][0]["slots"]["main"]["content"] == CONTENT
+
+
+def test_truncated_response_is_an_error() -> None:
+    body = json.dumps(RESPONSES[0]).encode("utf-8")
+    stream = QueryStream(split(body[:-1], random.Random(0)))
+    with pytest.raises(ValueError):
+        list(stream.pages())
+
+
+def test_stream_pages_matches_query_pages() -> None:
+    pages = [
+        StubPage(i, f"Task {i:02d}", CONTENT if i % 2 else "no tags\n" * 20)
+        for i in range(1, 9)
+    ]
+    # Small enough that every response is truncated.
+    with StubWiki(pages, max_content=250) as wiki:
+        session = get_session()
+        params = ap_params(chunk_size=6)
+
+        expected, expected_continue = query_pages(session, params, url=wiki.url)
+        assert wiki.requests_for("rvcontinue")
+        assert len(expected) == 6
+
+        wiki.requests.clear()
+        streamed = stream_pages(session, params, url=wiki.url)
+        streamed_pages = []
+        while True:
+            try:
+                streamed_pages.append(next(streamed))
+            except StopIteration as done:
+                streamed_continue = done.value
+                break
+
+        assert wiki.requests_for("rvcontinue")
+        assert streamed_continue == expected_continue
+        assert streamed_continue["gapcontinue"] == "6"
+        by_id = {page["pageid"]: page for page in expected}
+        assert len(streamed_pages) == len(expected)
+        for page in streamed_pages:
+            assert page == by_id[page["pageid"]]
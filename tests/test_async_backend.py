@@ -0,0 +1,284 @@
+"""Check that the aiohttp backend gives the same output as the requests
+backend, against a stub MediaWiki API."""
+
+import asyncio
+import contextlib
+import functools
+import io
+
+from typing import Any
+from typing import Callable
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+
+import pytest
+
+from api_scheduler import RequestScheduler
+from find_bad_lang_tags import ap_find_bad_lang_tags
+from find_bad_lang_tags import cm_find_bad_lang_tags
+from find_bad_lang_tags import find_bad_lang_tags
+from find_bad_lang_tags import get_session
+from find_bad_lang_tags import pageids_query
+from find_bad_lang_tags import revids_query
+from find_bad_lang_tags import scan_pages
+from find_bad_lang_tags import to_csv
+from fix_legacy_lang_tags import EditLog
+from fix_legacy_lang_tags import fix_pages
+from stub_wiki import StubPage
+from stub_wiki import StubWiki
+
+pytest.importorskip("aiohttp")
+
+import async_api  # pylint: disable=wrong-import-position
+
+CATEGORY = "Category:Programming Tasks"
+
+
+def stub_pages() -> List[StubPage]:
+    pages = []
+    for i in range(1, 13):
+        content = f"=={{{{header|Python}}}}==\n<lang python>print({i})</lang>\n"
+        if i % 3 == 0:
+            content = "no tags\n" * 40
+        if i % 4 == 0:
+            content += "<syntaxhighlight>\nx\n"
+        pages.append(
+            StubPage(
+                i,
+                f"Task {i:02d}",
+                content,
+                categories=[CATEGORY] if i % 2 else [],
+            )
+        )
+    pages.append(StubPage(99, "Talk:Task 01", "<lang c>x</lang>", ns=1))
+    return pages
+
+
+def csv_rows(tags: Iterable[Any]) -> List[str]:
+    out_file = io.StringIO()
+    to_csv(tags, out_file=out_file)
+    return out_file.getvalue().splitlines()
+
+
+def async_rows(
+    factory: Callable[[Any], Any],
+    scheduler: Optional[RequestScheduler] = None,
+) -> List[str]:
+    pages: Iterator[Any] = async_api.iterate(
+        factory, prefetch_depth=1, scheduler=scheduler
+    )
+    return csv_rows(scan_pages(pages, True, 0))
+
+
+@pytest.fixture(name="wiki")
+def fixture_wiki() -> Iterator[StubWiki]:
+    # Small enough that most responses are truncated.
+    with StubWiki(stub_pages(), max_content=150) as wiki:
+        yield wiki
+
+
+def test_namespace_query(wiki: StubWiki) -> None:
+    expected = csv_rows(
+        ap_find_bad_lang_tags(
+            get_session(),
+            url=wiki.url,
+            namespace=0,
+            chunk_size=3,
+            max_chunk_size=5,
+            page_limit=100,
+        )
+    )
+    assert wiki.requests_for("rvcontinue")
+    assert len(expected) > 5
+
+    wiki.requests.clear()
+    rows = async_rows(
+        lambda session: async_api.ap_query(
+            session,
+            url=wiki.url,
+            namespace=0,
+            chunk_size=3,
+            max_chunk_size=5,
+            limit=100,
+        )
+    )
+    assert wiki.requests_for("rvcontinue")
+    assert rows == expected
+
+
+def test_category_query(wiki: StubWiki) -> None:
+    expected = csv_rows(
+        cm_find_bad_lang_tags(
+            get_session(),
+            CATEGORY,
+            url=wiki.url,
+            chunk_size=2,
+            page_limit=100,
+        )
+    )
+    assert len(expected) > 1
+
+    rows = async_rows(
+        lambda session: async_api.cm_query(
+            session,
+            CATEGORY,
+            url=wiki.url,
+            chunk_size=2,
+            limit=100,
+        )
+    )
+    assert rows == expected
+
+
+def test_sharded_query(wiki: StubWiki) -> None:
+    expected = csv_rows(
+        ap_find_bad_lang_tags(
+            get_session(),
+            url=wiki.url,
+            namespace=0,
+            chunk_size=2,
+            page_limit=100,
+            shards=3,
+        )
+    )
+    assert len(expected) > 5
+
+    rows = async_rows(
+        lambda session: async_api.sharded_ap_query(
+            session,
+            url=wiki.url,
+            namespace=0,
+            chunk_size=2,
+            limit=100,
+            shards=3,
+        )
+    )
+    assert rows == expected
+
+    # Sharding doesn't change which rows are written.
+    unsharded = csv_rows(
+        ap_find_bad_lang_tags(get_session(), url=wiki.url, page_limit=100)
+    )
+    assert sorted(rows) == sorted(unsharded)
+
+
+def test_page_limit(wiki: StubWiki) -> None:
+    expected = csv_rows(
+        ap_find_bad_lang_tags(
+            get_session(),
+            url=wiki.url,
+            chunk_size=2,
+            max_chunk_size=2,
+            page_limit=4,
+        )
+    )
+    rows = async_rows(
+        lambda session: async_api.ap_query(
+            session,
+            url=wiki.url,
+            chunk_size=2,
+            max_chunk_size=2,
+            limit=4,
+        )
+    )
+    assert rows == expected
+    assert 1 < len(rows) < 6
+
+
+def test_maxlag(wiki: StubWiki) -> None:
+    def _query(session: Any) -> Any:
+        return async_api.ap_query(session, url=wiki.url, chunk_size=3, limit=100)
+
+    expected = async_rows(_query)
+    assert not wiki.requests_for("maxlag")
+
+    # Refused requests are retried, like they are with the requests backend.
+    wiki.requests.clear()
+    wiki.lagged = 2
+    rows = async_rows(_query, RequestScheduler(maxlag=5))
+    assert rows == expected
+    assert wiki.lagged == 0
+    assert all(request["maxlag"] == "5" for request in wiki.requests_for("action"))
+
+    wiki.lagged = 2
+    sync_rows = csv_rows(
+        ap_find_bad_lang_tags(
+            get_session(maxlag=5), url=wiki.url, chunk_size=3, page_limit=100
+        )
+    )
+    assert sync_rows == expected
+    assert wiki.lagged == 0
+
+
+def test_pageids_query(wiki: StubWiki) -> None:
+    pageids = [12, 1, 404, 5, 6, 7, 8, 9, 10, 99]
+    expected = list(pageids_query(get_session(), pageids, url=wiki.url, chunk_size=3))
+    assert len(expected) == 9
+
+    wiki.requests.clear()
+    with async_api.BackgroundSession() as reads:
+        pages = reads.pageids_query(pageids, url=wiki.url, chunk_size=3)
+        assert wiki.requests_for("rvcontinue")
+        assert pages == expected
+
+        in_category = reads.pageids_query(
+            pageids, url=wiki.url, chunk_size=3, category=CATEGORY
+        )
+        assert [page["pageid"] for page in in_category] == [1, 5, 7, 9]
+
+
+def test_revids_query(wiki: StubWiki) -> None:
+    revids = [100, 300, 500, 700, 1100]
+    expected = list(revids_query(get_session(), revids, url=wiki.url, chunk_size=2))
+    assert len(expected) == 5
+
+    async def _pages() -> List[Any]:
+        async with contextlib.AsyncExitStack() as stack:
+            session = async_api.AsyncSession()
+            stack.push_async_callback(session.close)
+            return [
+                page
+                async for page in async_api.revids_query(
+                    session, revids, url=wiki.url, chunk_size=2, concurrency=2
+                )
+            ]
+
+    assert asyncio.run(_pages()) == expected
+
+
+def test_fix_pages_refetches_over_a_background_session() -> None:
+    content = "=={{header|Python}}==\n<lang python>print(1)</lang>\n"
+    stub_pages = [StubPage(i, f"Task {i}", content) for i in range(1, 5)]
+    with StubWiki(stub_pages) as wiki:
+        session = get_session()
+        pages = list(pageids_query(session, [1, 2, 3, 4], url=wiki.url))
+        tags = list(find_bad_lang_tags(content, True))
+
+        # Someone else edits every page after it was scanned.
+        for i in range(1, 5):
+            wiki.edit(i, content + "<lang c>x</lang>\n")
+
+        out_file = io.StringIO()
+        with async_api.BackgroundSession(session.scheduler) as reads:
+            counts = fix_pages(
+                session,
+                [(page, tags) for page in pages],
+                url=wiki.url,
+                csrf_token="+\\",
+                start_timestamp="2025-01-01T00:00:00Z",
+                log=EditLog(out_file),
+                workers=4,
+                edits_per_minute=0,
+                fetch_pages=functools.partial(reads.pageids_query, url=wiki.url),
+            )
+
+        assert counts == {"edited": 4}
+        assert len(wiki.edits) == 8
+        for i in range(1, 5):
+            assert wiki.pages[i].content == (
+                "=={{header|Python}}==\n"
+                '<syntaxhighlight lang="python">print(1)</syntaxhighlight>\n'
+                '<syntaxhighlight lang="c">x</syntaxhighlight>\n'
+            )
@@ -0,0 +1,171 @@
+"""Interrupt and resume scans of a stub MediaWiki API."""
+
+import io
+import itertools
+import json
+import os
+
+from typing import Any
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+
+import pytest
+
+from checkpoint import Checkpoint
+from find_bad_lang_tags import ap_find_bad_lang_tags
+from find_bad_lang_tags import get_session
+from find_bad_lang_tags import write_tags
+from stub_wiki import StubPage
+from stub_wiki import StubWiki
+from tag_writers import CSVWriter
+from tag_writers import JSONLinesWriter
+from tag_writers import TagWriter
+
+TARGET = {"namespace": 0}
+
+
+class Interrupted(Exception):
+    pass
+
+
+def stub_pages() -> List[StubPage]:
+    pages = []
+    for i in range(1, 13):
+        content = f"=={{{{header|Python}}}}==\n<lang python>print({i})</lang>\n"
+        if i % 3 == 0:
+            content = "no tags\n"
+        if i % 4 == 0:
+            content += "<syntaxhighlight>\nx\n"
+        pages.append(StubPage(i, f"Task {i:02d}", content))
+    return pages
+
+
+def interrupted(items: Iterable[Any], after: int) -> Iterator[Any]:
+    yield from itertools.islice(items, after)
+    raise Interrupted()
+
+
+def scan(
+    wiki: StubWiki,
+    outfile: str,
+    output_format: str,
+    checkpoint_path: str,
+    *,
+    stop_after: Optional[int] = None,
+    batch_size: int = 500,
+) -> None:
+    """Scan like find_bad_lang_tags.py does with --checkpoint and --resume,
+    raising Interrupted after _stop_after_ pages."""
+    checkpoint = Checkpoint(checkpoint_path, target=TARGET, interval=0)
+    checkpoint.load()
+
+    tags: Iterable[Any] = ap_find_bad_lang_tags(
+        get_session(),
+        url=wiki.url,
+        chunk_size=3,
+        max_chunk_size=3,
+        page_limit=100,
+        checkpoint=checkpoint,
+    )
+    if stop_after is not None:
+        tags = interrupted(tags, stop_after)
+
+    resume = checkpoint.offset is not None
+    if resume:
+        with open(outfile, "r+b") as previous_output:
+            previous_output.truncate(checkpoint.offset)
+
+    with open(outfile, "a" if resume else "w", newline="", encoding="utf-8") as output:
+        checkpoint.out_file = output
+        writer: TagWriter
+        if output_format == "jsonl":
+            writer = JSONLinesWriter(output, batch_size=batch_size)
+        else:
+            writer = CSVWriter(output, header=not resume, batch_size=batch_size)
+        write_tags(tags, writer, checkpoint)
+
+    checkpoint.remove()
+
+
+def read_bytes(path: str) -> bytes:
+    with open(path, "rb") as fd:
+        return fd.read()
+
+
+@pytest.mark.parametrize("output_format", ["csv", "jsonl"])
+def test_resumed_scan_matches_an_uninterrupted_scan(
+    tmp_path: Any, output_format: str
+) -> None:
+    expected_path = str(tmp_path / f"expected.{output_format}")
+    outfile = str(tmp_path / f"tags.{output_format}")
+    checkpoint_path = str(tmp_path / "checkpoint.json")
+
+    with StubWiki(stub_pages()) as wiki:
+        scan(wiki, expected_path, output_format, str(tmp_path / "unused.json"))
+        expected = read_bytes(expected_path)
+        assert expected.count(b"\n") > 8
+
+        # Stop part way through the third batch, with the first page of it
+        # already written to the file.
+        with pytest.raises(Interrupted):
+            scan(
+                wiki,
+                outfile,
+                output_format,
+                checkpoint_path,
+                stop_after=7,
+                batch_size=1,
+            )
+
+        with open(checkpoint_path, encoding="utf-8") as fd:
+            state = json.load(fd)
+        assert state["page_count"] == 6
+        assert state["continue"]["gapcontinue"] == "6"
+        assert os.path.getsize(outfile) > state["offset"]
+        assert read_bytes(outfile) != expected
+
+        wiki.requests.clear()
+        scan(wiki, outfile, output_format, checkpoint_path)
+
+        # Only the pages after the checkpoint are fetched again.
+        assert [request.get("gapcontinue") for request in wiki.requests] == [
+            "6",
+            "9",
+        ]
+        assert read_bytes(outfile) == expected
+        assert not os.path.exists(checkpoint_path)
+
+
+def test_empty_batch_moves_the_checkpoint_on(tmp_path: Any) -> None:
+    path = str(tmp_path / "checkpoint.json")
+    checkpoint = Checkpoint(path, target=TARGET, interval=0)
+    writer = JSONLinesWriter(io.StringIO())
+
+    checkpoint.batch([{"pageid": 1}, {"pageid": 2}], {"gapcontinue": "2"}, 2)
+    # A batch whose pages were all dropped.
+    checkpoint.batch([], {"gapcontinue": "4"}, 4)
+    checkpoint.batch([{"pageid": 5}], None, 5)
+
+    checkpoint.written({"pageid": 1}, writer)
+    assert not os.path.exists(path)
+
+    checkpoint.written({"pageid": 2}, writer)
+    resumed = Checkpoint(path, target=TARGET)
+    assert resumed.load()
+    assert resumed.continue_params == {"gapcontinue": "4"}
+    assert resumed.page_count == 4
+    assert not resumed.done
+
+    checkpoint.written({"pageid": 5}, writer)
+    assert resumed.load()
+    assert resumed.continue_params is None
+    assert resumed.page_count == 5
+    assert resumed.done
+
+    # With no earlier batch waiting to be written, there is nothing to save.
+    checkpoint.batch([], {"gapcontinue": "6"}, 5)
+    checkpoint.written({"pageid": 6}, writer)
+    assert resumed.load()
+    assert resumed.page_count == 5
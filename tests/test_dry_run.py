@@ -0,0 +1,237 @@
+"""Check the changes written by a dry run of the fixer, without a wiki."""
+
+import io
+import json
+import os
+import subprocess
+import sys
+
+from typing import Any
+from typing import Dict
+from typing import List
+
+from find_bad_lang_tags import find_bad_lang_tags
+from fix_legacy_lang_tags import dry_run
+from fix_legacy_lang_tags import unified_diff
+from stub_wiki import StubPage
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PAGE = {"title": "Task", "revisions": [{"revid": 100}]}
+
+OLD_LINES = [f"line {i}" for i in range(10)]
+
+HEADER = "--- Task\trevision 100\n+++ Task\tproposed\n"
+
+
+def diff(changed: List[int], context: int) -> str:
+    new_lines = [
+        line.upper() if i in changed else line for i, line in enumerate(OLD_LINES)
+    ]
+    return "".join(unified_diff(PAGE, OLD_LINES, new_lines, changed, context=context))
+
+
+def test_nearby_changes_share_a_hunk() -> None:
+    # The gap between changes is no more than twice the context, so the
+    # hunks' context would overlap.
+    assert diff([2, 5], context=1) == HEADER + (
+        "@@ -2,6 +2,6 @@\n"
+        " line 1\n"
+        "-line 2\n"
+        "+LINE 2\n"
+        " line 3\n"
+        " line 4\n"
+        "-line 5\n"
+        "+LINE 5\n"
+        " line 6\n"
+    )
+
+
+def test_distant_changes_get_their_own_hunks() -> None:
+    assert diff([2, 6], context=1) == HEADER + (
+        "@@ -2,3 +2,3 @@\n"
+        " line 1\n"
+        "-line 2\n"
+        "+LINE 2\n"
+        " line 3\n"
+        "@@ -6,3 +6,3 @@\n"
+        " line 5\n"
+        "-line 6\n"
+        "+LINE 6\n"
+        " line 7\n"
+    )
+
+
+def test_adjacent_changes_are_one_run() -> None:
+    assert diff([3, 4], context=0) == HEADER + (
+        "@@ -4,2 +4,2 @@\n"  # All the old lines of a run, then the new ones.
+        "-line 3\n"
+        "-line 4\n"
+        "+LINE 3\n"
+        "+LINE 4\n"
+    )
+
+
+def test_context_is_clamped_to_the_page() -> None:
+    assert diff([0, 9], context=2) == HEADER + (
+        "@@ -1,3 +1,3 @@\n"
+        "-line 0\n"
+        "+LINE 0\n"
+        " line 1\n"
+        " line 2\n"
+        "@@ -8,3 +8,3 @@\n"
+        " line 7\n"
+        " line 8\n"
+        "-line 9\n"
+        "+LINE 9\n"
+    )
+
+
+def stub_pages() -> List[StubPage]:
+    return [
+        StubPage(
+            1,
+            "Alpha",
+            "=={{header|Python}}==\n"
+            "<lang python>print(1)</lang>\n"
+            "prose\n"
+            "<LANG C>// ß</lang >\n",
+        ),
+        # No legacy tags.
+        StubPage(2, "Bravo", '<syntaxhighlight lang="c">x</syntaxhighlight>\n'),
+        # The start tag spans a line break.
+        StubPage(3, "Charlie", "<lang c\n>x</lang>\n"),
+        StubPage(4, "Delta", "<lang>x</lang>"),
+    ]
+
+
+def page_tags() -> List[Any]:
+    pages: List[Any] = []
+    for stub in stub_pages():
+        page: Dict[str, Any] = {
+            "pageid": stub.pageid,
+            "ns": stub.ns,
+            "title": stub.title,
+            "revisions": [stub.revision(True)],
+        }
+        pages.append((page, list(find_bad_lang_tags(stub.content, True))))
+    return pages
+
+
+def test_dry_run_unified() -> None:
+    out_file = io.StringIO()
+    counts = dry_run(page_tags(), out_file, context=1)
+
+    assert counts == {"changed": 2, "line-count-changed": 1}
+    assert out_file.getvalue() == (
+        "--- Alpha\trevision 100\n"
+        "+++ Alpha\tproposed\n"
+        "@@ -1,5 +1,5 @@\n"
+        " =={{header|Python}}==\n"
+        "-<lang python>print(1)</lang>\n"
+        '+<syntaxhighlight lang="python">print(1)</syntaxhighlight>\n'
+        " prose\n"
+        "-<LANG C>// ß</lang >\n"
+        '+<syntaxhighlight lang="c">// ß</syntaxhighlight>\n'
+        " \n"
+        "--- Delta\trevision 400\n"
+        "+++ Delta\tproposed\n"
+        "@@ -1,1 +1,1 @@\n"
+        "-<lang>x</lang>\n"
+        "+<syntaxhighlight>x</syntaxhighlight>\n"
+    )
+
+
+def test_dry_run_spans() -> None:
+    out_file = io.StringIO()
+    counts = dry_run(page_tags(), out_file, diff_format="spans")
+
+    assert counts == {"changed": 2, "line-count-changed": 1}
+    # Offsets count characters, not bytes, so "ß" moves the last tag on by one.
+    assert [json.loads(line) for line in out_file.getvalue().splitlines()] == [
+        {
+            "page_id": 1,
+            "page_title": "Alpha",
+            "revision_id": 100,
+            "changes": [
+                {
+                    "lineno": 2,
+                    "start": 22,
+                    "end": 35,
+                    "old": "<lang python>",
+                    "new": '<syntaxhighlight lang="python">',
+                },
+                {
+                    "lineno": 2,
+                    "start": 43,
+                    "end": 50,
+                    "old": "</lang>",
+                    "new": "</syntaxhighlight>",
+                },
+                {
+                    "lineno": 4,
+                    "start": 57,
+                    "end": 65,
+                    "old": "<LANG C>",
+                    "new": '<syntaxhighlight lang="c">',
+                },
+                {
+                    "lineno": 4,
+                    "start": 69,
+                    "end": 77,
+                    "old": "</lang >",
+                    "new": "</syntaxhighlight>",
+                },
+            ],
+        },
+        {
+            "page_id": 4,
+            "page_title": "Delta",
+            "revision_id": 400,
+            "changes": [
+                {
+                    "lineno": 1,
+                    "start": 0,
+                    "end": 6,
+                    "old": "<lang>",
+                    "new": "<syntaxhighlight>",
+                },
+                {
+                    "lineno": 1,
+                    "start": 7,
+                    "end": 14,
+                    "old": "</lang>",
+                    "new": "</syntaxhighlight>",
+                },
+            ],
+        },
+    ]
+
+
+def test_dry_run_from_a_dump(tmp_path: Any) -> None:
+    changes = tmp_path / "changes.diff"
+    result = subprocess.run(
+        [
+            sys.executable,
+            os.path.join(ROOT, "fix_legacy_lang_tags.py"),
+            "--dump",
+            os.path.join(FIXTURES, "dump.xml"),
+            "--namespace=0",
+            f"--dry-run={changes}",
+            "--context=0",
+            "--progress-interval=0",
+        ],
+        capture_output=True,
+        check=True,
+        encoding="utf-8",
+    )
+
+    assert json.loads(result.stdout) == {"changed": 1}
+    assert changes.read_text(encoding="utf-8") == (
+        "--- Alpha\trevision 100\n"
+        "+++ Alpha\tproposed\n"
+        "@@ -2,1 +2,1 @@\n"
+        "-<lang python>print(1)</lang>\n"
+        '+<syntaxhighlight lang="python">print(1)</syntaxhighlight>\n'
+    )
@@ -0,0 +1,66 @@
+"""Edit pages on a stub MediaWiki API."""
+
+import io
+
+from find_bad_lang_tags import find_bad_lang_tags
+from find_bad_lang_tags import get_session
+from find_bad_lang_tags import pageids_query
+from fix_legacy_lang_tags import EditLog
+from fix_legacy_lang_tags import fix_page
+from fix_legacy_lang_tags import fix_pages
+from stub_wiki import StubPage
+from stub_wiki import StubWiki
+
+
+def test_edit_conflict_refetches_and_rescans_the_page() -> None:
+    content = "=={{header|Python}}==\n<lang python>print(1)</lang>\n"
+    with StubWiki([StubPage(1, "Task", content)]) as wiki:
+        session = get_session()
+        page = next(pageids_query(session, [1], url=wiki.url))
+        tags = list(find_bad_lang_tags(content, True))
+
+        # Someone else edits the page after it was scanned.
+        wiki.edit(1, content + "<lang c>x</lang>\n")
+
+        status, details = fix_page(
+            session,
+            page,
+            tags,
+            url=wiki.url,
+            csrf_token="+\\",
+            start_timestamp="2025-01-01T00:00:00Z",
+        )
+
+        assert status == "edited"
+        assert details["attempts"] == 1
+        assert details["refetched_revision_id"] == 101
+        assert details["new_revision_id"] == 102
+        assert [edit["baserevid"] for edit in wiki.edits] == ["100", "101"]
+        assert wiki.pages[1].content == (
+            "=={{header|Python}}==\n"
+            '<syntaxhighlight lang="python">print(1)</syntaxhighlight>\n'
+            '<syntaxhighlight lang="c">x</syntaxhighlight>\n'
+        )
+
+
+def test_pages_without_wiki_text_are_logged_as_errors() -> None:
+    content = "<lang python>print(1)</lang>\n"
+    with StubWiki([StubPage(1, "Task", content)]) as wiki:
+        session = get_session()
+        page = next(pageids_query(session, [1], url=wiki.url))
+        page["revisions"][0]["slots"]["main"]["contentformat"] = "text/plain"
+
+        out_file = io.StringIO()
+        counts = fix_pages(
+            session,
+            [(page, list(find_bad_lang_tags(content, True)))],
+            url=wiki.url,
+            csrf_token="+\\",
+            start_timestamp="2025-01-01T00:00:00Z",
+            log=EditLog(out_file),
+            edits_per_minute=0,
+        )
+
+        assert counts == {"error": 1}
+        assert '"code": "unsupported-content-format"' in out_file.getvalue()
+        assert not wiki.edits
@@ -0,0 +1,82 @@
+import io
+import os
+import sqlite3
+
+from find_bad_lang_tags import CSV_HEADER
+from find_bad_lang_tags import deleted_pages
+from find_bad_lang_tags import merge_csv
+from stubs import ReplaySession
+from stubs import TAG_ROW
+from tag_writers import SQLiteWriter
+
+URL = "https://example.org/w/api.php"
+
+
+def test_deleted_pages_follows_continuation_and_filters_titles() -> None:
+    session = ReplaySession(
+        [
+            {
+                "continue": {"lecontinue": "20250101000000|7", "continue": "-||"},
+                "query": {
+                    "logevents": [
+                        {"ns": 1, "title": "Talk:Alpha", "pageid": 0, "logpage": 5},
+                        {"ns": 1, "title": "Talk:Bravo", "pageid": 0, "logpage": 6},
+                    ]
+                },
+            },
+            {
+                "query": {
+                    "logevents": [
+                        {"ns": 1, "title": "Talk:Alpine", "pageid": 0, "logpage": 3},
+                        # Deleting a page that never existed has no page id.
+                        {"ns": 1, "title": "Talk:Alps", "pageid": 0, "logpage": 0},
+                    ]
+                },
+            },
+        ]
+    )
+
+    pageids = deleted_pages(
+        session,  # type: ignore[arg-type]
+        url=URL,
+        since="2025-01-01T00:00:00Z",
+        namespace=1,
+        prefix="Alp",
+    )
+
+    assert pageids == [3, 5]
+    assert session.requests[0]["leend"] == "2025-01-01T00:00:00Z"
+    assert session.requests[0]["lenamespace"] == 1
+    assert session.requests[1]["lecontinue"] == "20250101000000|7"
+
+
+def test_merge_drops_deleted_pages() -> None:
+    previous = io.StringIO(
+        ",".join(f'"{name}"' for name in CSV_HEADER)
+        + "\n"
+        + '"1","Alpha","10","2025","python","lang"\n'
+        + '"2","Bravo","20","2025","python","lang"\n'
+    )
+    out_file = io.StringIO()
+
+    merge_csv([], previous=previous, replace=[2], out_file=out_file)
+
+    rows = out_file.getvalue().splitlines()
+    assert len(rows) == 2
+    assert rows[1].startswith('"1"')
+
+
+def test_sqlite_writer_deletes_pages(tmp_path: os.PathLike) -> None:
+    path = os.path.join(tmp_path, "results.sqlite")
+
+    with SQLiteWriter(path) as writer:
+        writer.write((1, "Alpha", 10, "2025", 0), [TAG_ROW])
+        writer.write((2, "Bravo", 20, "2025", 0), [TAG_ROW])
+
+    with SQLiteWriter(path) as writer:
+        writer.delete_pages([2])
+
+    db = sqlite3.connect(path)
+    assert db.execute("SELECT page_id FROM pages").fetchall() == [(1,)]
+    assert db.execute("SELECT page_id FROM tags").fetchall() == [(1,)]
+    db.close()
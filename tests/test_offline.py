@@ -0,0 +1,158 @@
+"""Offline tests for the query layer and the XML dump reader, using canned
+API responses and a small fixture dump."""
+
+import io
+import json
+import os
+
+from typing import Any
+from typing import List
+
+from find_bad_lang_tags import AP_QUERY
+from find_bad_lang_tags import AdaptiveChunkSize
+from find_bad_lang_tags import dump_find_bad_lang_tags
+from find_bad_lang_tags import query_batches
+from find_bad_lang_tags import query_pages
+from find_bad_lang_tags import scan_pages
+from find_bad_lang_tags import to_csv
+from mediawiki_dump import dump_query
+from stubs import ReplaySession
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+URL = "https://example.org/w/api.php"
+
+
+# An API response with the same page as the fixture dump.
+ALPHA_RESPONSE = {
+    "batchcomplete": True,
+    "query": {
+        "pages": [
+            {
+                "pageid": 1,
+                "ns": 0,
+                "title": "Alpha",
+                "revisions": [
+                    {
+                        "revid": 100,
+                        "parentid": 99,
+                        "timestamp": "2025-01-01T00:00:00Z",
+                        "slots": {
+                            "main": {
+                                "contentmodel": "wikitext",
+                                "contentformat": "text/x-wiki",
+                                "content": "=={{header|Python}}==\n"
+                                "<lang python>print(1)</lang>\n",
+                            }
+                        },
+                    }
+                ],
+            }
+        ]
+    },
+}
+
+
+def truncated_responses() -> List[Any]:
+    path = os.path.join(FIXTURES, "truncated_responses.json")
+    with open(path, encoding="utf-8") as fd:
+        return json.load(fd)  # type: ignore[no-any-return]
+
+
+def test_query_pages_follows_rvcontinue_after_truncation() -> None:
+    session = ReplaySession(truncated_responses())
+    chunk_size = AdaptiveChunkSize(3)
+    params = {**AP_QUERY, "gaplimit": 3}
+
+    pages, _continue = query_pages(
+        session,  # type: ignore[arg-type]
+        params,
+        url=URL,
+        chunk_size=chunk_size,
+    )
+
+    assert [page["title"] for page in pages] == ["Alpha", "Bravo", "Charlie"]
+    assert [page["revisions"][0]["revid"] for page in pages] == [100, 200, 300]
+    assert _continue == {"gapcontinue": "Delta", "continue": "gapcontinue||"}
+
+    # The second request repeats the first with the revisions continuation.
+    assert len(session.requests) == 2
+    assert session.requests[1] == {
+        **params,
+        "rvcontinue": "3|300",
+        "gapcontinue": "Delta",
+        "continue": "gapcontinue||",
+    }
+
+    # Two pages were returned in full, so the next request asks for two.
+    assert chunk_size.size == 2
+
+
+def test_query_batches_shrinks_requests_after_truncation() -> None:
+    final = {"batchcomplete": True, "query": {"pages": []}}
+    session = ReplaySession(truncated_responses() + [final])
+    params = {**AP_QUERY, "gaplimit": 3}
+
+    batches = query_batches(
+        session,  # type: ignore[arg-type]
+        params,
+        url=URL,
+        continue_key="gapcontinue",
+        limit=10,
+        limit_key="gaplimit",
+    )
+
+    assert [len(list(batch)) for batch in batches] == [3, 0]
+    assert session.requests[0]["gaplimit"] == 3
+    assert session.requests[2]["gaplimit"] == 2
+    assert session.requests[2]["gapcontinue"] == "Delta"
+    assert "rvcontinue" not in session.requests[2]
+
+
+def test_dump_query_filters_pages() -> None:
+    path = os.path.join(FIXTURES, "dump.xml")
+
+    pages = list(dump_query(path, namespace=0))
+    assert [page["title"] for page in pages] == ["Alpha", "Bravo"]
+    assert pages[0] == {
+        "pageid": 1,
+        "ns": 0,
+        "title": "Alpha",
+        "revisions": [
+            {
+                "revid": 100,
+                "parentid": 99,
+                "timestamp": "2025-01-01T00:00:00Z",
+                "slots": {
+                    "main": {
+                        "contentmodel": "wikitext",
+                        "contentformat": "text/x-wiki",
+                        "content": "=={{header|Python}}==\n"
+                        "<lang python>print(1)</lang>\n",
+                    }
+                },
+            }
+        ],
+    }
+
+    # Prefixes are matched without the namespace.
+    pages = list(dump_query(path, prefix="Alp"))
+    assert [page["title"] for page in pages] == ["Alpha", "Talk:Alpha"]
+
+
+def test_dump_matches_api_output() -> None:
+    dump_csv = io.StringIO()
+    to_csv(
+        dump_find_bad_lang_tags(os.path.join(FIXTURES, "dump.xml"), namespace=0),
+        out_file=dump_csv,
+    )
+
+    session = ReplaySession([ALPHA_RESPONSE])
+    api_pages, _ = query_pages(session, {**AP_QUERY}, url=URL)  # type: ignore[arg-type]
+
+    api_csv = io.StringIO()
+    to_csv(scan_pages(api_pages, True, 0), out_file=api_csv)
+
+    dump_rows = dump_csv.getvalue().splitlines()
+    assert len(dump_rows) == 2
+    assert '"lang"' in dump_rows[1]
+    assert dump_rows == api_csv.getvalue().splitlines()
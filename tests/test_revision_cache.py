@@ -0,0 +1,50 @@
+import os
+
+from revision_cache import RevisionCache
+
+
+def slot(content: str) -> dict:
+    return {
+        "contentmodel": "wikitext",
+        "contentformat": "text/x-wiki",
+        "content": content,
+    }
+
+
+def last_used(path: str) -> dict:
+    cache = RevisionCache(path)
+    rows = cache._db.execute("SELECT page_id, last_used FROM revisions").fetchall()
+    cache.close()
+    return dict(rows)
+
+
+def test_hits_are_written_with_the_next_commit(tmp_path: os.PathLike) -> None:
+    path = os.path.join(tmp_path, "cache.sqlite")
+    cache = RevisionCache(path)
+    cache.put(1, 10, slot("a"))
+    cache.put(2, 20, slot("b"))
+    cache.commit()
+    before = last_used(path)
+
+    assert cache.get(1, 10) == slot("a")
+    assert last_used(path) == before
+
+    cache.commit()
+    after = last_used(path)
+    assert after[1] > after[2]
+    cache.close()
+
+
+def test_evicts_least_recently_used(tmp_path: os.PathLike) -> None:
+    path = os.path.join(tmp_path, "cache.sqlite")
+    cache = RevisionCache(path, max_bytes=2)
+    cache.put(1, 10, slot("a"))
+    cache.put(2, 20, slot("b"))
+    assert cache.get(1, 10) is not None
+
+    # The hit on page 1 hasn't been committed, but still counts.
+    cache.put(3, 30, slot("c"))
+    assert cache.get(2, 20) is None
+    assert cache.get(1, 10) is not None
+    assert cache.get(3, 30) is not None
+    cache.close()
@@ -0,0 +1,55 @@
+"""Check the search prescreen against a full scan of a stub MediaWiki API."""
+
+import io
+
+from typing import Any
+from typing import Iterable
+from typing import List
+
+from find_bad_lang_tags import ap_find_bad_lang_tags
+from find_bad_lang_tags import get_session
+from find_bad_lang_tags import pageids_find_bad_lang_tags
+from find_bad_lang_tags import search_candidates
+from find_bad_lang_tags import to_csv
+from stub_wiki import StubPage
+from stub_wiki import StubWiki
+
+
+def stub_pages() -> List[StubPage]:
+    return [
+        StubPage(1, "Alpha", "<lang python>print(1)</lang>\n"),
+        StubPage(2, "Bravo", "no tags here\n"),
+        StubPage(3, "Charlie", "<syntaxhighlight>\nx\n"),
+        # Mentions lang tags without having any.
+        StubPage(4, "Delta", "Uses the lang attribute, but not </langs>.\n"),
+        StubPage(5, "Echo", '<syntaxhighlight lang="c">x</syntaxhighlight>\n'),
+        StubPage(6, "Foxtrot", "<LANG c>x</LANG>\n<lang>y</lang>\n"),
+        StubPage(7, "Golf", "plain text\n"),
+        StubPage(99, "Talk:Alpha", "<lang c>x</lang>\n", ns=1),
+    ]
+
+
+def csv_rows(tags: Iterable[Any]) -> List[str]:
+    out_file = io.StringIO()
+    to_csv(tags, out_file=out_file)
+    return out_file.getvalue().splitlines()
+
+
+def test_search_candidates_match_a_full_scan() -> None:
+    with StubWiki(stub_pages()) as wiki:
+        session = get_session()
+        scanned = list(
+            ap_find_bad_lang_tags(session, url=wiki.url, namespace=0, page_limit=100)
+        )
+        assert len(scanned) == 7
+        matched = {page["pageid"] for page, tags in scanned if tags}
+
+        candidates = search_candidates(session, url=wiki.url, namespace=0)
+        assert wiki.requests_for("sroffset")
+        assert set(candidates) >= matched
+        assert set(candidates) > matched
+        assert 99 not in candidates
+
+        rows = csv_rows(pageids_find_bad_lang_tags(session, candidates, url=wiki.url))
+        assert len(rows) > 1
+        assert rows == csv_rows(scanned)
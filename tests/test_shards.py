@@ -0,0 +1,47 @@
+"""Check the title ranges used to shard namespace scans, against a stub
+MediaWiki API."""
+
+from typing import List
+from typing import Tuple
+
+from find_bad_lang_tags import get_session
+from find_bad_lang_tags import title_shards
+from stub_wiki import StubPage
+from stub_wiki import StubWiki
+
+TITLES = [f"Task {i:02d}" for i in range(1, 12)]
+
+
+def covered(ranges: List[Tuple[str, str]], titles: List[str]) -> List[List[str]]:
+    """Return the titles in each inclusive range."""
+    return [
+        [title for title in titles if start <= title <= end] for start, end in ranges
+    ]
+
+
+def test_shards_are_contiguous_and_cover_every_page() -> None:
+    pages = [StubPage(i, title, "") for i, title in enumerate(TITLES, 1)]
+    pages.append(StubPage(99, "Talk:Task 01", "", ns=1))
+
+    with StubWiki(pages) as wiki:
+        for shards in (1, 3, 4, 11, 20):
+            ranges = title_shards(get_session(), url=wiki.url, shards=shards)
+            assert len(ranges) == min(shards, len(TITLES))
+
+            in_ranges = covered(ranges, TITLES)
+            assert all(in_ranges)
+            assert sum(in_ranges, []) == TITLES
+            # No gaps or overlaps between neighbouring ranges.
+            for (_, end), (start, _) in zip(ranges, ranges[1:]):
+                assert TITLES.index(start) == TITLES.index(end) + 1
+
+
+def test_listing_stops_at_the_page_limit() -> None:
+    pages = [StubPage(i, title, "") for i, title in enumerate(TITLES, 1)]
+
+    with StubWiki(pages) as wiki:
+        ranges = title_shards(get_session(), url=wiki.url, shards=2, limit=3)
+        assert sum(covered(ranges, TITLES), []) == TITLES[:3]
+        # The stub lists two titles per request.
+        assert len(wiki.requests_for("list")) == 2
+        assert all(request["aplimit"] == "3" for request in wiki.requests_for("list"))
@@ -0,0 +1,299 @@
+"""Check that `tag_scanner.scan_tags` matches exactly what `RE_BAD_LANG`
+matches, so the two engines can't drift apart when `RE_SPEC` changes, and
+that scanning only the window given by `tag_window` finds the same tags as
+scanning whole pages."""
+
+import random
+import time
+
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import pytest
+
+import find_bad_lang_tags as module
+from find_bad_lang_tags import RE_BAD_LANG
+from find_bad_lang_tags import find_bad_lang_tags
+from tag_scanner import ScanStats
+from tag_scanner import scan_tags
+from tag_scanner import tag_window
+
+# Pieces of tags, attributes and skip regions, joined at random to make
+# pages that exercise every RE_SPEC alternative and how they fail.
+FRAGMENTS = [
+    "<lang",
+    "<lang python>",
+    "<LANG C>",
+    "<Lang ",
+    "<lang>",
+    "</lang>",
+    "</lang >",
+    "</LANG>",
+    "<syntaxhighlight",
+    "<SyntaxHighlight",
+    "<syntaxhighlight>",
+    "</syntaxhighlight>",
+    "</syntaxhighlight >",
+    "</SYNTAXHIGHLIGHT>",
+    'lang="c"',
+    "lang='c'",
+    'lang="c',
+    "lang='c\"",
+    "lang=c",
+    " lang = py ",
+    "line",
+    "<nowiki>",
+    "</nowiki>",
+    "<!--",
+    "-->",
+    "<pre>",
+    "</pre>",
+    "<code>",
+    "</code>",
+    "<",
+    ">",
+    "=",
+    '"',
+    "'",
+    " ",
+    "\n",
+    "x",
+    "ß",
+    "İ",
+]
+
+EDGE_CASES = [
+    "",
+    "no tags at all",
+    # Unterminated start tags.
+    "<lang python>print(1)",
+    "<lang",
+    "<lang python",
+    "<syntaxhighlight",
+    '<syntaxhighlight lang="python">x = 1',
+    "<syntaxhighlight lang=python>x = 1",
+    "<syntaxhighlight>x = 1",
+    "<lang python>a\n<lang c>b\n<syntaxhighlight lang=j>c\n",
+    "</lang> without a start",
+    "</syntaxhighlight> without a start",
+    # Skip regions, nested and unterminated.
+    "<nowiki><lang python>x</lang></nowiki>",
+    "<nowiki><!-- <lang c>x</lang> --></nowiki><lang j>y</lang>",
+    "<!-- <nowiki> --> <lang c>x</lang> </nowiki>",
+    "<pre><code><lang c>x</lang></code></pre>",
+    "<code><pre></code><lang c>x</lang></pre>",
+    "<!-- <lang python>x</lang>",
+    "<nowiki><lang python>x</lang>",
+    "<pre ><lang c>x</lang></pre >",
+    # Mismatched and missing quotes.
+    "<syntaxhighlight lang=\"c'>x</syntaxhighlight>",
+    "<syntaxhighlight lang='c\">x</syntaxhighlight>",
+    '<syntaxhighlight lang="c>x</syntaxhighlight>',
+    '<syntaxhighlight lang="">x</syntaxhighlight>',
+    '<syntaxhighlight line lang="c" highlight="2">x</syntaxhighlight>',
+    "<syntaxhighlight lang = c >x</syntaxhighlight>",
+    # Case variants.
+    "<LANG Python>x</LANG>",
+    "<Lang>x</lAnG >",
+    '<SYNTAXHIGHLIGHT LANG="C">x</syntaxHighlight>',
+    "<lang c>x</syntaxhighlight>",
+    '<syntaxhighlight lang="c">x</lang>',
+    # Case folding that changes the length of the text.
+    "ß<lang c>İ</lang>ß",
+]
+
+
+def random_pages(seed: int, count: int) -> List[str]:
+    rng = random.Random(seed)
+    return [
+        "".join(rng.choice(FRAGMENTS) for _ in range(rng.randint(1, 30)))
+        for _ in range(count)
+    ]
+
+
+CORPUS = EDGE_CASES + random_pages(42, 3000)
+
+
+def spans(matches: Iterable[Any]) -> List[Tuple[int, int, str, Dict[str, Any]]]:
+    """Return the span, kind and the span of every matched group of each
+    match."""
+    return [
+        (
+            match.start(),
+            match.end(),
+            match.lastgroup,
+            {
+                name: match.span(name)
+                for name, value in match.groupdict().items()
+                if value is not None
+            },
+        )
+        for match in matches
+    ]
+
+
+@pytest.mark.parametrize("text", EDGE_CASES)
+def test_scan_tags_matches_the_regex_on_edge_cases(text: str) -> None:
+    assert spans(scan_tags(text)) == spans(RE_BAD_LANG.finditer(text))
+
+
+def test_scan_tags_matches_the_regex_on_random_pages() -> None:
+    for text in CORPUS:
+        assert spans(scan_tags(text)) == spans(RE_BAD_LANG.finditer(text)), text
+
+
+def test_engines_find_the_same_tags() -> None:
+    for text in CORPUS:
+        for skip_unsupported_langs in (False, True):
+            tokens = [
+                tag.as_tuple()
+                for tag in find_bad_lang_tags(
+                    text, skip_unsupported_langs, engine="tokens"
+                )
+            ]
+            regex = [
+                tag.as_tuple()
+                for tag in find_bad_lang_tags(
+                    text, skip_unsupported_langs, engine="regex"
+                )
+            ]
+            assert tokens == regex, text
+
+
+def _seconds_to_scan(text: str) -> float:
+    best = float("inf")
+    for _ in range(3):
+        started = time.perf_counter()
+        list(find_bad_lang_tags(text))
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def test_unterminated_tags_scan_in_linear_time() -> None:
+    unit = "<lang python>\nint main() { return a < b; }\n"
+    small = unit * (20_000 // len(unit))
+    large = unit * (200_000 // len(unit))
+
+    # Ten times the text. Quadratic scanning would take about a hundred
+    # times as long.
+    assert _seconds_to_scan(large) < 40 * _seconds_to_scan(small)
+
+
+WINDOW_CASES = [
+    # A skip region opening before the first tag literal hides a tag.
+    "intro <nowiki>a <lang c>x</lang> b</nowiki> <lang python>y</lang>",
+    "intro <!-- <lang c>x</lang> --> <lang python>y</lang> outro",
+    "intro <pre>\n<lang c>x</lang></pre><syntaxhighlight>z",
+    "intro <code ><lang c>x</lang></code ><lang j>y</lang>",
+    # Unterminated skip regions hide nothing.
+    "intro <nowiki> <lang python>y</lang>",
+    # Skip regions after the last tag literal.
+    "<lang c>x</lang> <nowiki>a</nowiki> <!-- b --> <pre>c</pre>",
+    # Case folding lengthens "ß" and "İ", so the window is found without
+    # the folded text.
+    "ßßß <LANG c>x</lang> İ <nowiki><lang j>y</lang></nowiki> ß",
+    "İ <!-- ß --> <Lang python>y</LANG> <SyntaxHighlight lang=c>z",
+    "ß <!-- <lang c>x</lang> --> ß",
+    "ß<lang",
+    "ß</syntaxhighlight>ß",
+    "</lang>ß",
+    # Tag literals that don't start a tag.
+    "ßßß İ <langs",
+    # A long s case folds to "s".
+    "<ſyntaxhighlight lang=c>x</syntaxhighlight>",
+    "ß <ſyntaxhighlight lang=c>x</syntaxhighlight>",
+]
+
+# Pages without tag literals, which are ruled out before scanning.
+NO_CANDIDATES = [
+    "",
+    "plain text",
+    "the lang attribute of syntaxhighlight",
+    "<nowiki>x</nowiki> <!-- y --> <pre>z</pre>",
+    "< lang c>x< /lang>",
+    "ßßß İ < lang",
+]
+
+
+def tag_tuples(
+    text: str,
+    engine: str = "regex",
+    stats: Optional[ScanStats] = None,
+) -> List[Tuple[Any, ...]]:
+    return [
+        tag.as_tuple() for tag in find_bad_lang_tags(text, engine=engine, stats=stats)
+    ]
+
+
+def unwindowed(text: str, monkeypatch: Any) -> List[Tuple[Any, ...]]:
+    """Return the tags found by the regex engine scanning all of _text_."""
+    with monkeypatch.context() as patch:
+        patch.setattr(module, "tag_window", lambda text, stats: (0, len(text)))
+        return tag_tuples(text)
+
+
+@pytest.mark.parametrize("text", WINDOW_CASES)
+def test_windowed_scans_match_unwindowed_scans(text: str, monkeypatch: Any) -> None:
+    expected = unwindowed(text, monkeypatch)
+    assert tag_tuples(text) == expected
+    assert tag_tuples(text, engine="tokens") == expected
+
+
+def test_windowed_scans_match_unwindowed_scans_on_random_pages(
+    monkeypatch: Any,
+) -> None:
+    for text in CORPUS:
+        expected = unwindowed(text, monkeypatch)
+        assert tag_tuples(text) == expected, text
+        assert tag_tuples(text, engine="tokens") == expected, text
+
+
+def test_window_starts_at_a_skip_region_hiding_a_tag() -> None:
+    text = WINDOW_CASES[0]
+    assert tag_window(text) == (text.index("<nowiki>"), text.rindex("</lang"))
+    assert [tag[0] for tag in tag_tuples(text)] == ["python"]
+
+
+def test_window_without_the_folded_text() -> None:
+    text = "ßßß <LANG c>x</lang> İ ß"
+    assert len(text.casefold()) != len(text)
+    assert tag_window(text) == (text.index("<LANG"), text.index("</lang"))
+
+
+def test_matches_after_the_window_are_not_classified() -> None:
+    text = WINDOW_CASES[5]
+    stats = ScanStats()
+    tags = tag_tuples(text, stats=stats)
+
+    assert len(tags) == 1
+    # The trailing skip regions are never reached.
+    assert stats.matches == 1
+    assert len(list(RE_BAD_LANG.finditer(text))) == 4
+
+
+@pytest.mark.parametrize("text", NO_CANDIDATES)
+def test_pages_without_tag_literals_are_ruled_out(text: str) -> None:
+    stats = ScanStats()
+    assert tag_window(text, stats) is None
+    assert stats.pages == 1
+    assert stats.chars == len(text)
+    assert stats.prescreened == 0
+
+    assert tag_tuples(text, stats=stats) == []
+    assert stats.pages == 2
+    assert stats.prescreened == 0
+    assert stats.matches == 0
+
+
+def test_prescreened_pages_are_counted() -> None:
+    stats = ScanStats()
+    for text in NO_CANDIDATES + WINDOW_CASES:
+        tag_tuples(text, stats=stats)
+
+    assert stats.pages == len(NO_CANDIDATES) + len(WINDOW_CASES)
+    assert stats.prescreened == len(WINDOW_CASES)
+    assert 0 < stats.window_chars < stats.chars
@@ -0,0 +1,29 @@
+import io
+
+import pytest
+
+from stubs import TAG_ROW
+from tag_writers import CSVWriter
+from tag_writers import TagWriter
+
+
+class IncompleteWriter(TagWriter):
+    pass
+
+
+def test_writers_must_implement_write_batch() -> None:
+    with pytest.raises(TypeError):
+        IncompleteWriter()  # type: ignore[abstract]
+
+
+def test_csv_writer_leaves_out_namespace() -> None:
+    out_file = io.StringIO()
+
+    with CSVWriter(out_file, header=False) as writer:
+        writer.write((1, "Alpha", 10, "2025", 0), [TAG_ROW])
+        writer.write((2, "Bravo", 20, "2025", 0), [])
+
+    assert out_file.getvalue().splitlines() == [
+        '"1","Alpha","10","2025","python","lang","1","1","False","False",'
+        '"<lang python>","</lang>","0","13","20","27","LANG"'
+    ]
@@ -0,0 +1,51 @@
+"""Check the compact tag representations against plain BadLangTags."""
+
+from typing import List
+from typing import Tuple
+
+from find_bad_lang_tags import BadLangTag
+from find_bad_lang_tags import TagBatch
+from find_bad_lang_tags import find_bad_lang_tags
+
+PAGES = {
+    1: (
+        "<lang>x</lang>\n"
+        "<lang ñandú>y</lang>\n"
+        '<syntaxhighlight lang="日本">z</syntaxhighlight>\n'
+        "<lang c>\nnever closed\n"
+    ),
+    2: "text </lang>\n</syntaxhighlight>\n<lang ñandú>again</lang>\n",
+}
+
+
+def test_lazy_text_tags_equal_eager_tags() -> None:
+    for text in PAGES.values():
+        eager = [tag.as_tuple() for tag in find_bad_lang_tags(text)]
+        lazy = list(find_bad_lang_tags(text, lazy_text=True))
+        assert [tag.as_tuple() for tag in lazy] == eager
+        assert all(tag.start.source is text for tag in lazy)
+
+
+def test_tag_batch_round_trip() -> None:
+    batch = TagBatch()
+    expected: List[Tuple[int, str, BadLangTag]] = []
+    for page_id, text in PAGES.items():
+        tags = list(find_bad_lang_tags(text))
+        batch.extend(page_id, tags)
+        expected.extend((page_id, text, tag) for tag in tags)
+
+    kinds = {tag.kind for _, _, tag in expected}
+    langs = {tag.lang for _, _, tag in expected}
+    assert {"BARE", "LONELANG", "ENDHIGH"} <= kinds
+    assert {None, "ñandú", "日本"} <= langs
+    assert any(tag.end is None for _, _, tag in expected)
+
+    assert len(batch) == len(expected)
+    # Languages are stored once, however many tags use them.
+    assert batch.lang_names.count("ñandú") == 1
+
+    for index, (page_id, text, tag) in enumerate(expected):
+        assert batch.page_ids[index] == page_id
+        stored = batch.tag(index, text)
+        assert isinstance(stored, BadLangTag)
+        assert stored.as_tuple() == tag.as_tuple()